@@ -0,0 +1,33 @@
+import pytest
+import tifffile as tif
+
+from napari_u01.data_loader import DataLoaderModel
+
+from profiling import peak_memory_mb
+
+
+@pytest.fixture
+def loader(tmp_path, label_volume):
+    path = str(tmp_path / 'labels.tif')
+    tif.imwrite(path, label_volume)
+    model = DataLoaderModel()
+    model.config = {'data': {
+        'images': [{'name': 'image', 'path': path}],
+        'labels': [{'name': 'labels', 'path': path, 'color': None}]}}
+    return model
+
+
+@pytest.mark.parametrize('lazy', [False, True], ids=['eager', 'lazy'])
+def bench_load_labels(benchmark, loader, lazy):
+    loader.config['data']['lazy'] = lazy
+    benchmark.extra_info['peak_memory_mb'] = peak_memory_mb(
+        loader.load_labels)
+    benchmark.pedantic(loader.load_labels, rounds=3, iterations=1)
+
+
+@pytest.mark.parametrize('lazy', [False, True], ids=['eager', 'lazy'])
+def bench_load_images(benchmark, loader, lazy):
+    loader.config['data']['lazy'] = lazy
+    benchmark.extra_info['peak_memory_mb'] = peak_memory_mb(
+        loader.load_images)
+    benchmark.pedantic(loader.load_images, rounds=3, iterations=1)
@@ -0,0 +1,40 @@
+import itertools
+
+from napari.layers import Labels
+
+from napari_u01.classification_model import LabelClassificationModel
+from napari_u01.label_index import LabelIndex
+
+from profiling import peak_memory_mb
+from synthetic import split_label_volume
+
+
+def make_class_layers(label_volume):
+    neuron, glia = split_label_volume(label_volume)
+    return [Labels(neuron, name='neuron'), Labels(glia, name='glia')]
+
+
+def bench_model_init(benchmark, config_path, label_volume):
+    # label scan, index, class store and colormaps
+    layers = make_class_layers(label_volume)
+    benchmark.extra_info['peak_memory_mb'] = peak_memory_mb(
+        LabelClassificationModel, layers, config_path)
+    benchmark.pedantic(LabelClassificationModel, args=(layers, config_path),
+                       rounds=3, iterations=1)
+
+
+def bench_label_index(benchmark, label_volume):
+    benchmark.extra_info['peak_memory_mb'] = peak_memory_mb(
+        LabelIndex.from_arrays, [label_volume])
+    benchmark.pedantic(LabelIndex.from_arrays, args=([label_volume],),
+                       rounds=3, iterations=1)
+
+
+def bench_classify_all_labels(benchmark, config_path, label_volume):
+    # one batch update of the class of every label
+    model = LabelClassificationModel(make_class_layers(label_volume),
+                                     config_path)
+    labels = model.class_per_label.labels
+    # move all labels back and forth between the two classes
+    class_names = itertools.cycle(['glia', 'neuron'])
+    benchmark(lambda: model.classify_labels(labels, next(class_names)))
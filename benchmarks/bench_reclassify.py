@@ -0,0 +1,44 @@
+import itertools
+
+import pytest
+
+from napari_u01.classification_widget import LabelClassificationWidget
+
+from synthetic import make_label_volume, split_label_volume
+
+# same number of labels in growing volumes, the latency per click and
+# keypress should not grow with the volume
+SHAPES = [(16, 256, 256), (32, 512, 512), (64, 1024, 1024)]
+
+
+@pytest.fixture(params=SHAPES, ids=lambda shape: 'x'.join(map(str, shape)))
+def widget(request, make_napari_viewer, qtbot, config_path, n_labels):
+    viewer = make_napari_viewer()
+    volume = make_label_volume(request.param, n_labels)
+    neuron, glia = split_label_volume(volume)
+    viewer.add_labels(neuron, name='neuron')
+    viewer.add_labels(glia, name='glia')
+
+    widget = LabelClassificationWidget(viewer)
+    widget.config_textbox.setText(config_path)
+    widget.load_config(viewer)
+    # the model is built in a background worker
+    qtbot.waitUntil(lambda: widget.controller is not None, timeout=60000)
+    return widget
+
+
+def bench_keypress(benchmark, widget):
+    label = int(widget.model.class_per_label.labels[0])
+    widget.controller.model.select_label(label)
+
+    # move the label back and forth between the two classes
+    keys = itertools.cycle(['g', 'n'])
+    benchmark(lambda: widget.controller.on_keyboard_input(next(keys)))
+
+
+def bench_click(benchmark, widget):
+    # click on the centers of labels in turn, picking and highlighting them
+    index = widget.model.label_index
+    centers = itertools.cycle([tuple(int(round(c)) for c in center)
+                               for center in index.centroids[:100]])
+    benchmark(lambda: widget.controller.on_label_selection(next(centers)))
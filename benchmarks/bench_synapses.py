@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from napari_u01.synapse_index import PointGridIndex
+
+from profiling import peak_memory_mb
+
+# the view of a slice should cost the same however large the cloud is
+SIZES = [1_000_000, 10_000_000]
+
+
+def make_synapses(n_points, shape=(100, 4000, 4000)):
+    rng = np.random.default_rng(0)
+    return (rng.random((n_points, 3)) * shape).astype(np.float32)
+
+
+@pytest.fixture(params=SIZES, ids=str)
+def synapses(request):
+    return make_synapses(request.param)
+
+
+def bench_synapse_index(benchmark, synapses):
+    benchmark.extra_info['peak_memory_mb'] = peak_memory_mb(
+        PointGridIndex, synapses)
+    benchmark.pedantic(PointGridIndex, args=(synapses,), rounds=3,
+                       iterations=1)
+
+
+def bench_synapse_slice_view(benchmark, synapses):
+    # one zoomed in slice, as refreshed while panning
+    index = PointGridIndex(synapses)
+    benchmark(index.query, [49.5, 1500, 1500], [50.5, 2500, 2500],
+              1_000_000)
+
+
+def bench_synapse_volume_view(benchmark, synapses):
+    # the whole cloud in 3D, decimated
+    index = PointGridIndex(synapses)
+    benchmark(index.query, [-np.inf] * 3, [np.inf] * 3, 1_000_000)
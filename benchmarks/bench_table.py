@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from napari_u01.classification_view import TableView
+from napari_u01.label_store import LabelClassStore
+
+from profiling import peak_memory_mb
+
+N_ROWS = [10_000, 1_000_000]
+
+
+def make_store(n_labels, seed=0):
+    rng = np.random.default_rng(seed)
+    labels = np.arange(1, n_labels + 1)
+    class_names = ['neuron', 'neuron:excitatory', 'glia']
+    return LabelClassStore(class_names, labels,
+                           rng.integers(0, len(class_names), n_labels))
+
+
+@pytest.mark.parametrize('n_rows', N_ROWS)
+def bench_table_populate(benchmark, qtbot, n_rows):
+    table = TableView()
+    qtbot.addWidget(table)
+    store = make_store(n_rows)
+    benchmark.extra_info['peak_memory_mb'] = peak_memory_mb(
+        table.populate, store)
+    benchmark(table.populate, store)
+
+
+@pytest.mark.parametrize('n_rows', N_ROWS)
+def bench_table_update_label(benchmark, qtbot, n_rows):
+    table = TableView()
+    qtbot.addWidget(table)
+    store = make_store(n_rows)
+    table.populate(store)
+    label = int(store.labels[n_rows // 2])
+    benchmark(table.update_label, label)
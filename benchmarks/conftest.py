@@ -0,0 +1,54 @@
+import os
+
+# headless, no window or GPU needed
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import pytest  # noqa: E402
+import yaml  # noqa: E402
+
+from synthetic import make_label_volume  # noqa: E402
+
+CONFIG = {
+    'classifications': [
+        {'group': 'cell type',
+         'classes': [
+             {'name': 'neuron', 'color': 'magenta', 'key': 'n'},
+             {'name': 'glia', 'color': 'cyan', 'key': 'g'},
+         ]}
+    ],
+    # keep the benchmarks free of file writes
+    'journal': None,
+    'features': None,
+}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('napari-u01 benchmarks')
+    group.addoption('--bench-shape', default='32x512x512',
+                    help='shape of the synthetic label volume, e.g. '
+                         '64x1024x1024')
+    group.addoption('--bench-labels', type=int, default=1000,
+                    help='number of labels in the synthetic volume')
+
+
+@pytest.fixture
+def bench_shape(request):
+    return tuple(int(size) for size in
+                 request.config.getoption('--bench-shape').split('x'))
+
+
+@pytest.fixture
+def n_labels(request):
+    return request.config.getoption('--bench-labels')
+
+
+@pytest.fixture
+def label_volume(bench_shape, n_labels):
+    return make_label_volume(bench_shape, n_labels)
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / 'config.yaml'
+    path.write_text(yaml.safe_dump(CONFIG))
+    return str(path)
@@ -0,0 +1,15 @@
+import tracemalloc
+
+
+def peak_memory_mb(func, *args, **kwargs):
+    """
+    Peak memory allocated while calling func, in MB. numpy reports its
+    array allocations to tracemalloc, so arrays are included.
+    """
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 2 ** 20
@@ -0,0 +1,20 @@
+import numpy as np
+
+
+def make_label_volume(shape, n_labels, label_size=4, seed=0):
+    # non-overlapping cubic labels placed on random cells of a grid
+    rng = np.random.default_rng(seed)
+    grid = tuple(size // (label_size + 1) for size in shape)
+    cells = rng.choice(np.prod(grid), size=n_labels, replace=False)
+    data = np.zeros(shape, dtype=np.uint32)
+    for label, cell in enumerate(cells, start=1):
+        corner = [index * (label_size + 1)
+                  for index in np.unravel_index(cell, grid)]
+        data[tuple(slice(c, c + label_size) for c in corner)] = label
+    return data
+
+
+def split_label_volume(data, n_classes=2):
+    # spread the labels evenly over the classes
+    return [np.where(data % n_classes == i, data, 0)
+            for i in range(n_classes)]
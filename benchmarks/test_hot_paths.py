@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from napari_u01.classification_view import HL_NAME
+from napari_u01.classification_widget import LabelClassificationWidget
+
+from synthetic import split_label_volume
+
+# the benchmarked hot paths give the same results as a full volume scan,
+# on the volume set with --bench-shape and --bench-labels
+
+
+@pytest.fixture
+def widget(make_napari_viewer, qtbot, config_path, label_volume):
+    viewer = make_napari_viewer()
+    neuron, glia = split_label_volume(label_volume)
+    viewer.add_labels(neuron, name='neuron')
+    viewer.add_labels(glia, name='glia')
+
+    widget = LabelClassificationWidget(viewer)
+    widget.config_textbox.setText(config_path)
+    widget.load_config(viewer)
+    qtbot.waitUntil(lambda: widget.controller is not None, timeout=60000)
+    return widget
+
+
+def first_voxel(volume, label):
+    return tuple(int(c) for c in np.argwhere(volume == label)[0])
+
+
+def test_label_selection(widget, label_volume):
+    viewer = widget.view.viewer
+    label = int(label_volume.max())
+    widget.controller.on_label_selection(first_voxel(label_volume, label))
+
+    assert widget.model.selected == label
+    np.testing.assert_array_equal(viewer.layers[HL_NAME].data,
+                                  label_volume == label)
+
+    # clicking the background clears the highlight
+    widget.controller.on_label_selection(
+        first_voxel(label_volume, 0))
+    assert widget.model.selected is None
+    assert not viewer.layers[HL_NAME].data.any()
+
+
+def test_keyboard_input(widget, label_volume):
+    layers = widget.view.viewer.layers
+    # labels of even ids start as neuron
+    label = int(label_volume.max()) // 2 * 2
+    widget.controller.on_label_selection(first_voxel(label_volume, label))
+
+    widget.controller.on_keyboard_input('g')
+    assert widget.model.class_per_label[label]['class'] == 'glia'
+    assert not np.any(layers['neuron'].data == label)
+    np.testing.assert_array_equal(layers['glia'].data == label,
+                                  label_volume == label)
+
+    # and back, the other labels are left as they were
+    widget.controller.on_keyboard_input('n')
+    neuron, glia = split_label_volume(label_volume)
+    np.testing.assert_array_equal(layers['neuron'].data, neuron)
+    np.testing.assert_array_equal(layers['glia'].data, glia)
+
+
+def test_update_label_layers(widget, label_volume):
+    layers = widget.view.viewer.layers
+    labels = widget.model.class_per_label.labels[:10].tolist()
+    for label in labels:
+        old_class_name = widget.model.classify_label(label, 'glia')
+        widget.view.update_label_layers(label, old_class_name)
+
+    moved = np.isin(label_volume, labels)
+    neuron, glia = split_label_volume(label_volume)
+    np.testing.assert_array_equal(layers['neuron'].data,
+                                  np.where(moved, 0, neuron))
+    np.testing.assert_array_equal(layers['glia'].data,
+                                  np.where(moved, label_volume, glia))
+    # the glia layer colors the moved labels too
+    assert np.allclose(layers['glia'].get_color(labels[0]),
+                       layers['glia'].get_color(labels[1]))
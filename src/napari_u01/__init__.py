@@ -5,9 +5,11 @@ except ImportError:
 from .classification_widget import LabelClassificationWidget
 from .visability import LayerVisabilityWidget
 from .data_loader import DataLoaderWidget
+from .latency_widget import LatencyWidget
 
 __all__ = (
     "LabelClassificationWidget",
     "LayerVisabilityWidget",
-    "DataLoaderWidget"
+    "DataLoaderWidget",
+    "LatencyWidget"
 )
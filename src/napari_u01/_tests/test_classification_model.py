@@ -0,0 +1,333 @@
+import numpy as np
+import pytest
+import yaml
+from napari.layers import Image, Labels
+
+from napari_u01.classification_model import LabelClassificationModel
+
+CONFIG = {
+    'classifications': [
+        {'group': 'cell type',
+         'classes': [
+             {'name': 'neuron', 'color': 'magenta', 'key': 'n',
+              'subclasses': [
+                  {'name': 'excitatory', 'color': None, 'key': 'e'}]},
+             {'name': 'glia', 'color': 'cyan', 'key': 'g'},
+         ]}
+    ]
+}
+
+
+def make_layers():
+    shape = (20, 16, 16)
+    neuron = np.zeros(shape, dtype=np.uint16)
+    excitatory = np.zeros(shape, dtype=np.uint16)
+    glia = np.zeros(shape, dtype=np.uint16)
+    neuron[1:3, 1:4, 1:4] = 3
+    neuron[17:19, 10:12, 10:12] = 9
+    excitatory[5:8, 5:9, 5:9] = 12
+    glia[10:19, 1:3, 1:3] = 70
+    return [Labels(neuron, name='neuron'),
+            Labels(excitatory, name='neuron:excitatory'),
+            Labels(glia, name='glia')]
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / 'config.yaml'
+    path.write_text(yaml.safe_dump(CONFIG))
+    return str(path)
+
+
+def test_model_init(config_path):
+    layers = make_layers()
+    model = LabelClassificationModel(layers, config_path)
+
+    assert model.class_names == ['neuron', 'neuron:excitatory', 'glia']
+    labels_per_class = {class_name: labels.tolist() for class_name, labels
+                        in model.labels_per_class.items()}
+    assert labels_per_class == {'neuron': [3, 9],
+                                'neuron:excitatory': [12],
+                                'glia': [70]}
+    assert model.class_per_label[12] == {'class': 'neuron:excitatory'}
+    assert model.class_colormaps['glia'] == {0: 'transparent', None: 'cyan'}
+
+    # labels are picked by probing the class layers
+    assert model.label_at((5, 6, 6)) == 12
+    assert model.label_at((12, 1, 2)) == 70
+    assert model.label_at((0, 0, 0)) == 0
+
+
+def test_model_init_overlap(config_path):
+    layers = make_layers()
+    layers[2].data[1, 1, 1] = 70
+    with pytest.raises(AssertionError):
+        LabelClassificationModel(layers, config_path)
+
+
+def test_classify_and_save(config_path, tmp_path):
+    model = LabelClassificationModel(make_layers(), config_path)
+
+    old_class_name = model.classify_label(9, 'neuron:excitatory')
+    assert old_class_name == 'neuron'
+    assert model.class_per_label[9]['class'] == 'neuron:excitatory'
+    assert model.class_per_label.counts() == {'neuron': 1,
+                                              'neuron:excitatory': 2,
+                                              'glia': 1}
+
+    filename = tmp_path / 'classified_labels.csv'
+    model.save_classified_labels(filename)
+    assert filename.read_text().splitlines() == [
+        'ID,Class,Subclass',
+        '3,neuron,',
+        '9,neuron,excitatory',
+        '12,neuron,excitatory',
+        '70,glia,']
+
+
+def test_model_shared_labels(tmp_path):
+    config = dict(CONFIG, shared_labels='all_labels')
+    path = tmp_path / 'config.yaml'
+    path.write_text(yaml.safe_dump(config))
+
+    data = sum(layer.data for layer in make_layers())
+    metadata = {'class_names': ['glia', 'neuron:excitatory'],
+                'labels': np.array([3, 12]),
+                'class_index_per_label': np.array([-1, 1])}
+    layer = Labels(data, name='all_labels', metadata=metadata)
+    model = LabelClassificationModel([layer], str(path))
+
+    assert model.label_at((5, 6, 6)) == 12
+    assert model.class_per_label[12]['class'] == 'neuron:excitatory'
+    assert model.class_per_label[70]['class'] == 'neuron'
+    assert model.get_layer_name(70) == 'all_labels'
+
+    model.classify_label(70, 'glia')
+    assert model.update_shared_colormap(70) == {70: 'cyan'}
+    assert model.shared_colormap[70] == 'cyan'
+    assert model.shared_colormap[3] == 'magenta'
+
+
+def test_model_large_label_ids(config_path):
+    # 64-bit label ids need no lookup arrays as large as the ids
+    layers = make_layers()
+    for layer in layers:
+        data = layer.data.astype(np.uint64)
+        data[data > 0] += 2 ** 40
+        layer.data = data
+    model = LabelClassificationModel(layers, config_path)
+
+    label = 2 ** 40 + 70
+    assert model.class_per_label.labels.tolist() == [
+        2 ** 40 + 3, 2 ** 40 + 9, 2 ** 40 + 12, label]
+    assert model.label_at((12, 1, 2)) == label
+    assert model.classify_label(label, 'neuron') == 'glia'
+    assert model.class_per_label[label]['class'] == 'neuron'
+    assert 70 not in model.class_per_label
+
+
+def test_journal_replay_and_compact(config_path, tmp_path):
+    model = LabelClassificationModel(make_layers(), config_path)
+    model.classify_label(9, 'glia')
+    model.classify_label(9, 'neuron:excitatory')
+    model.classify_label(70, 'neuron')
+    model.classify_label(3, 'glia')
+    model.classify_label(3, 'neuron')
+    model.journal.close()
+
+    journal_path = tmp_path / 'config_journal.csv'
+    assert len(journal_path.read_text().splitlines()) == 6
+
+    # a new session on the original layers restores the classes
+    restored = LabelClassificationModel(make_layers(), config_path)
+    changes = restored.replay_journal()
+    assert sorted(changes) == [(9, 'neuron'), (70, 'glia')]
+    assert restored.class_per_label[9]['class'] == 'neuron:excitatory'
+    assert restored.class_per_label[70]['class'] == 'neuron'
+    assert restored.class_per_label[3]['class'] == 'neuron'
+
+    # compaction keeps one row per label, the full table of classes
+    restored.compact_journal()
+    rows = [row.split(',')[1:] for row in
+            journal_path.read_text().splitlines()[1:]]
+    assert rows == [['3', 'neuron', 'neuron'],
+                    ['9', 'neuron', 'neuron:excitatory'],
+                    ['12', 'neuron:excitatory', 'neuron:excitatory'],
+                    ['70', 'glia', 'neuron']]
+
+    # the compacted journal restores the same classes
+    restored.close()
+    compacted = LabelClassificationModel(make_layers(), config_path)
+    assert sorted(compacted.replay_journal()) == [(9, 'neuron'),
+                                                  (70, 'glia')]
+    compacted.close()
+
+
+def test_import_classified_labels(config_path, tmp_path):
+    filename = tmp_path / 'imported.csv'
+    filename.write_text('ID,Class,Subclass\n'
+                        '3,glia,\n'
+                        '9,neuron,\n'
+                        '12,neuron,\n'
+                        '70,neuron,excitatory\n'
+                        '500,glia,\n'
+                        '71,astrocyte,\n')
+    model = LabelClassificationModel(make_layers(), config_path)
+
+    changes = model.import_classified_labels(filename)
+    # unknown labels and classes are skipped
+    assert sorted(changes) == [(3, 'neuron'), (12, 'neuron:excitatory'),
+                               (70, 'glia')]
+    assert model.class_per_label.counts() == {'neuron': 2,
+                                              'neuron:excitatory': 1,
+                                              'glia': 1}
+    assert model.class_per_label[70]['class'] == 'neuron:excitatory'
+
+    # imported classes are journaled like keypresses
+    model.journal.close()
+    restored = LabelClassificationModel(make_layers(), config_path)
+    assert sorted(restored.replay_journal()) == sorted(changes)
+
+
+def test_import_classified_labels_shared(tmp_path):
+    config = dict(CONFIG, shared_labels='all_labels', journal=None)
+    path = tmp_path / 'config.yaml'
+    path.write_text(yaml.safe_dump(config))
+    data = sum(layer.data for layer in make_layers())
+    model = LabelClassificationModel([Labels(data, name='all_labels')],
+                                     str(path))
+
+    filename = tmp_path / 'imported.csv'
+    model.save_classified_labels(filename)
+    filename.write_text(filename.read_text().replace('70,neuron,',
+                                                     '70,glia,'))
+    assert model.import_classified_labels(filename) == [(70, 'neuron')]
+    assert model.shared_colormap[70] == 'cyan'
+    assert model.shared_colormap[9] == 'magenta'
+
+
+@pytest.mark.parametrize('extension', ['parquet', 'feather'])
+def test_save_label_table(config_path, tmp_path, extension):
+    pd = pytest.importorskip('pandas')
+    pytest.importorskip('pyarrow')
+    layers = make_layers()
+    model = LabelClassificationModel(layers, config_path)
+
+    filename = tmp_path / f'labels.{extension}'
+    model.save_label_table(filename)
+    if extension == 'parquet':
+        table = pd.read_parquet(filename)
+    else:
+        table = pd.read_feather(filename)
+
+    assert table['ID'].tolist() == [3, 9, 12, 70]
+    assert table['Class'].tolist() == ['neuron', 'neuron', 'neuron', 'glia']
+    assert table['Subclass'].tolist() == ['', '', 'excitatory', '']
+    assert table['Voxels'].tolist() == [18, 8, 48, 36]
+    row = table.set_index('ID').loc[70]
+    assert (row['Centroid Z'], row['Centroid Y'], row['Centroid X']) \
+        == (14.0, 1.5, 1.5)
+    assert (row['BBox Min Z'], row['BBox Max Z']) == (10, 18)
+
+
+def test_model_initialize_in_steps(config_path):
+    model = LabelClassificationModel(make_layers(), config_path,
+                                     initialize=False)
+    assert model.class_per_label is None
+
+    progress = list(model.initialize())
+    # one step per slab of planes, the labels have 20 planes
+    assert progress == [('Reading labels...', 16, 20),
+                        ('Reading labels...', 20, 20)]
+    assert model.class_per_label[70]['class'] == 'glia'
+    assert model.class_colormaps['glia'] == {0: 'transparent', None: 'cyan'}
+
+
+def test_model_initialize_cancelled(config_path):
+    model = LabelClassificationModel(make_layers(), config_path,
+                                     initialize=False)
+    steps = model.initialize()
+    next(steps)
+    # closing the generator, as a cancelled worker does, stops the scan
+    steps.close()
+    assert model.class_per_label is None
+
+
+def test_classify_labels_in_region(config_path):
+    model = LabelClassificationModel(make_layers(), config_path)
+
+    # a box on plane 12 around label 70, and a lasso around labels 3,
+    # 12 and 70 drawn on plane 1, or on all planes
+    box = np.array([[12, 0, 0], [12, 0, 4], [12, 4, 4], [12, 4, 0]])
+    lasso = np.array([[1, 0, 0], [1, 0, 12], [1, 9, 9], [1, 12, 0]])
+    assert model.labels_in_shapes([box]).tolist() == [70]
+    assert model.labels_in_shapes([lasso]).tolist() == [3]
+    assert model.labels_in_shapes([lasso[:, 1:]]).tolist() == [3, 12, 70]
+    assert model.labels_in_range('volume', 20, 40).tolist() == [70]
+
+    model.select_labels(model.labels_in_shapes([lasso[:, 1:]]))
+    changes = model.classify_labels(model.selected_labels, 'glia')
+    assert sorted(changes) == [(3, 'neuron'), (12, 'neuron:excitatory')]
+    assert model.class_per_label.counts() == {'neuron': 1,
+                                              'neuron:excitatory': 0,
+                                              'glia': 3}
+
+
+def test_label_features_and_rules(tmp_path):
+    layers = make_layers()
+    image = np.zeros(layers[0].data.shape, dtype=np.uint8)
+    image[5:8, 5:9, 5:9] = 200
+    image[1:3, 1:4, 1:4] = 10
+    image[1, 1, 1] = 100
+    config = dict(CONFIG, features=True,
+                  rules=[{'class': 'glia', 'volume': [None, 20]},
+                         {'class': 'neuron', 'nuclei mean': [150, None]}])
+    path = tmp_path / 'config.yaml'
+    path.write_text(yaml.safe_dump(config))
+
+    model = LabelClassificationModel(layers + [Image(image, name='nuclei')],
+                                     str(path))
+    features = model.label_features
+    assert features.names == ['volume', 'extent', 'nuclei mean',
+                              'nuclei max']
+    assert features['volume'].tolist() == [18, 8, 48, 36]
+    assert features['extent'].tolist() == [1, 1, 1, 1]
+    assert features['nuclei mean'].tolist() == [15, 0, 200, 0]
+    assert features['nuclei max'].tolist() == [100, 0, 200, 0]
+    assert model.labels_in_range('nuclei max', 50).tolist() == [3, 12]
+
+    # features are cached next to the config and reused
+    cache = tmp_path / 'config_features.npz'
+    assert cache.exists()
+    cached = LabelClassificationModel(make_layers(), str(path))
+    assert cached.label_features.names == features.names
+
+    # but not if the image changed
+    image[12, 1, 1] = 255
+    changed = LabelClassificationModel(
+        make_layers() + [Image(image, name='nuclei')], str(path))
+    assert changed.label_features['nuclei max'].tolist() == [100, 0, 200,
+                                                             255]
+
+    changes = model.apply_rules()
+    assert sorted(changes) == [(3, 'neuron'), (9, 'neuron'),
+                               (12, 'neuron:excitatory')]
+    assert model.class_per_label[12]['class'] == 'neuron'
+    assert model.class_per_label.counts() == {'neuron': 1,
+                                              'neuron:excitatory': 0,
+                                              'glia': 3}
+
+
+def test_intensity_features_are_opt_in(config_path, tmp_path):
+    layers = make_layers()
+    image = np.ones(layers[0].data.shape, dtype=np.uint8)
+    model = LabelClassificationModel(layers + [Image(image, name='nuclei')],
+                                     config_path)
+    # the image is not read, only the index gives features
+    assert model.label_features.names == ['volume', 'extent']
+    assert not (tmp_path / 'config_features.npz').exists()
+
+    # a rule on a feature that is not computed is skipped
+    model.config['rules'] = [{'class': 'glia', 'nuclei mean': [0, None]},
+                             {'class': 'glia', 'volume': [None, 20]}]
+    assert sorted(model.apply_rules()) == [(3, 'neuron'), (9, 'neuron')]
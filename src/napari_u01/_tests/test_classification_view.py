@@ -0,0 +1,165 @@
+import numpy as np
+import pytest
+import yaml
+from napari.utils.colormaps.standardize_color import transform_color
+from PyQt5 import QtCore
+
+from napari_u01.classification_model import LabelClassificationModel
+from napari_u01.classification_view import HL_NAME, TableView, \
+    LabelClassificationView
+from napari_u01.label_features import LabelFeatures
+from napari_u01.label_store import LabelClassStore
+
+from .test_classification_model import CONFIG, make_layers
+
+
+def make_store():
+    class_names = ['neuron', 'neuron:excitatory', 'glia']
+    labels = np.array([3, 9, 12, 70])
+    return LabelClassStore(class_names, labels, [0, 2, 1, 0])
+
+
+def table_rows(table):
+    model = table.model
+    return [[model.index(row, col).data() for col in range(3)]
+            for row in range(model.rowCount())]
+
+
+def test_table_view_reads_store(qtbot):
+    table = TableView()
+    qtbot.addWidget(table)
+    table.populate(make_store())
+
+    assert table_rows(table) == [['3', 'neuron', ''],
+                                 ['9', 'glia', ''],
+                                 ['12', 'neuron', 'excitatory'],
+                                 ['70', 'neuron', '']]
+
+    table.table.sortByColumn(1, QtCore.Qt.AscendingOrder)
+    assert [row[0] for row in table_rows(table)] == ['9', '3', '12', '70']
+
+    table.select_label(12)
+    assert table.get_selected_id() == 12
+
+
+def test_table_view_update_label(qtbot):
+    store = make_store()
+    table = TableView()
+    qtbot.addWidget(table)
+    table.populate(store)
+
+    store.set_class(70, 'glia')
+    with qtbot.waitSignal(table.model.dataChanged) as blocker:
+        table.update_label(70)
+    top_left, bottom_right = blocker.args[:2]
+    assert (top_left.row(), bottom_right.row()) == (3, 3)
+    assert table_rows(table)[3] == ['70', 'glia', '']
+
+
+def test_table_view_keeps_selection_when_sorting(qtbot):
+    table = TableView()
+    qtbot.addWidget(table)
+    table.populate(make_store())
+
+    table.select_label(70)
+    table.table.sortByColumn(0, QtCore.Qt.DescendingOrder)
+    assert table.get_selected_id() == 70
+    assert table.model.row_of_label(70) == 0
+    assert table.model.row_of_label(3) == 3
+    assert table.model.row_of_label(5) is None
+    assert table.model.row_of_label(1000) is None
+
+
+def test_table_view_multi_select(qtbot):
+    table = TableView()
+    qtbot.addWidget(table)
+    table.populate(make_store())
+
+    selection = table.table.selectionModel()
+    for label in [9, 70]:
+        selection.select(
+            table.model.index(table.model.row_of_label(label), 0),
+            QtCore.QItemSelectionModel.Select
+            | QtCore.QItemSelectionModel.Rows)
+    assert sorted(table.get_selected_ids()) == [9, 70]
+
+    with qtbot.waitSignal(table.model.dataChanged) as blocker:
+        table.update_labels()
+    top_left, bottom_right = blocker.args[:2]
+    assert (top_left.row(), bottom_right.row()) == (0, 3)
+
+
+def test_table_view_feature_columns(qtbot):
+    store = make_store()
+    features = LabelFeatures(store.labels,
+                             {'volume': np.array([30.0, 10.0, 20.0, 40.0])})
+    table = TableView()
+    qtbot.addWidget(table)
+    table.populate(store, features)
+
+    assert table.model.headers[3] == 'volume'
+    assert table.feature_box.currentText() == 'volume'
+    table.table.sortByColumn(3, QtCore.Qt.AscendingOrder)
+    assert [row[0] for row in table_rows(table)] == ['9', '12', '3', '70']
+    assert table.model.index(0, 3).data() == '10'
+
+    # filtering keeps the sort order and hides the other labels
+    table.show_labels([70, 3])
+    assert [row[0] for row in table_rows(table)] == ['3', '70']
+    assert table.model.row_of_label(9) is None
+    table.show_labels(None)
+    assert table.model.rowCount() == 4
+
+
+@pytest.fixture
+def view(make_napari_viewer, tmp_path):
+    config_path = tmp_path / 'config.yaml'
+    config_path.write_text(yaml.safe_dump(dict(CONFIG, journal=None)))
+    viewer = make_napari_viewer()
+    layers = make_layers()
+    for layer in layers:
+        viewer.add_layer(layer)
+    model = LabelClassificationModel(layers, str(config_path))
+    view = LabelClassificationView(model, viewer)
+    yield view
+    view.label_list_window.close()
+
+
+def test_highlight_labels(view):
+    view.highlight_label(12)
+    highlight_layer = view.viewer.layers[HL_NAME]
+    assert highlight_layer.data.sum() == 3 * 4 * 4
+    np.testing.assert_allclose(highlight_layer.get_color(1), [1, 1, 1, 1])
+    assert view.viewer.layers.selection.active.name == 'neuron:excitatory'
+
+    # the previous highlight is cleared
+    view.highlight_labels([3, 70])
+    assert highlight_layer.data.sum() == 2 * 3 * 3 + 9 * 2 * 2
+    assert highlight_layer.data[12, 1, 1] == 1
+
+    view.unhighlight_label()
+    assert highlight_layer.data.sum() == 0
+
+
+def test_reclassify_shared_labels(make_napari_viewer, tmp_path):
+    config_path = tmp_path / 'config.yaml'
+    config_path.write_text(yaml.safe_dump(
+        dict(CONFIG, shared_labels='all_labels', journal=None)))
+    viewer = make_napari_viewer()
+    layer = viewer.add_labels(sum(layer.data for layer in make_layers()),
+                              name='all_labels')
+    model = LabelClassificationModel([layer], str(config_path))
+    view = LabelClassificationView(model, viewer)
+    magenta, cyan = transform_color(['magenta', 'cyan'])
+    np.testing.assert_allclose(layer.get_color(70), magenta)
+
+    # only the color of the label changes
+    model.classify_label(70, 'glia')
+    view.update_label_layers(70, 'neuron')
+    np.testing.assert_allclose(layer.get_color(70), cyan)
+    np.testing.assert_allclose(layer.get_color(9), magenta)
+
+    changes = model.classify_labels([3, 9], 'glia')
+    view.update_many_label_layers(changes)
+    np.testing.assert_allclose(layer.get_color(9), cyan)
+    view.label_list_window.close()
@@ -0,0 +1,98 @@
+import yaml
+
+from napari_u01.classification_widget import LabelClassificationWidget
+
+from .test_classification_model import CONFIG, make_layers
+
+
+def test_load_config_in_background(make_napari_viewer, qtbot, tmp_path):
+    viewer = make_napari_viewer()
+    for layer in make_layers():
+        viewer.add_layer(layer)
+    config_path = tmp_path / 'config.yaml'
+    config_path.write_text(yaml.safe_dump(CONFIG))
+
+    widget = LabelClassificationWidget(viewer)
+    widget.config_textbox.setText(str(config_path))
+    widget.load_config(viewer)
+    assert not widget.config_button.isEnabled()
+
+    qtbot.waitUntil(lambda: widget.controller is not None, timeout=5000)
+    assert widget.init_worker is None
+    assert widget.config_button.isEnabled()
+    assert widget.view.label_list.model.rowCount() == 4
+    assert 'g' in widget.model.class_per_key
+
+
+def test_reload_and_close_release_journal(make_napari_viewer, qtbot,
+                                          tmp_path):
+    viewer = make_napari_viewer()
+    for layer in make_layers():
+        viewer.add_layer(layer)
+    config_path = tmp_path / 'config.yaml'
+    config_path.write_text(yaml.safe_dump(CONFIG))
+
+    widget = LabelClassificationWidget(viewer)
+    widget.config_textbox.setText(str(config_path))
+    widget.load_config(viewer)
+    qtbot.waitUntil(lambda: widget.controller is not None, timeout=5000)
+    first = widget.model
+    first_view = widget.view
+    first.classify_label(9, 'glia')
+    assert first.journal._file is not None
+    callbacks = len(viewer.layers['glia'].mouse_drag_callbacks)
+
+    # loading the config again closes the journal of the old model
+    widget.controller = None
+    widget.load_config(viewer)
+    qtbot.waitUntil(lambda: widget.controller is not None, timeout=5000)
+    assert widget.model is not first
+    assert first.journal._file is None
+    # and disconnects the old view and controller
+    assert len(viewer.layers['glia'].mouse_drag_callbacks) == callbacks
+    assert not first_view.label_list_window.isVisible()
+    assert widget.view.label_list_window.isVisible()
+
+    widget.model.classify_label(9, 'neuron')
+    assert widget.model.journal._file is not None
+    widget.close()
+    assert widget.model.journal._file is None
+
+
+def press_key(viewer, key):
+    # call the function bound to the key on the viewer
+    bindings = {str(bound).lower(): func
+                for bound, func in viewer.keymap.items()}
+    bindings[key.lower()](viewer)
+
+
+def test_escape_clears_selection_and_filter(make_napari_viewer, qtbot,
+                                            tmp_path):
+    viewer = make_napari_viewer()
+    for layer in make_layers():
+        viewer.add_layer(layer)
+    config_path = tmp_path / 'config.yaml'
+    config_path.write_text(yaml.safe_dump(dict(CONFIG, journal=None)))
+
+    widget = LabelClassificationWidget(viewer)
+    widget.config_textbox.setText(str(config_path))
+    widget.load_config(viewer)
+    qtbot.waitUntil(lambda: widget.controller is not None, timeout=5000)
+
+    # a filtered multi-label selection, e.g. by a feature range
+    label_list = widget.view.label_list
+    widget.controller.select_labels([3, 12])
+    label_list.show_labels([3, 12])
+    assert label_list.model.rowCount() == 2
+
+    press_key(viewer, 'Escape')
+    assert widget.model.selected_labels is None
+    assert label_list.model.rowCount() == 4
+
+    # a single selection is cleared too, classifying does nothing then
+    widget.controller.on_label_selection((12, 1, 2))
+    assert widget.model.selected == 70
+    press_key(viewer, 'Escape')
+    assert widget.model.selected is None
+    press_key(viewer, 'n')
+    assert widget.model.class_per_label[70]['class'] == 'glia'
@@ -0,0 +1,350 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+import tifffile as tif
+import yaml
+from napari.components import ViewerModel
+from napari.layers import Image, Labels
+from napari.utils.colormaps.standardize_color import transform_color
+
+from napari_u01.classification_model import LabelClassificationModel
+from napari_u01.classification_view import LabelClassificationView
+from napari_u01.data_loader import DataLoaderModel, DataLoaderWidget
+
+CONFIG = {
+    'shared_labels': 'all_labels',
+    'classifications': [
+        {'group': 'cell type',
+         'classes': [
+             {'name': 'neuron', 'color': 'magenta', 'key': 'n',
+              'labels': 'neuron_labels',
+              'subclasses': [
+                  {'name': 'excitatory', 'color': None, 'key': 'e',
+                   'labels': 'excitatory_labels'}]},
+             {'name': 'glia', 'color': 'cyan', 'key': 'g',
+              'labels': 'glia_labels'},
+             {'name': 'background', 'color': 'red', 'key': 'b',
+              'labels': None},
+         ]}
+    ]
+}
+
+
+def test_process_shared_labels():
+    shape = (6, 8, 8)
+    neuron = np.zeros(shape, dtype=np.uint16)
+    excitatory = np.zeros(shape, dtype=np.uint16)
+    glia = np.zeros(shape, dtype=np.uint16)
+    neuron[0:2, 0:2, 0:2] = 4
+    excitatory[3:5, 3:5, 3:5] = 8
+    glia[5, 6:8, 6:8] = 2
+
+    model = DataLoaderModel()
+    model.config = CONFIG
+    for name, data in [('neuron_labels', neuron),
+                       ('excitatory_labels', excitatory),
+                       ('glia_labels', glia)]:
+        model.labels[name] = Labels(data, name=name)
+    model.process_classifications()
+
+    assert list(model.labels) == ['all_labels']
+    layer = model.labels['all_labels']
+    assert np.array_equal(layer.data, neuron + excitatory + glia)
+    assert layer.metadata['class_names'] == [
+        'neuron', 'neuron:excitatory', 'glia', 'background']
+    assert layer.metadata['labels'].tolist() == [2, 4, 8]
+    class_index = layer.metadata['class_index_per_label']
+    assert class_index.tolist() == [2, 0, 1]
+
+
+def test_shared_labels_of_uncolored_class_keep_default_colors():
+    config = {'shared_labels': 'all_labels', 'classifications': [
+        {'group': 'cell type',
+         'classes': [{'name': 'glia', 'color': None, 'key': 'g',
+                      'labels': 'glia_labels'},
+                     {'name': 'neuron', 'color': 'magenta', 'key': 'n',
+                      'labels': 'neuron_labels'}]}]}
+    glia = np.zeros((4, 4), dtype=np.uint16)
+    neuron = np.zeros((4, 4), dtype=np.uint16)
+    glia[0, :2], glia[1, :2] = 2, 3
+    neuron[3, :] = 5
+
+    model = DataLoaderModel()
+    model.config = config
+    model.labels['glia_labels'] = Labels(glia, name='glia_labels')
+    model.labels['neuron_labels'] = Labels(neuron, name='neuron_labels')
+    model.process_classifications()
+
+    layer = model.labels['all_labels']
+    default = Labels(glia)
+    for label in [2, 3]:
+        np.testing.assert_allclose(layer.get_color(label),
+                                   default.get_color(label), atol=1 / 255)
+    np.testing.assert_allclose(layer.get_color(5),
+                               transform_color('magenta')[0])
+
+
+def test_process_shared_labels_without_label_files():
+    config = {'shared_labels': 'all_labels', 'classifications': [
+        {'group': 'cell type',
+         'classes': [{'name': 'glia', 'color': 'cyan', 'key': 'g',
+                      'labels': None}]}]}
+    model = DataLoaderModel()
+    model.config = config
+    with pytest.raises(ValueError):
+        model.process_classifications()
+
+    # the empty shared layer takes the shape of the images
+    model.images['nuclei'] = Image(np.zeros((3, 4, 5)), name='nuclei')
+    model.process_classifications()
+    layer = model.labels['all_labels']
+    assert layer.data.shape == (3, 4, 5) and not layer.data.any()
+    assert len(layer.metadata['labels']) == 0
+
+
+def write_stack(path, **kwargs):
+    data = np.arange(4 * 5 * 6, dtype=np.uint16).reshape(4, 5, 6)
+    tif.imwrite(path, data, **kwargs)
+    return data
+
+
+def test_read_tiff_memmap(tmp_path):
+    path = str(tmp_path / 'plain.tif')
+    data = write_stack(path)
+
+    mapped = DataLoaderModel.read_tiff(path, lazy=True, mode='c')
+    assert isinstance(mapped, np.memmap)
+    assert np.array_equal(mapped, data)
+    # copy-on-write: edits are not written back to the file
+    mapped[0, 0, 0] = 100
+    assert tif.imread(path)[0, 0, 0] == 0
+
+
+def test_read_tiff_compressed(tmp_path):
+    pytest.importorskip('dask')
+    path = str(tmp_path / 'compressed.tif')
+    data = write_stack(path, compression='zlib')
+
+    chunked = DataLoaderModel.read_tiff(path, lazy=True)
+    assert chunked.shape == data.shape
+    assert np.array_equal(np.asarray(chunked[2]), data[2])
+
+    # labels can not be mapped from a compressed file, they are read
+    writable = DataLoaderModel.read_tiff(path, lazy=True, mode='c')
+    assert isinstance(writable, np.ndarray)
+    writable[0, 0, 0] = 100
+
+
+def test_reclassify_lazily_loaded_labels(make_napari_viewer, tmp_path):
+    neuron = np.zeros((6, 8, 8), dtype=np.uint16)
+    neuron[0:2, 0:2, 0:2] = 4
+    glia = np.zeros((6, 8, 8), dtype=np.uint16)
+    glia[3:5, 3:5, 3:5] = 8
+    tif.imwrite(str(tmp_path / 'neuron.tif'), neuron, compression='zlib')
+    tif.imwrite(str(tmp_path / 'glia.tif'), glia)
+    config = {
+        'data': {
+            'lazy': True,
+            'images': [],
+            'labels': [{'name': 'neuron_labels',
+                        'path': str(tmp_path / 'neuron.tif'),
+                        'color': None},
+                       {'name': 'glia_labels',
+                        'path': str(tmp_path / 'glia.tif'),
+                        'color': None}]},
+        'journal': None,
+        'features': None,
+        'classifications': [
+            {'group': 'cell type',
+             'classes': [
+                 {'name': 'neuron', 'color': 'magenta', 'key': 'n',
+                  'labels': 'neuron_labels'},
+                 {'name': 'glia', 'color': 'cyan', 'key': 'g',
+                  'labels': 'glia_labels'}]}]}
+    config_path = tmp_path / 'config.yaml'
+    config_path.write_text(yaml.safe_dump(config))
+
+    loader = DataLoaderModel(str(config_path))
+    loader.load_labels()
+    loader.process_classifications()
+    viewer = make_napari_viewer()
+    for layer in loader.labels.values():
+        viewer.add_layer(layer)
+    model = LabelClassificationModel(list(loader.labels.values()),
+                                     str(config_path))
+    view = LabelClassificationView(model, viewer)
+
+    # both ways, out of the read and of the memory-mapped layer
+    model.classify_label(4, 'glia')
+    view.update_label_layers(4, 'neuron')
+    model.classify_label(8, 'neuron')
+    view.update_label_layers(8, 'glia')
+    assert viewer.layers['glia'].data[0, 0, 0] == 4
+    assert viewer.layers['neuron'].data[0, 0, 0] == 0
+    assert viewer.layers['neuron'].data[3, 3, 3] == 8
+    # the files are not changed
+    assert tif.imread(str(tmp_path / 'glia.tif'))[0, 0, 0] == 0
+    view.label_list_window.close()
+
+
+def test_load_data_in_background(qtbot, tmp_path, monkeypatch):
+    # a viewer model, image layers need OpenGL in a Qt viewer
+    viewer = ViewerModel()
+    widget = DataLoaderWidget(viewer)
+    qtbot.addWidget(widget)
+
+    neuron = np.zeros((4, 8, 8), dtype=np.uint16)
+    neuron[1:3, 1:3, 1:3] = 5
+    glia = np.zeros((4, 8, 8), dtype=np.uint16)
+    glia[0, 5:7, 5:7] = 9
+    image = np.arange(256, dtype=np.uint8).reshape(4, 8, 8)
+    tif.imwrite(str(tmp_path / 'neuron.tif'), neuron)
+    tif.imwrite(str(tmp_path / 'glia.tif'), glia)
+    tif.imwrite(str(tmp_path / 'img.tif'), image)
+    widget.model.config = {
+        'data': {
+            'images': [{'name': 'img', 'path': str(tmp_path / 'img.tif')}],
+            'labels': [{'name': 'neuron_labels',
+                        'path': str(tmp_path / 'neuron.tif'),
+                        'color': None},
+                       {'name': 'glia_labels',
+                        'path': str(tmp_path / 'glia.tif'),
+                        'color': None}],
+        },
+        'classifications': [
+            {'group': 'cell type',
+             'classes': [
+                 {'name': 'neuron', 'color': None, 'key': 'n',
+                  'labels': 'neuron_labels'},
+                 {'name': 'glia', 'color': None, 'key': 'g',
+                  'labels': 'glia_labels'},
+                 {'name': 'background', 'color': None, 'key': 'b',
+                  'labels': None},
+             ]}
+        ]
+    }
+
+    # the image is read last, it still ends up below the labels
+    read_image = widget.model.read_image
+
+    def read_slowly(img_info):
+        time.sleep(0.5)
+        return read_image(img_info)
+    monkeypatch.setattr(widget.model, 'read_image', read_slowly)
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+
+    widget.controller.load_data()
+    qtbot.waitUntil(widget.view.load_button.isEnabled, timeout=10000)
+
+    assert [layer.name for layer in viewer.layers] == [
+        'img', 'neuron', 'glia', 'background']
+    assert np.array_equal(viewer.layers['img'].data, image)
+    assert widget.controller.loaded_layers == []
+    assert np.array_equal(viewer.layers['neuron'].data, neuron)
+    assert np.array_equal(viewer.layers['glia'].data, glia)
+    assert not viewer.layers['background'].data.any()
+
+
+def test_merge_shared_labels_in_background(make_napari_viewer, qtbot,
+                                           tmp_path, monkeypatch):
+    viewer = make_napari_viewer()
+    widget = DataLoaderWidget(viewer)
+    neuron = np.zeros((4, 8, 8), dtype=np.uint16)
+    neuron[1:3, 1:3, 1:3] = 5
+    glia = np.zeros((4, 8, 8), dtype=np.uint16)
+    glia[0, 5:7, 5:7] = 9
+    tif.imwrite(str(tmp_path / 'neuron.tif'), neuron)
+    tif.imwrite(str(tmp_path / 'glia.tif'), glia)
+    widget.model.config = {
+        'data': {
+            'images': [],
+            'labels': [{'name': 'neuron_labels',
+                        'path': str(tmp_path / 'neuron.tif'),
+                        'color': None},
+                       {'name': 'glia_labels',
+                        'path': str(tmp_path / 'glia.tif'),
+                        'color': None}],
+        },
+        'shared_labels': 'all_labels',
+        'classifications': [
+            {'group': 'cell type',
+             'classes': [
+                 {'name': 'neuron', 'color': 'magenta', 'key': 'n',
+                  'labels': 'neuron_labels'},
+                 {'name': 'glia', 'color': 'cyan', 'key': 'g',
+                  'labels': 'glia_labels'}]}]}
+
+    merge_threads = []
+    process_shared_labels = widget.model.process_shared_labels
+
+    def record_thread(layer_name):
+        merge_threads.append(threading.current_thread())
+        return process_shared_labels(layer_name)
+    monkeypatch.setattr(widget.model, 'process_shared_labels',
+                        record_thread)
+
+    widget.controller.load_data()
+    qtbot.waitUntil(widget.view.load_button.isEnabled, timeout=10000)
+
+    assert merge_threads and merge_threads[0] is not threading.main_thread()
+    assert [layer.name for layer in viewer.layers] == ['all_labels']
+    # the per-class layers were merged and are not kept
+    assert widget.controller.loaded_layers == []
+    assert np.array_equal(viewer.layers['all_labels'].data, neuron + glia)
+
+
+def test_class_colormap():
+    neuron_info = CONFIG['classifications'][0]['classes'][0]
+    excitatory_info = neuron_info['subclasses'][0]
+    color = DataLoaderModel.class_color(excitatory_info, neuron_info)
+
+    assert color == 'magenta'
+    assert DataLoaderModel.create_colormap(color) == {
+        0: 'transparent', None: 'magenta'}
+
+
+def test_save_labels_in_parallel(tmp_path):
+    model = DataLoaderModel()
+    expected = {}
+    for i, name in enumerate(['neuron', 'glia']):
+        data = np.zeros((3, 300, 300), dtype=np.uint32)
+        data[1, 10:20, 10:20] = 70000 + i
+        model.labels[name] = Labels(data, name=name)
+        expected[name] = data
+
+    paths = {'neuron': str(tmp_path / 'neuron.tif'),
+             'glia': str(tmp_path / 'glia.tif')}
+    saved = list(model.iter_save_labels(paths))
+
+    assert sorted(saved) == ['glia', 'neuron']
+    for name, path in paths.items():
+        with tif.TiffFile(path) as tiff:
+            page = tiff.pages[0]
+            assert tiff.is_bigtiff
+            assert page.is_tiled
+            assert page.compression == tif.COMPRESSION.ADOBE_DEFLATE
+            assert page.photometric == tif.PHOTOMETRIC.MINISBLACK
+            # one page per plane, the 3 planes are not read as RGB
+            assert len(tiff.pages) == 3
+            assert np.array_equal(tiff.asarray(), expected[name])
+
+
+def test_save_snapshot_of_labels(qtbot, tmp_path):
+    widget = DataLoaderWidget(ViewerModel())
+    qtbot.addWidget(widget)
+    data = np.zeros((3, 40, 40), dtype=np.uint16)
+    data[1, 5:10, 5:10] = 7
+    saved = data.copy()
+    widget.model.labels['neuron'] = Labels(data, name='neuron')
+
+    path = str(tmp_path / 'neuron.tif')
+    widget.controller.save_in_background({'neuron': path})
+    # reclassified while the worker writes, the file keeps the labels as
+    # they were when saving started
+    data[1, 5:10, 5:10] = 0
+    qtbot.waitUntil(widget.view.save_labels_button.isEnabled, timeout=10000)
+
+    assert np.array_equal(tif.imread(path), saved)
@@ -0,0 +1,57 @@
+import atexit
+
+from napari_u01 import instrumentation
+from napari_u01.instrumentation import span, timed, timings
+from napari_u01.latency_widget import LatencyWidget
+
+
+def work():
+    return sum(range(100))
+
+
+def test_disabled_timing_costs_nothing(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'ENABLED', False)
+    assert timed()(work) is work
+    assert span('a') is span('b')
+
+
+def test_enabled_timing_records(monkeypatch, qtbot):
+    monkeypatch.setattr(instrumentation, 'ENABLED', True)
+    timings.clear()
+    timed_work = timed('work')(work)
+    assert timed_work() == work()
+    assert timed_work() == work()
+    with span('block'):
+        work()
+
+    summary = timings.summary()
+    assert sorted(summary) == ['block', 'work']
+    count, last, mean, maximum = summary['work']
+    assert count == 2 and 0 <= last <= maximum and mean <= maximum
+
+    widget = LatencyWidget()
+    qtbot.addWidget(widget)
+    widget.refresh()
+    assert widget.table.rowCount() == 2
+    assert widget.table.item(1, 0).text() == 'work'
+    widget.clear()
+    assert widget.table.rowCount() == 0
+
+
+def test_timings_logged_in_background(monkeypatch, tmp_path):
+    log_path = tmp_path / 'timings.log'
+    monkeypatch.setattr(instrumentation, 'TIMING', str(log_path))
+    monkeypatch.setattr(instrumentation, 'LOG_TIMINGS', True)
+    handlers = list(instrumentation.logger.handlers)
+    level = instrumentation.logger.level
+    listener = instrumentation._init_logging()
+    try:
+        timings.record('work', 0.002)
+    finally:
+        # stopping the listener writes the queued records
+        listener.stop()
+        atexit.unregister(listener.stop)
+        instrumentation.logger.handlers = handlers
+        instrumentation.logger.setLevel(level)
+
+    assert log_path.read_text().strip().endswith('MainThread work 2.000 ms')
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pytest
+
+from napari_u01.label_features import LabelFeatures, image_signature, \
+    iter_label_features, load_cached_features
+from napari_u01.label_index import LabelIndex, run_to_completion
+
+
+def make_volumes():
+    labels = np.zeros((20, 6, 7), dtype=np.uint16)
+    labels[1:18, 1:3, 1:3] = 4
+    labels[16:20, 4:6, 2:7] = 9
+    image = np.arange(labels.size, dtype=np.uint16).reshape(labels.shape)
+    return labels, image
+
+
+def test_lazy_image_features_match():
+    da = pytest.importorskip('dask.array')
+    labels, image = make_volumes()
+    index = LabelIndex.from_arrays([labels])
+
+    in_memory = list(iter_label_features(index, {'img': image}))
+    lazy = iter_label_features(index, {'img': da.from_array(image,
+                                                            chunks=5)})
+    features = run_to_completion(lazy)
+
+    assert in_memory == [(1, 1)]
+    for label in [4, 9]:
+        values = image[labels == label]
+        assert features.values_of('img mean', [label])[0] == values.mean()
+        assert features.values_of('img max', [label])[0] == values.max()
+
+
+def test_features_save_and_load(tmp_path):
+    features = LabelFeatures(np.array([4, 9]),
+                             {'volume': np.array([68.0, 20.0]),
+                              'img: mean [a.u.]': np.array([1.5, 2.5])})
+    path = tmp_path / 'features.npz'
+    features.save(path)
+
+    loaded = LabelFeatures.load(path)
+    assert loaded.names == features.names
+    assert loaded.values_of('img: mean [a.u.]', [9, 5])[0] == 2.5
+    assert np.isnan(loaded.values_of('volume', [9, 5])[1])
+
+
+def test_cached_features_check_image_files(tmp_path):
+    labels, image = make_volumes()
+    index = LabelIndex.from_arrays([labels])
+    image_path = tmp_path / 'image.npy'
+    np.save(image_path, image)
+    sources = {'img': image_signature(image, str(image_path))}
+
+    features = run_to_completion(iter_label_features(index, {'img': image}))
+    features.sources = sources
+    path = tmp_path / 'features.npz'
+    features.save(path)
+    assert load_cached_features(path, index, ['img mean'], sources) \
+        is not None
+
+    # a rewritten image file does not match the cache anymore
+    np.save(image_path, image[::-1])
+    os.utime(image_path, ns=(0, 0))
+    changed = {'img': image_signature(image, str(image_path))}
+    assert changed != sources
+    assert load_cached_features(path, index, ['img mean'], changed) is None
+    # nor does an image that cannot be identified
+    assert load_cached_features(path, index, ['img mean'],
+                                {'img': None}) is None
@@ -0,0 +1,67 @@
+import numpy as np
+
+from napari_u01.label_index import LabelIndex
+
+
+def make_class_volumes():
+    neuron = np.zeros((4, 10, 12), dtype=np.uint16)
+    glia = np.zeros((4, 10, 12), dtype=np.uint16)
+    neuron[1:3, 2:5, 3:7] = 7
+    neuron[0, 0, 0] = 2
+    glia[2:4, 6:9, 8:11] = 40
+    return neuron, glia
+
+
+def test_label_index_matches_full_scan():
+    neuron, glia = make_class_volumes()
+    index = LabelIndex.from_arrays([neuron, glia])
+
+    assert list(index.labels) == [2, 7, 40]
+    for label, data in [(2, neuron), (7, neuron), (40, glia)]:
+        z, y, x = np.where(data == label)
+        voxels = index.voxels_of(label)
+        assert np.array_equal(voxels[0], z)
+        assert np.array_equal(voxels[1], y)
+        assert np.array_equal(voxels[2], x)
+        assert index.size(label) == z.size
+        assert np.allclose(index.centroid(label),
+                           (z.mean(), y.mean(), x.mean()))
+        bbox = index.bounding_box(label)
+        assert bbox == (slice(z.min(), z.max() + 1),
+                        slice(y.min(), y.max() + 1),
+                        slice(x.min(), x.max() + 1))
+
+
+def test_label_index_missing_label():
+    neuron, glia = make_class_volumes()
+    index = LabelIndex.from_arrays([neuron, glia])
+
+    assert 5 not in index
+    assert 40 in index
+    assert index.size(5) == 0
+    assert index.centroid(5) is None
+    assert index.bounding_box(5) is None
+    assert index.voxels_of(5)[0].size == 0
+
+
+def test_label_index_voxels_of_many():
+    neuron, glia = make_class_volumes()
+    index = LabelIndex.from_arrays([neuron, glia])
+
+    flat_voxels, owners = index.flat_voxels_of_many([40, 5, 2])
+    assert np.array_equal(flat_voxels[owners == 0], index.flat_voxels(40))
+    assert not (owners == 1).any()
+    assert np.array_equal(flat_voxels[owners == 2], index.flat_voxels(2))
+
+
+def test_label_index_statistics_of_many():
+    neuron, glia = make_class_volumes()
+    index = LabelIndex.from_arrays([neuron, glia])
+
+    counts, centroids, bbox_min, bbox_max = index.statistics_of([7, 5, 40])
+    assert counts.tolist() == [24, 0, 18]
+    assert np.allclose(centroids[0], index.centroid(7))
+    assert np.isnan(centroids[1]).all()
+    assert bbox_min[2].tolist() == [2, 6, 8]
+    assert bbox_max[2].tolist() == [3, 8, 10]
+    assert bbox_min[1].tolist() == [-1, -1, -1]
@@ -0,0 +1,41 @@
+import numpy as np
+
+from napari_u01.synapse_index import PointGridIndex
+
+
+def make_points(n=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.random((n, 3)) * [20, 500, 400]).astype(np.float32)
+
+
+def test_query_box():
+    points = make_points()
+    index = PointGridIndex(points, bins_per_axis=16)
+    lo, hi = [9.5, 100, -np.inf], [10.5, 250.25, np.inf]
+
+    found = index.query(lo, hi)
+    expected = np.flatnonzero(np.all((points >= lo) & (points <= hi), axis=1))
+    np.testing.assert_array_equal(np.sort(found), expected)
+
+    assert len(index.query([30, 0, 0], [40, 10, 10])) == 0
+
+
+def test_query_decimated():
+    points = make_points()
+    index = PointGridIndex(points, bins_per_axis=16)
+    everywhere = [-np.inf] * 3, [np.inf] * 3
+
+    shown = index.query(*everywhere, max_points=2000)
+    assert 1800 < len(shown) < 2200
+    assert len(np.unique(shown)) == len(shown)
+    # the same points for the same box
+    np.testing.assert_array_equal(
+        shown, index.query(*everywhere, max_points=2000))
+    # a box with fewer points than max_points is not decimated
+    part = index.query([0, 0, 0], [1, 50, 50], max_points=2000)
+    assert len(part) == len(index.query([0, 0, 0], [1, 50, 50]))
+
+
+def test_empty_index():
+    index = PointGridIndex(np.zeros((0, 3), dtype=np.float32))
+    assert len(index.query([0, 0, 0], [1, 1, 1], max_points=10)) == 0
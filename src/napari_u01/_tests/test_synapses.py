@@ -0,0 +1,225 @@
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from napari_u01.synapse_io import iter_point_chunks, read_points, \
+    pair_colors, PAIR_COLUMNS
+from napari_u01 import synapses
+from napari_u01.synapses import SynapseModel, SynapseWidget
+
+
+@pytest.fixture
+def pairs():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(rng.random((1000, 6)) * 100, columns=PAIR_COLUMNS)
+
+
+def test_read_points_csv_chunks(tmp_path, pairs):
+    path = tmp_path / 'pairs.csv'
+    pairs.to_csv(path, index=False)
+
+    chunks = list(iter_point_chunks(path, ['z1', 'y1', 'x1'], chunk_rows=64))
+    assert len(chunks) > 1
+    assert all(chunk.dtype == np.float32 for chunk in chunks)
+
+    zyx = read_points(path, ['z1', 'y1', 'x1'], chunk_rows=64)
+    assert zyx.shape == (1000, 3) and zyx.dtype == np.float32
+    np.testing.assert_allclose(zyx, pairs[['z1', 'y1', 'x1']].values,
+                               rtol=1e-6)
+
+
+def test_read_points_without_pyarrow(tmp_path, pairs, monkeypatch):
+    path = tmp_path / 'pairs.csv'
+    pairs.to_csv(path, index=False)
+    # falls back to the chunked pandas parser
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+
+    zyx = read_points(path, ['x2', 'z2'], chunk_rows=300)
+    assert zyx.dtype == np.float32
+    np.testing.assert_allclose(zyx, pairs[['x2', 'z2']].values, rtol=1e-6)
+
+
+def test_get_points_parquet(tmp_path, pairs):
+    pytest.importorskip('pyarrow')
+    path = tmp_path / 'pairs.parquet'
+    pairs.to_parquet(path)
+
+    zyx1, zyx2, colors = SynapseModel.get_points(str(path))
+    assert zyx1.dtype == zyx2.dtype == np.float32
+    np.testing.assert_allclose(zyx2, pairs[['z2', 'y2', 'x2']].values,
+                               rtol=1e-6)
+    assert colors.shape == (1000, 3)
+
+    # chunks are copied into one array sized from the Parquet metadata
+    zyx = read_points(path, ['z1', 'y1', 'x1'], chunk_rows=64)
+    assert zyx.shape == (1000, 3) and zyx.flags.owndata
+    np.testing.assert_allclose(zyx, pairs[['z1', 'y1', 'x1']].values,
+                               rtol=1e-6)
+
+
+def test_get_points_single_and_invalid(tmp_path, pairs):
+    path = tmp_path / 'points.csv'
+    pairs[['z1', 'y1', 'x1']].set_axis(['z', 'y', 'x'], axis=1) \
+        .to_csv(path, index=False)
+    assert SynapseModel.get_points(str(path)).shape == (1000, 3)
+
+    path = tmp_path / 'other.csv'
+    pd.DataFrame({'a': [1.0]}).to_csv(path, index=False)
+    assert SynapseModel.get_points(str(path)) is None
+
+
+def test_pair_colors():
+    colors = pair_colors(10, seed=1)
+    assert colors.shape == (10, 3) and colors.dtype == np.float32
+    assert ((colors >= 0) & (colors < 1)).all()
+
+
+def test_large_cloud_shows_points_in_view(make_napari_viewer, monkeypatch):
+    monkeypatch.setattr(synapses, 'MAX_SHOWN_POINTS', 500)
+    viewer = make_napari_viewer()
+    widget = SynapseWidget(viewer)
+    rng = np.random.default_rng(0)
+    zyx = (rng.random((5000, 3)) * [10, 100, 100]).astype(np.float32)
+
+    widget.controller.add_points('synapses_0', zyx, pair_colors(len(zyx)))
+    layer = viewer.layers['synapses_0']
+    level_of_detail = widget.model.level_of_detail['synapses_0']
+    assert len(layer.data) == len(level_of_detail.shown) <= 550
+
+    # only the current slice is shown
+    viewer.dims.set_point(0, 4)
+    widget.controller.refresh_shown_points()
+    np.testing.assert_allclose(layer.data, zyx[level_of_detail.shown])
+    assert np.all(np.abs(layer.data[:, 0] - 4) <= 0.5)
+    np.testing.assert_allclose(layer.face_color[:, :3],
+                               level_of_detail.shown_colors(), rtol=1e-6)
+
+
+def test_close_disconnects_viewer(make_napari_viewer, qtbot):
+    viewer = make_napari_viewer()
+    widget = SynapseWidget(viewer)
+    qtbot.addWidget(widget)
+    timer = widget.controller.refresh_timer
+    assert timer.parent() is widget.view
+
+    viewer.camera.zoom = 2
+    assert timer.isActive()
+    widget.close()
+    assert not timer.isActive()
+    # navigating no longer schedules a refresh of the closed widget
+    viewer.camera.zoom = 3
+    viewer.dims.ndisplay = 3
+    assert not timer.isActive()
+
+
+def add_pairs(viewer, n_pairs=100):
+    widget = SynapseWidget(viewer)
+    rng = np.random.default_rng(0)
+    zyx = (rng.random((n_pairs, 6)) * 50).astype(np.float32)
+    pairs = synapses.SynapsePairs(pair_colors(n_pairs, seed=0))
+    widget.controller.add_points('tp1', zyx[:, :3], pairs=pairs)
+    widget.controller.add_points('tp2', zyx[:, 3:], pairs=pairs)
+    return widget, pairs, viewer.layers['tp1'], viewer.layers['tp2']
+
+
+def test_pairs_mirror_selection(make_napari_viewer):
+    widget, pairs, tp1, tp2 = add_pairs(make_napari_viewer())
+    assert widget.model.unique_pairs() == [pairs]
+
+    tp1.selected_data = {3, 7}
+    assert set(tp2.selected_data) == {3, 7}
+    assert pairs.active is tp1
+    tp2.selected_data = {5}
+    assert set(tp1.selected_data) == {5}
+    assert pairs.active is tp2
+
+
+def test_pairs_update_changed_points(make_napari_viewer):
+    widget, pairs, tp1, tp2 = add_pairs(make_napari_viewer())
+    sizes = []
+    tp2.events.size.connect(lambda event: sizes.append(event))
+
+    pairs.update(np.array([1, 2]), size=8, color=np.array([1, 0, 0]))
+    for layer in (tp1, tp2):
+        assert np.all(np.asarray(layer.size)[[1, 2]] == 8)
+        assert np.all(np.asarray(layer.size)[0] == 3)
+        np.testing.assert_allclose(layer.face_color[1], [1, 0, 0, 1])
+        np.testing.assert_allclose(layer.face_color[0, :3], pairs.colors[0])
+
+    # nothing changed, the layers are left alone
+    sizes.clear()
+    pairs.update(np.array([1, 2]), size=8)
+    assert sizes == []
+
+    tp1.selected_data = {4}
+    widget.controller.hide_selected_pairs()
+    assert not tp1.shown[4] and not tp2.shown[4]
+    assert tp1.shown.sum() == tp2.shown.sum() == 99
+    widget.controller.show_all_pairs()
+    assert tp2.shown.all()
+
+
+def test_pairs_styled_by_level_of_detail(make_napari_viewer, monkeypatch):
+    monkeypatch.setattr(synapses, 'MAX_SHOWN_POINTS', 50)
+    viewer = make_napari_viewer()
+    widget, pairs, tp1, tp2 = add_pairs(viewer, n_pairs=2000)
+    pairs.update(np.arange(0, 2000, 2), size=6)
+
+    viewer.dims.set_point(0, 20)
+    widget.controller.refresh_shown_points()
+    ids = widget.model.level_of_detail['tp2'].shown
+    sizes = np.asarray(tp2.size).reshape(len(ids), -1)[:, 0]
+    np.testing.assert_allclose(sizes, pairs.sizes[ids])
+    np.testing.assert_allclose(tp2.face_color[:, :3], pairs.colors[ids])
+
+
+def test_refresh_paired_and_unpaired(make_napari_viewer):
+    viewer = make_napari_viewer()
+    widget, pairs, tp1, tp2 = add_pairs(viewer)
+    rng = np.random.default_rng(1)
+    widget.controller.add_points('synapses_2',
+                                 rng.random((50, 3)).astype(np.float32))
+    single = viewer.layers['synapses_2']
+    outline = synapses._outline(single)
+
+    single.current_size = 7
+    single.current_face_color = 'red'
+    setattr(single, f'current_{outline}_color', 'blue')
+    tp1.current_size = 5
+    widget.view.refresh_button.click()
+    assert np.all(np.asarray(single.size) == 7)
+    np.testing.assert_allclose(single.face_color, [[1, 0, 0, 1]] * 50)
+    np.testing.assert_allclose(getattr(single, f'{outline}_color'),
+                               [[0, 0, 1, 1]] * 50)
+    for layer in (tp1, tp2):
+        assert np.all(np.asarray(layer.size) == 5)
+    np.testing.assert_allclose(tp2.face_color[:, :3], pairs.colors)
+
+    # refreshing again leaves the layers alone
+    events = []
+    for layer in (single, tp2):
+        layer.events.size.connect(events.append)
+        getattr(layer.events, f'{outline}_width').connect(events.append)
+    widget.view.refresh_button.click()
+    assert events == []
+
+
+def test_removed_layers_are_dropped(make_napari_viewer):
+    viewer = make_napari_viewer()
+    widget, pairs, tp1, tp2 = add_pairs(viewer)
+    tp1.name = 'renamed'
+
+    viewer.layers.remove(tp1)
+    assert list(widget.model.point_layers) == ['tp2']
+    assert [layer for layer, _ in pairs.layers] == [tp2]
+    assert pairs.active is tp2
+    # the removed layer no longer mirrors its selection
+    tp1.selected_data = {1}
+    assert set(tp2.selected_data) == set()
+
+    viewer.layers.remove(tp2)
+    assert widget.model.point_layers == {}
+    assert widget.model.unique_pairs() == []
+    widget.view.refresh_button.click()
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+import tifffile as tif
+
+from napari_u01.data_loader import DataLoaderModel
+from napari_u01.zarr_io import (convert_tiff_to_zarr, is_zarr_path,
+                                open_multiscale, write_multiscale)
+
+pytest.importorskip('zarr')
+
+
+def test_convert_tiff_to_zarr(tmp_path):
+    data = np.random.default_rng(0).integers(
+        0, 1000, size=(3, 300, 260), dtype=np.uint16)
+    tiff_path = str(tmp_path / 'stack.tif')
+    zarr_path = str(tmp_path / 'stack.zarr')
+    tif.imwrite(tiff_path, data)
+
+    convert_tiff_to_zarr(tiff_path, zarr_path, plane_chunk=64)
+    levels = open_multiscale(zarr_path)
+
+    assert is_zarr_path(zarr_path)
+    assert [level.shape for level in levels] == [
+        (3, 300, 260), (3, 150, 130), (3, 75, 65), (3, 37, 32)]
+    # one plane per chunk
+    assert levels[0].chunksize == (1, 64, 64)
+    assert np.array_equal(levels[0].compute(), data)
+
+
+def test_write_multiscale_labels(tmp_path):
+    labels = np.zeros((2, 100, 100), dtype=np.uint32)
+    labels[:, 10:50, 10:50] = 70000
+    zarr_path = str(tmp_path / 'labels.zarr')
+
+    write_multiscale(labels, zarr_path, labels=True, n_levels=3)
+    levels = open_multiscale(zarr_path)
+
+    assert len(levels) == 3
+    # subsampling keeps the label values
+    assert np.unique(levels[2].compute()).tolist() == [0, 70000]
+
+    assert len(open_multiscale(zarr_path, max_levels=1)) == 1
+
+    # as class labels only the full resolution is kept, writable
+    label_data, _ = DataLoaderModel().read_labels(
+        {'path': zarr_path, 'color': None})
+    assert isinstance(label_data, np.ndarray)
+    label_data[0, 0, 0] = 1
+    assert np.array_equal(label_data[:, 10:50, 10:50],
+                          labels[:, 10:50, 10:50])
+
+
+def test_open_n5_without_n5_store(tmp_path, monkeypatch):
+    import zarr
+    monkeypatch.delattr(zarr, 'N5Store', raising=False)
+    with pytest.raises(ImportError, match='zarr 2'):
+        open_multiscale(str(tmp_path / 'labels.n5'))
+
+
+def test_convert_compressed_tiff(tmp_path):
+    data = np.arange(2 * 40 * 30, dtype=np.uint16).reshape(2, 40, 30)
+    tiff_path = str(tmp_path / 'compressed.tif')
+    tif.imwrite(tiff_path, data, compression='zlib')
+
+    convert_tiff_to_zarr(tiff_path, str(tmp_path / 'compressed.zarr'))
+    levels = open_multiscale(str(tmp_path / 'compressed.zarr'))
+    assert np.array_equal(levels[0].compute(), data)
@@ -1,6 +1,9 @@
 from PyQt5.QtWidgets import QWidget, \
     QVBoxLayout, QListWidget, QLabel, QFileDialog
 import csv
+from napari.layers import Shapes
+
+from .instrumentation import logger, timed
 
 
 class LabelClassificationController:
@@ -8,9 +11,10 @@ class LabelClassificationController:
         self.model = model
         self.view = view
 
+    @timed()
     def on_label_selection(self, coordinates):
-        label = self.model.segmentation_summary_image[tuple(coordinates)]
-        print(f'Label selected: {label} at {coordinates}')
+        label = self.model.label_at(coordinates)
+        logger.debug('Label selected: %s at %s', label, coordinates)
         if label == 0:
             self.view.unhighlight_label()
             self.model.deselect_label()
@@ -21,22 +25,87 @@ class LabelClassificationController:
             self.view.highlight_label(label)
             self.model.select_label(label)
 
+    @timed()
     def on_keyboard_input(self, key):
-        print(f'Key pressed: {key}')
+        logger.debug('Key pressed: %s', key)
+        if key == 'Escape':
+            self.on_escape()
+            return
+        if self.model.selected_labels is not None:
+            self.on_keyboard_input_many(key)
+            return
         label = self.model.selected
-        if label is not None:
-            # if escape, deselect label
-            if key == 'Escape':
-                self.model.deselect_label()
-                self.view.unhighlight_label()
-            else:
-                class_name = self.model.class_per_key[key]
-                old_class_name = self.model.classify_label(label, class_name)
-
-            if key in list(self.model.class_per_key.keys()):
-                # Update the view
-                self.view.update_label_layers(label, old_class_name)
-                self.view.update_classified_labels_list()
+        if label is not None and key in self.model.class_per_key:
+            class_name = self.model.class_per_key[key]
+            old_class_name = self.model.classify_label(label, class_name)
+
+            # Update the view
+            self.view.update_label_layers(label, old_class_name)
+            self.view.update_classified_labels_list(label)
+
+    def on_escape(self):
+        # deselect the labels and show all rows of the table again
+        self.model.deselect_label()
+        self.view.unhighlight_label()
+        self.view.label_list.show_labels(None)
+
+    def on_keyboard_input_many(self, key):
+        # classify all selected labels in one update
+        if key in self.model.class_per_key:
+            changes = self.model.classify_labels(
+                self.model.selected_labels, self.model.class_per_key[key])
+            self.view.update_many_label_layers(changes)
+            self.view.label_list.update_labels()
+
+    def select_labels(self, labels):
+        logger.debug('Labels selected: %d', len(labels))
+        if len(labels) == 0:
+            self.model.deselect_label()
+            self.view.unhighlight_label()
+            return
+        self.model.select_labels(labels)
+        self.view.highlight_labels(labels)
+
+    def on_table_selection(self):
+        # several rows selected in the table are classified together
+        labels = self.view.label_list.get_selected_ids()
+        if len(labels) > 1:
+            self.select_labels(labels)
+        elif self.model.selected_labels is not None:
+            # back to one row, drop the previous selection
+            self.model.deselect_label()
+            self.view.unhighlight_label()
+
+    def on_select_shapes_click(self):
+        # shapes of the active Shapes layer, or of the first one
+        shapes_layers = [layer for layer in self.view.viewer.layers
+                         if isinstance(layer, Shapes)]
+        active = self.view.viewer.layers.selection.active
+        if isinstance(active, Shapes):
+            shapes_layers = [active]
+        if not shapes_layers:
+            logger.warning('Draw a box or lasso in a Shapes layer first.')
+            return
+        self.select_labels(self.model.labels_in_shapes(shapes_layers[0].data))
+
+    def on_select_range_click(self):
+        # select the labels with a feature in range, and show only them
+        label_list = self.view.label_list
+        name = label_list.feature_box.currentText()
+        if not name:
+            return
+        labels = self.model.labels_in_range(name,
+                                            label_list.min_value_box.value(),
+                                            label_list.max_value_box.value())
+        self.select_labels(labels)
+        label_list.show_labels(labels if len(labels) > 0 else None)
+
+    def on_rules_button_click(self):
+        changes = self.model.apply_rules()
+        logger.debug('Pre-classified %d labels by the rules.', len(changes))
+        self.view.update_many_label_layers(changes)
+        if changes:
+            self.view.label_list.update_labels()
 
     def on_double_click_label(self, item):
         # when label is double-clicked in the table
@@ -47,9 +116,36 @@ class LabelClassificationController:
         self.view.highlight_label(label)
         self.model.select_label(label)
 
-    def on_save_button_click(self):
-        filename, _ = QFileDialog.getSaveFileName(self.view.label_list,
-                                                  'Save to CSV', '',
+    def restore_session(self):
+        # replay the classification journal of a previous session
+        changes = self.model.replay_journal()
+        self.view.update_many_label_layers(changes)
+        if changes:
+            self.view.label_list.update_labels()
+
+    def on_import_button_click(self):
+        filename, _ = QFileDialog.getOpenFileName(self.view.label_list,
+                                                  'Import CSV', '',
                                                   'CSV Files (*.csv)')
         if filename:
+            changes = self.model.import_classified_labels(filename)
+            logger.debug('Imported classes of %d labels.', len(changes))
+            self.view.update_many_label_layers(changes)
+            if changes:
+                self.view.label_list.update_labels()
+
+    def on_compact_button_click(self):
+        self.model.compact_journal()
+
+    def on_save_button_click(self):
+        filename, _ = QFileDialog.getSaveFileName(
+            self.view.label_list, 'Save to CSV', '',
+            'CSV Files (*.csv);;Parquet Files (*.parquet);;'
+            'Feather Files (*.feather)')
+        if not filename:
+            return
+        if filename.lower().endswith(('.parquet', '.feather')):
+            # columnar table with the size and position of every label
+            self.model.save_label_table(filename)
+        else:
             self.model.save_classified_labels(filename)
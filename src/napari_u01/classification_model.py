@@ -1,13 +1,25 @@
 import csv
+import os
 import numpy as np
 import yaml
-from napari.layers import Labels
+from napari.layers import Image, Labels
+
+from .label_index import iter_scan_label_volumes, report_progress
+from .label_store import LabelClassStore
+from .journal import ClassificationJournal
+from .instrumentation import logger, span, timed
+from .label_features import LabelFeatures, iter_label_features, \
+    image_signature, load_cached_features, shape_features
+
+# names of the last axes of the label volumes, for exported columns
+AXES = 'zyx'
 
 
 # Model
 class LabelClassificationModel:
-    def __init__(self, layers, config_path=None):
+    def __init__(self, layers, config_path=None, initialize=True):
 
+        self.config_path = config_path
         self.config = {}
         if config_path is not None:
             self.load_config(config_path)
@@ -16,12 +28,24 @@ class LabelClassificationModel:
         # {class_name: np.ndarray, ...}
         # will put all labels in layers into segmentation data
         self.segmentation_data = {}
-        # summary image of all labels: all labels in one array
-        self.segmentation_summary_image = None
+        # layer metadata, {layer_name: dict, ...}
+        self.segmentation_metadata = {}
+        # image data, {layer_name: np.ndarray, ...}, for label features
+        self.image_data = {}
+        # file each image was read from, {layer_name: path or None}
+        self.image_paths = {}
         self.init_segmentation_data(layers)
 
+        # name of the layer holding the labels of all classes, if classes
+        # are only expressed through its colormap, None if there is
+        # one layer per class
+        self.shared_labels = self.config.get('shared_labels')
+
         # label value of the currently selected label
         self.selected = None
+        # labels selected together, e.g. in a region or in the table,
+        # None if only one label (or none) is selected
+        self.selected_labels = None
 
         # class-related information
         self.group_names = []
@@ -30,19 +54,48 @@ class LabelClassificationModel:
         self.class_per_key = {}
 
         # label-related information
-        self.labels_per_class = {}
-        # {label: {'class': 'neuron', 'subclass': 'excitatory'}, ...}
-        self.class_per_label = {}
+        # class of every label, used as {label: {'class': 'neuron'}, ...}
+        self.class_per_label = None
 
         # color information
         self.class_colors = {}
         self.class_colormaps = {}
+        # {label: color, ...} of the shared labels layer
+        self.shared_colormap = {}
+
+        # voxels, bounding box and centroid of every label
+        self.label_index = None
+
+        # append-only log of classification changes, to restore a session
+        self.journal = None
+        # classes as loaded, before any change
+        self.initial_class_index = None
+
+        # per-label features: volume, extent and image intensities
+        self.label_features = None
 
-        self.init_class_info()
-        self.init_labels_per_class()
-        self.init_class_per_label()
-        self.init_class_colormaps()
-        self.init_segmentation_summary_image()
+        # reading the labels can take long, so it can be left to
+        # initialize(), e.g. to run it in a worker thread
+        if initialize:
+            for _ in self.initialize():
+                pass
+
+    def initialize(self):
+        """
+        Read the labels and build the class information, label index and
+        colormaps. A generator yielding (text, steps done, total steps),
+        so it can run in a worker thread and be cancelled between steps.
+        """
+        with span('LabelClassificationModel.initialize'):
+            self.init_class_info()
+            # label index and label classes in one pass
+            yield from self.iter_label_index()
+            yield from self.iter_label_features()
+            self.init_class_colormaps()
+
+            self.initial_class_index = \
+                self.class_per_label.class_index.copy()
+            self.init_journal(self.config_path)
 
     def load_config(self, config_path):
         with open(config_path, 'r') as config_file:
@@ -73,80 +126,416 @@ class LabelClassificationModel:
                         else:
                             self.class_colors[sub_name] = color
 
+    def init_journal(self, config_path):
+        # journal path from the config, null disables it,
+        # next to the config file by default
+        if 'journal' in self.config:
+            path = self.config['journal']
+        elif config_path is not None:
+            path = os.path.splitext(config_path)[0] + '_journal.csv'
+        else:
+            path = None
+        if path is not None:
+            self.journal = ClassificationJournal(path)
+
     def init_segmentation_data(self, layers):
         for layer in layers:
             if isinstance(layer, Labels):
-                self.segmentation_data[layer.name] = layer.data
+                # full resolution level of multiscale labels
+                self.segmentation_data[layer.name] = \
+                    layer.data[0] if layer.multiscale else layer.data
+                self.segmentation_metadata[layer.name] = layer.metadata
+            elif isinstance(layer, Image):
+                self.image_data[layer.name] = \
+                    layer.data[0] if layer.multiscale else layer.data
+                # set by the data loader, or by napari when opening a file
+                self.image_paths[layer.name] = layer.metadata.get(
+                    'path', getattr(getattr(layer, 'source', None), 'path',
+                                    None))
 
-    def init_segmentation_summary_image(self):
-        class_name = self.class_names[0]
-        self.segmentation_summary_image = np.zeros(
-            self.segmentation_data[class_name].shape, dtype=np.uint16)
+    def iter_label_index(self):
+        # yields the progress of reading the labels
+        if self.shared_labels is not None:
+            yield from self.iter_shared_labels()
+            return
 
-        for class_name in self.class_names:
-            class_data = self.segmentation_data[class_name]
-            # assert that segmentation labels do not overlap between classes
-            assert np.sum(
-                self.segmentation_summary_image[class_data > 0]) == 0, \
-                "Segmentation labels overlap between classes!"
-            # add labels to summary image
-            self.segmentation_summary_image += class_data
-
-    def init_labels_per_class(self):
-        for class_name in self.class_names:
-            if class_name in self.segmentation_data:
-                self.labels_per_class[class_name] = set(
-                    np.unique(self.segmentation_data[class_name]))
-            else:
-                self.labels_per_class[class_name] = set()
+        # read all class layers once, building the label index and the
+        # class of every label at the same time
+        class_positions = [position for position, class_name
+                           in enumerate(self.class_names)
+                           if class_name in self.segmentation_data]
+        scan = iter_scan_label_volumes(
+            [self.segmentation_data[self.class_names[i]]
+             for i in class_positions], summary=False)
+        _, labels, layer_per_label, self.label_index = \
+            yield from report_progress('Reading labels...', scan)
 
-    def init_class_per_label(self):
-        for class_name in self.class_names:
-            for label in self.labels_per_class[class_name]:
-                self.class_per_label[label] = {'class': class_name}
+        # map layer positions to class positions
+        class_lookup = np.array(class_positions, dtype=np.int16)
+        self.class_per_label = LabelClassStore(
+            self.class_names, labels, class_lookup[layer_per_label])
+
+    def iter_shared_labels(self):
+        # all labels are already in one array
+        data = self.segmentation_data[self.shared_labels]
+        scan = iter_scan_label_volumes([data], summary=False)
+        _, labels, _, self.label_index = \
+            yield from report_progress('Reading labels...', scan)
+
+        # classes saved in the layer metadata by the data loader,
+        # labels without a class go to the first class
+        metadata = self.segmentation_metadata[self.shared_labels]
+        class_index_per_label = np.zeros(len(labels), dtype=np.int16)
+        if 'class_index_per_label' in metadata:
+            class_lookup = np.array(
+                [self.class_names.index(name) if name in self.class_names
+                 else 0 for name in metadata['class_names']] + [0],
+                dtype=np.int16)
+            saved = LabelClassStore(metadata['class_names'],
+                                    metadata['labels'],
+                                    metadata['class_index_per_label'])
+            class_index_per_label = class_lookup[saved.classes_of(labels)]
+
+        self.class_per_label = LabelClassStore(
+            self.class_names, labels, class_index_per_label)
+
+    @timed()
+    def label_at(self, coordinates):
+        """
+        Label value at the voxel coordinates, 0 for background. Only the
+        voxel is read from the class layers, so no array of all labels is
+        kept in memory.
+        """
+        if self.shared_labels is not None:
+            layer_names = [self.shared_labels]
+        else:
+            layer_names = [class_name for class_name in self.class_names
+                           if class_name in self.segmentation_data]
+        for layer_name in layer_names:
+            # int() also reads the value from lazily loaded (dask) labels
+            label = int(self.segmentation_data[layer_name][
+                tuple(coordinates)])
+            if label != 0:
+                return label
+        return 0
+
+    def features_path(self):
+        # features cache path from the config, true puts it next to the
+        # config file
+        path = self.config.get('features')
+        if path is True:
+            if self.config_path is None:
+                return None
+            return os.path.splitext(self.config_path)[0] + '_features.npz'
+        return path
+
+    def iter_label_features(self):
+        # yields the progress of reading the images, the intensity
+        # features read every image in full, so only if the config asks
+        # for them
+        if not self.config.get('features'):
+            self.label_features = LabelFeatures(
+                self.label_index.labels, shape_features(self.label_index))
+            return
+
+        # images of the same shape as the labels, one channel each
+        images = {name: data for name, data in self.image_data.items()
+                  if tuple(data.shape) == self.label_index.shape}
+        names = [f'{name} {stat}' for name in images
+                 for stat in ['mean', 'max']]
+        path = self.features_path()
+        sources = {}
+        if path is not None:
+            sources = {name: image_signature(data, self.image_paths.get(name))
+                       for name, data in images.items()}
+        self.label_features = load_cached_features(path, self.label_index,
+                                                   names, sources)
+        if self.label_features is not None:
+            return
+
+        self.label_features = yield from report_progress(
+            'Computing label features...',
+            iter_label_features(self.label_index, images))
+        self.label_features.sources = sources
+        # images that cannot be identified are not cached
+        if path is not None and None not in sources.values():
+            self.label_features.save(path)
+
+    def apply_rules(self):
+        """
+        Pre-classify labels by the rules in the config, e.g.
+        {'class': 'glia', 'volume': [None, 500]} puts all labels of at most
+        500 voxels in glia. Every feature of a rule is a [min, max] range,
+        None for no bound, and later rules win.
+        Returns [(label, old_class_name), ...] of the labels that changed.
+        """
+        store = self.class_per_label
+        features = self.label_features
+        positions = store.classes_of(features.labels)
+        for rule in self.config.get('rules') or []:
+            unknown = [name for name in rule
+                       if name != 'class' and name not in features]
+            if unknown:
+                logger.warning('Skipping the rule for %s, the features %s '
+                               'are not computed.', rule['class'], unknown)
+                continue
+            keep = np.ones(len(features.labels), dtype=bool)
+            for name, value_range in rule.items():
+                if name != 'class':
+                    keep &= features.in_range(name, *value_range)
+            positions[keep] = store.class_position(rule['class'])
+
+        changed = positions != store.classes_of(features.labels)
+        names = np.array(store.class_names, dtype=object)
+        changes = self.apply_classes(features.labels[changed],
+                                     names[positions[changed]])
+        self.record_changes(changes)
+        return changes
+
+    def get_layer_name(self, label):
+        # name of the layer that holds the label
+        if self.shared_labels is not None:
+            return self.shared_labels
+        return self.class_per_label[label]['class']
+
+    @property
+    def labels_per_class(self):
+        # {class_name: np.ndarray of labels, ...}
+        return {class_name: self.class_per_label.labels_in_class(class_name)
+                for class_name in self.class_names}
 
     def init_class_colormaps(self):
+        # all labels of a class layer share the class color, so the colormap
+        # only sets the background and the default color (None key) and does
+        # not need an entry, or an update, per label
         for class_name in self.class_names:
-            self.class_colormaps[class_name] = {}
-            for label in self.labels_per_class[class_name]:
-                self.class_colormaps[class_name][label] = self.class_colors[
-                    class_name]
-            self.class_colormaps[class_name][0] = 'transparent'
+            self.class_colormaps[class_name] = {
+                0: 'transparent', None: self.class_colors[class_name]}
 
-    def update_class_colormap(self, class_name, label):
-        # adds a new label to the class colormap
-        self.class_colormaps[class_name][label] = self.class_colors[
-            class_name]
+        if self.shared_labels is not None:
+            self.init_shared_colormap()
 
-    def classify_label(self, label, class_name):
-        print(f"Classifying label {label} as {class_name}.")
-        print(f"Old class: {self.class_per_label[label]['class']}.")
+    def init_shared_colormap(self):
+        # one entry per label, filled from the class of every label
+        labels = self.class_per_label.labels
+        # object array filled one by one, colors may be tuples
+        colors = np.empty(len(self.class_names), dtype=object)
+        for position, class_name in enumerate(self.class_names):
+            colors[position] = self.class_colors[class_name]
+        self.shared_colormap = dict(zip(
+            labels.tolist(),
+            colors[self.class_per_label.classes_of(labels)].tolist()))
+        self.shared_colormap[0] = 'transparent'
+
+    def update_shared_colormap(self, labels):
+        # give one or many labels the color of their new class,
+        # returns {label: color} of these labels
+        labels = np.atleast_1d(np.asarray(labels, dtype=np.int64))
+        store = self.class_per_label
+        colors = {label: self.class_colors[store.class_names[position]]
+                  for label, position in zip(
+                      labels.tolist(), store.classes_of(labels).tolist())}
+        self.shared_colormap.update(colors)
+        return colors
 
-        # first remove it from the old class
-        old_class_name = self.class_per_label[label]['class']
-        self.labels_per_class[old_class_name].remove(label)
+    @timed()
+    def classify_label(self, label, class_name):
+        logger.debug('Classifying label %s as %s.', label, class_name)
 
-        # now change classification
-        self.class_per_label[label] = {'class': class_name}
-        self.labels_per_class[class_name].add(label)
+        old_class_name = self.class_per_label.set_class(label, class_name)
+        if self.journal is not None:
+            self.journal.record(label, old_class_name, class_name)
 
-        print(f"New class: {self.class_per_label[label]['class']}.")
+        logger.debug('Old class: %s, new class: %s.', old_class_name,
+                     class_name)
 
         return old_class_name
 
+    def replay_journal(self):
+        """
+        Apply the latest class of every label in the journal.
+        Returns [(label, old_class_name), ...] of the labels that changed.
+        """
+        if self.journal is None:
+            return []
+        labels, class_names = self.journal.read_latest()
+
+        return self.apply_classes(labels, class_names)
+
+    @timed()
+    def apply_classes(self, labels, class_names):
+        """
+        Set the classes of many labels at once.
+        Returns [(label, old_class_name), ...] of the labels that changed.
+        """
+        store = self.class_per_label
+        labels = np.asarray(labels, dtype=np.int64)
+        class_names = np.asarray(class_names, dtype=object)
+
+        # class names are few, so they are mapped once each
+        unique_names, inverse = np.unique(class_names, return_inverse=True)
+        unique_positions = np.array([store.class_names.index(name)
+                                     if name in store.class_names else -1
+                                     for name in unique_names.tolist()],
+                                    dtype=np.int16)
+        positions = unique_positions[inverse.reshape(-1)]
+
+        # skip labels and classes that are not in this session
+        known = np.isin(labels, store.labels) & (positions >= 0)
+        labels, positions = labels[known], positions[known]
+
+        old_positions = store.set_classes(labels, positions)
+        changed = old_positions != positions
+        if self.shared_labels is not None and changed.any():
+            self.update_shared_colormap(labels[changed])
+        return [(label, store.class_names[old_position])
+                for label, old_position in zip(
+                    labels[changed].tolist(),
+                    old_positions[changed].tolist())]
+
+    @timed()
+    def import_classified_labels(self, filename):
+        """
+        Apply the classes of a CSV saved with save_classified_labels
+        (ID,Class,Subclass), e.g. to restore the classes of a single label
+        volume loaded as shared labels.
+        Returns [(label, old_class_name), ...] of the labels that changed.
+        """
+        import pandas as pd
+        try:
+            import pyarrow  # noqa: F401
+            engine = 'pyarrow'
+        except ImportError:
+            engine = 'c'
+        table = pd.read_csv(filename, engine=engine,
+                            dtype={'ID': 'int64', 'Class': str,
+                                   'Subclass': str})
+        class_column = table['Class'].fillna('')
+        subclass_column = table['Subclass'].fillna('')
+        class_names = class_column.where(subclass_column == '',
+                                         class_column + ':' + subclass_column)
+        changes = self.apply_classes(table['ID'].to_numpy(),
+                                     class_names.to_numpy(dtype=object))
+        self.record_changes(changes)
+        return changes
+
+    def classify_labels(self, labels, class_name):
+        """
+        Classify many labels at once, e.g. all labels in a region.
+        Returns [(label, old_class_name), ...] of the labels that changed.
+        """
+        logger.debug('Classifying %d labels as %s.', len(labels), class_name)
+        changes = self.apply_classes(
+            labels, np.full(len(labels), class_name, dtype=object))
+        self.record_changes(changes)
+        return changes
+
+    def record_changes(self, changes):
+        # journal many changes in one write
+        if self.journal is None or not changes:
+            return
+        store = self.class_per_label
+        labels = [label for label, _ in changes]
+        names = np.array(store.class_names, dtype=object)
+        self.journal.record_many(
+            labels, [old_class_name for _, old_class_name in changes],
+            names[store.classes_of(labels)].tolist())
+
+    def labels_in_shapes(self, shapes):
+        """
+        Labels inside any of the shapes, given as arrays of vertices like
+        the data of a napari Shapes layer. Boxes and lassos are polygons,
+        ellipses are taken as their bounding box.
+        """
+        selected = []
+        for vertices in shapes:
+            vertices = np.asarray(vertices)
+            plane = None
+            if vertices.shape[1] > 2:
+                # shape drawn on one plane of the volume
+                plane = np.round(vertices[0, :-2]).astype(np.int64)
+            selected.append(self.label_index.labels_in_polygon(vertices,
+                                                               plane))
+        if not selected:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(selected))
+
+    def labels_in_range(self, name, min_value=None, max_value=None):
+        # labels with a feature, e.g. 'volume', in [min_value, max_value]
+        return self.label_features.labels_in_range(name, min_value,
+                                                   max_value)
+
+    def compact_journal(self):
+        # rewrite the journal as the full table, one row per label with its
+        # class as loaded and its current class, dropping the history of
+        # intermediate changes
+        if self.journal is None:
+            return
+        store = self.class_per_label
+        names = np.array(store.class_names, dtype=object)
+        self.journal.rewrite(store.labels.tolist(),
+                             names[self.initial_class_index].tolist(),
+                             names[store.class_index].tolist())
+
+    def close(self):
+        # release the journal file, the model is not used anymore
+        if self.journal is not None:
+            self.journal.close()
+
+    @timed()
     def save_classified_labels(self, filename='classified_labels.csv'):
+        labels, class_names, subclass_names = \
+            self.class_per_label.export_columns()
         with open(filename, 'w', newline='') as csvfile:
             writer = csv.writer(csvfile)
             writer.writerow(['ID', 'Class', 'Subclass'])
-            for label, classification in self.class_per_label.items():
-                class_name = classification['class']
-                subclass_name = ''
-                if ":" in class_name:
-                    class_name, subclass_name = class_name.split(":")
-                writer.writerow([label, class_name, subclass_name])
+            writer.writerows(zip(labels.tolist(), class_names.tolist(),
+                                 subclass_names.tolist()))
+
+    def label_table(self):
+        """
+        Class, size, centroid and bounding box of every label as a pandas
+        DataFrame with one row per label, in the order of the labels.
+        """
+        import pandas as pd
+
+        labels, class_names, subclass_names = \
+            self.class_per_label.export_columns()
+        counts, centroids, bbox_min, bbox_max = \
+            self.label_index.statistics_of(labels)
+
+        columns = {'ID': labels,
+                   'Class': class_names.astype(str),
+                   'Subclass': subclass_names.astype(str),
+                   'Voxels': counts}
+        n_dims = centroids.shape[1]
+        axes = AXES[-n_dims:].upper() if n_dims <= len(AXES) \
+            else [str(axis) for axis in range(n_dims)]
+        for axis, name in enumerate(axes):
+            columns[f'Centroid {name}'] = centroids[:, axis]
+        for axis, name in enumerate(axes):
+            columns[f'BBox Min {name}'] = bbox_min[:, axis]
+            columns[f'BBox Max {name}'] = bbox_max[:, axis]
+        return pd.DataFrame(columns)
+
+    @timed()
+    def save_label_table(self, filename='classified_labels.parquet'):
+        # columnar export for analysis, Parquet or Feather by extension,
+        # both need pyarrow
+        table = self.label_table()
+        if str(filename).lower().endswith('.feather'):
+            table.to_feather(filename)
+        else:
+            table.to_parquet(filename, index=False)
 
     def select_label(self, label):
         self.selected = label
+        self.selected_labels = None
+
+    def select_labels(self, labels):
+        self.selected = None
+        self.selected_labels = np.asarray(labels, dtype=np.int64)
 
     def deselect_label(self):
         self.selected = None
+        self.selected_labels = None
@@ -4,22 +4,183 @@ import csv
 from PyQt5 import QtCore, QtWidgets
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel
 
+from .instrumentation import logger, timed
+from .label_colors import set_label_colors
+
 # name of the highlight layer
 HL_NAME = '_hightlight'
 
 
+class LabelTableModel(QtCore.QAbstractTableModel):
+    """
+    Table of labels and their classes, read directly from the model's
+    LabelClassStore. Qt only asks for the rows that are visible, so nothing
+    is copied per label.
+    """
+    class_headers = ['ID', 'Class', 'Subclass']
+
+    def __init__(self):
+        super().__init__()
+        self.store = None
+        # per-label features shown after the class columns, if any
+        self.features = None
+        self.headers = list(self.class_headers)
+        # position of the label in store.labels -> feature row
+        self.feature_rows = np.zeros(0, dtype=np.int64)
+        # store positions of the rows shown, None to show all labels
+        self.row_filter = None
+        # row -> position of the label in store.labels
+        self.order = np.zeros(0, dtype=np.int64)
+        # inverse of order: position of the label in store.labels -> row
+        self.row_of_position = np.zeros(0, dtype=np.int64)
+
+    def set_store(self, store, features=None):
+        self.beginResetModel()
+        self.store = store
+        self.features = features
+        self.headers = list(self.class_headers)
+        if store is not None and features is not None:
+            self.headers += features.names
+            self.feature_rows, _ = features.positions_of(store.labels)
+        self.row_filter = None
+        n_labels = len(store) if store is not None else 0
+        self.order = np.arange(n_labels)
+        self.row_of_position = np.arange(n_labels)
+        self.endResetModel()
+
+    def set_row_filter(self, positions):
+        # show only the labels at these positions of store.labels,
+        # None shows all, applied by the next sort
+        self.row_filter = None if positions is None \
+            else np.asarray(positions, dtype=np.int64)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.order)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.headers)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+        label = self.label_at(index.row())
+        if index.column() == 0:
+            return str(label)
+        if index.column() >= len(self.class_headers):
+            name = self.headers[index.column()]
+            row = self.feature_rows[self.order[index.row()]]
+            return f'{self.features[name][row]:.4g}'
+
+        class_name = self.store.class_of(label)
+        subclass_name = ''
+        if ":" in class_name:
+            class_name, subclass_name = class_name.split(":")
+        return class_name if index.column() == 1 else subclass_name
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal \
+                and role == QtCore.Qt.DisplayRole:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+
+    def flags(self, index):
+        return QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        if self.store is None:
+            return
+        labels = self.store.labels
+        if column == 0:
+            new_order = np.argsort(labels, kind='stable')
+        elif column >= len(self.class_headers):
+            values = self.features[self.headers[column]][self.feature_rows]
+            new_order = np.argsort(values, kind='stable')
+        else:
+            # rank the class name table once, then sort labels by rank
+            names = [name.split(':') + [''] for name in
+                     self.store.class_names]
+            names = [name[column - 1] for name in names] + ['']
+            _, ranks = np.unique(names, return_inverse=True)
+            classes = self.store.classes_of(labels)
+            new_order = np.lexsort((labels, ranks[classes]))
+        if order == QtCore.Qt.DescendingOrder:
+            new_order = new_order[::-1]
+
+        self.layoutAboutToBeChanged.emit()
+        # keep the selection on the same labels
+        old_indexes = self.persistentIndexList()
+        positions = [self.order[index.row()] for index in old_indexes]
+
+        self.order = new_order
+        self.row_of_position = np.empty_like(new_order)
+        self.row_of_position[new_order] = np.arange(len(new_order))
+        self.apply_row_filter()
+
+        new_indexes = [self.index(self.row_of_position[position],
+                                  index.column())
+                       for position, index in zip(positions, old_indexes)]
+        self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit()
+
+    def apply_row_filter(self):
+        # drop the filtered out labels from the sorted order
+        if self.row_filter is None:
+            return
+        shown = np.zeros(len(self.store), dtype=bool)
+        shown[self.row_filter] = True
+        self.order = self.order[shown[self.order]]
+        self.row_of_position = np.full(len(self.store), -1, dtype=np.int64)
+        self.row_of_position[self.order] = np.arange(len(self.order))
+
+    def label_at(self, row):
+        return int(self.store.labels[self.order[row]])
+
+    def row_of_label(self, label):
+        # rows stay in place when a label is reclassified,
+        # so the index only changes when sorting
+        if self.store is None:
+            return None
+        # store.labels is sorted, so the label is found by binary search
+        position = self.store.position_of(label)
+        if position is None or self.row_of_position[position] == -1:
+            return None
+        return int(self.row_of_position[position])
+
+    def labels_changed(self):
+        # after many labels are reclassified, repaint the class columns
+        # once, Qt only reads the visible rows
+        if len(self.order) > 0:
+            self.dataChanged.emit(self.index(0, 1),
+                                  self.index(len(self.order) - 1, 2))
+
+    def label_changed(self, label):
+        # only the class columns of the reclassified row need repainting
+        row = self.row_of_label(label)
+        if row is not None:
+            self.dataChanged.emit(self.index(row, 1), self.index(row, 2))
+
+
 class TableView(QtWidgets.QWidget):
     def __init__(self):
         super().__init__()
-        self.table = QtWidgets.QTableWidget()
+        self.model = LabelTableModel()
+        self.table = QtWidgets.QTableView()
+        self.table.setModel(self.model)
         self.table.setSelectionBehavior(
             QtWidgets.QAbstractItemView.SelectRows)
+        # several rows can be selected to classify them together
         self.table.setSelectionMode(
-            QtWidgets.QAbstractItemView.SingleSelection)
-        self.table.setColumnCount(3)
-        self.table.setHorizontalHeaderLabels(['ID', 'Class', 'Subclass'])
+            QtWidgets.QAbstractItemView.ExtendedSelection)
         self.table.setSortingEnabled(True)
-        self.table.setEditTriggers(QtWidgets.QTableWidget.NoEditTriggers)
+        self.table.sortByColumn(0, QtCore.Qt.AscendingOrder)
+        self.table.setEditTriggers(QtWidgets.QTableView.NoEditTriggers)
+        # fixed row heights, so Qt does not measure every row
+        self.table.verticalHeader().setSectionResizeMode(
+            QtWidgets.QHeaderView.Fixed)
 
         # Set the size policy for the table
         policy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Expanding,
@@ -30,43 +191,95 @@ class TableView(QtWidgets.QWidget):
         layout = QtWidgets.QVBoxLayout(self)
         layout.addWidget(self.table)
 
+        # Add buttons to select many labels at once: inside the shapes
+        # drawn in a Shapes layer, or by a range of a label feature,
+        # which also filters the table
+        self.select_shapes_button = QtWidgets.QPushButton('Select in Shapes')
+        layout.addWidget(self.select_shapes_button)
+        select_layout = QtWidgets.QHBoxLayout()
+        self.feature_box = QtWidgets.QComboBox()
+        self.min_value_box = QtWidgets.QDoubleSpinBox()
+        self.max_value_box = QtWidgets.QDoubleSpinBox()
+        for value_box in [self.min_value_box, self.max_value_box]:
+            value_box.setRange(-1e12, 1e12)
+            value_box.setDecimals(3)
+        self.max_value_box.setValue(self.max_value_box.maximum())
+        self.select_range_button = QtWidgets.QPushButton('Select')
+        select_layout.addWidget(self.feature_box)
+        select_layout.addWidget(self.min_value_box)
+        select_layout.addWidget(self.max_value_box)
+        select_layout.addWidget(self.select_range_button)
+        layout.addLayout(select_layout)
+
+        # Add a button to pre-classify labels by the rules in the config
+        self.rules_button = QtWidgets.QPushButton('Apply Rules')
+        layout.addWidget(self.rules_button)
+
         # Add a button to save the table data to a CSV file
         self.save_button = QtWidgets.QPushButton('Save to CSV')
         layout.addWidget(self.save_button)
 
+        # Add a button to load the classes of all labels from a CSV file
+        self.import_button = QtWidgets.QPushButton('Import CSV')
+        layout.addWidget(self.import_button)
+
+        # Add a button to compact the journal of classification changes
+        self.compact_button = QtWidgets.QPushButton('Compact Journal')
+        layout.addWidget(self.compact_button)
+
         # Connect the double-click event to the on_double_click method
-        # self.table.cellDoubleClicked.connect(self.on_double_click)
-
-    def populate(self, data_dict):
-        self.table.setRowCount(len(data_dict))
-        for row, (id_, classification) in enumerate(data_dict.items()):
-            class_name = classification['class']
-            subclass_name = ''
-            if ":" in class_name:
-                class_name, subclass_name = class_name.split(":")
-                # print(f"subclass found: {subclass_name}")
-
-            self.table.setItem(row, 0, QtWidgets.QTableWidgetItem(str(id_)))
-            self.table.setItem(row, 1, QtWidgets.QTableWidgetItem(class_name))
-            self.table.setItem(row, 2, QtWidgets.QTableWidgetItem(subclass_name))
-            for col in range(self.table.columnCount()):
-                self.table.item(row, col).setFlags(
-                    QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled)
+        # self.table.doubleClicked.connect(self.on_double_click)
+
+    @timed()
+    def populate(self, store, features=None):
+        self.model.set_store(store, features)
+        self.resort()
+        # features to select or filter labels by
+        names = features.names if features is not None else []
+        if names != [self.feature_box.itemText(i)
+                     for i in range(self.feature_box.count())]:
+            self.feature_box.clear()
+            self.feature_box.addItems(names)
+
+    def resort(self):
+        header = self.table.horizontalHeader()
+        self.model.sort(header.sortIndicatorSection(),
+                        header.sortIndicatorOrder())
+
+    def show_labels(self, labels=None):
+        # show only the given labels in the table, None shows all
+        positions = None
+        if labels is not None:
+            positions, known = self.model.store.positions_of(labels)
+            positions = positions[known]
+        self.model.set_row_filter(positions)
+        self.resort()
+
+    @timed()
+    def update_label(self, label):
+        self.model.label_changed(label)
+
+    @timed()
+    def update_labels(self):
+        self.model.labels_changed()
 
     def clear(self):
-        self.table.setRowCount(0)
+        self.model.set_store(None)
 
     def get_selected_id(self):
-        selected_row = self.table.currentRow()
+        selected_row = self.table.currentIndex().row()
         if selected_row == -1:
             return None
-        return int(self.table.item(selected_row, 0).text())
+        return self.model.label_at(selected_row)
+
+    def get_selected_ids(self):
+        rows = self.table.selectionModel().selectedRows()
+        return [self.model.label_at(index.row()) for index in rows]
 
     def select_label(self, label):
-        for row in range(self.table.rowCount()):
-            if int(self.table.item(row, 0).text()) == label:
-                self.table.selectRow(row)
-                break
+        row = self.model.row_of_label(label)
+        if row is not None:
+            self.table.selectRow(row)
 
     # not used at the moment, using model.save_classified_labels instead
     # but might be useful in the future to save with the
@@ -74,12 +287,10 @@ class TableView(QtWidgets.QWidget):
     def save_to_csv(self, filename):
         with open(filename, 'w', newline='') as csvfile:
             writer = csv.writer(csvfile)
-            writer.writerow(['ID', 'Class', 'Subclass'])
-            for row in range(self.table.rowCount()):
-                id_ = self.table.item(row, 0).text()
-                class_ = self.table.item(row, 1).text()
-                subclass = self.table.item(row, 2).text()
-                writer.writerow([id_, class_, subclass])
+            writer.writerow(self.model.headers)
+            for row in range(self.model.rowCount()):
+                writer.writerow([self.model.index(row, col).data()
+                                 for col in range(self.model.columnCount())])
 
 
 # View
@@ -100,6 +311,8 @@ class LabelClassificationView:
         layout.addWidget(self.label_list)
         self.label_list_window.setLayout(layout)
         self.label_list_window.show()
+        self.label_list.populate(self.model.class_per_label,
+                                 self.model.label_features)
 
         # keep track of the layers that are visible
         # when changing visibility from code
@@ -107,84 +320,183 @@ class LabelClassificationView:
         self.visible_layers = None
         self.update_visible_layers()
 
+        # voxels currently set in the highlight layer
+        self.highlighted_voxels = None
+
+        # class layers that already use the class colormap
+        self.colored_layers = set()
+        # color the shared labels layer by the classes in the model
+        if self.model.shared_labels is not None:
+            set_label_colors(self.viewer.layers[self.model.shared_labels],
+                             self.model.shared_colormap)
+
+    @timed()
     def update_label_layers(self, label, old_class_name=None):
         """
         Update the label layers when a label is classified or reclassified to
         a different class.
         """
+        # with all classes in one layer only the label color changes
+        if self.model.shared_labels is not None:
+            self.model.update_shared_colormap(label)
+            self.update_shared_colors()
+            return
+
+        # voxels of the label from the precomputed index,
+        # only these are written in both layers
+        voxels = self.model.label_index.voxels_of(label)
+
         # Remove the label from old class layer
-        segmentation_layer = self.viewer.layers[old_class_name]
-        mask = segmentation_layer.data == label
-        segmentation_layer.data[mask] = 0
-        segmentation_layer.refresh()
+        self.set_layer_voxels(self.viewer.layers[old_class_name], voxels, 0)
 
         # Add the label to the new class layer
         label_class = self.model.class_per_label[label]['class']
         segmentation_layer = self.viewer.layers[label_class]
-        segmentation_layer.data[mask] = label
-
-        # update colormap of the new class layer
-        self.model.update_class_colormap(label_class, label)
-        segmentation_layer.color = self.model.class_colormaps[label_class]
+        self.set_layer_voxels(segmentation_layer, voxels, label)
 
-        # refresh the layer to update the display
-        segmentation_layer.refresh()
+        # the class colormap colors any label, so it is set only once
+        if label_class not in self.colored_layers:
+            set_label_colors(segmentation_layer,
+                             self.model.class_colormaps[label_class])
+            self.colored_layers.add(label_class)
 
-    def update_classified_labels_list(self):
-        # Update the list of classified labels in the separate window
-        self.label_list.clear()
-        self.label_list.populate(self.model.class_per_label)
+    @timed()
+    def update_many_label_layers(self, changes):
+        """
+        Update the label layers after many labels changed class at once,
+        changes is [(label, old_class_name), ...]. Every layer is written
+        and refreshed only once.
+        """
+        if not changes:
+            return
+        # with all classes in one layer only the colors of the labels
+        # change, the model has updated them
+        if self.model.shared_labels is not None:
+            self.update_shared_colors()
+            return
+
+        store = self.model.class_per_label
+        labels = np.array([label for label, _ in changes], dtype=np.int64)
+        old_classes = np.array([store.class_position(old_class_name)
+                                for _, old_class_name in changes])
+        new_classes = store.classes_of(labels)
+        flat_voxels, owners = \
+            self.model.label_index.flat_voxels_of_many(labels)
+        shape = self.model.label_index.shape
+
+        for position in np.union1d(old_classes, new_classes).tolist():
+            class_name = store.class_names[position]
+            layer = self.viewer.layers[class_name]
+            # remove the labels that left the class, add the ones that
+            # joined it
+            left = old_classes[owners] == position
+            joined = new_classes[owners] == position
+            layer.data[np.unravel_index(flat_voxels[left], shape)] = 0
+            layer.data[np.unravel_index(flat_voxels[joined], shape)] = \
+                labels[owners[joined]]
+            layer.refresh()
+
+            if class_name not in self.colored_layers:
+                set_label_colors(layer, self.model.class_colormaps[class_name])
+                self.colored_layers.add(class_name)
+
+    def update_shared_colors(self):
+        # napari builds a new colormap from a whole {label: color} dict, so
+        # the shared labels layer is colored again from the model colormap
+        layer = self.viewer.layers[self.model.shared_labels]
+        set_label_colors(layer, self.model.shared_colormap)
+
+    @staticmethod
+    def set_layer_voxels(layer, voxels, value):
+        # napari >= 0.4.18 only refreshes the changed region of the layer
+        if hasattr(layer, 'data_setitem'):
+            layer.data_setitem(voxels, value)
+        else:
+            layer.data[voxels] = value
+            layer.refresh()
+
+    def update_classified_labels_list(self, label=None):
+        # Update the list of classified labels in the separate window,
+        # only the row of the given label if it is the only one that changed
+        if label is None:
+            self.label_list.populate(self.model.class_per_label,
+                                 self.model.label_features)
+        else:
+            self.label_list.update_label(label)
 
     def move_viewer_to_label(self, label):
         # Move the viewer to the center of the given label and zoom to the
         # specified box size
         label_class = self.model.class_per_label[label]['class']
-        segmentation_layer = self.viewer.layers[label_class]
-        mask = segmentation_layer.data == label
-        z, y, x = np.where(mask)
+        centroid = self.model.label_index.centroid(label)
 
-        if z.size > 0 and y.size > 0 and x.size > 0:
-            center_z, center_y, center_x = np.mean(z), np.mean(y), np.mean(x)
+        if centroid is not None:
+            center_z, center_y, center_x = centroid
             # camera.center: In 2D viewing only the last two values are used,
             # so setting the x and y
             self.viewer.camera.center = (center_z, center_y, center_x)
             # setting z
             self.viewer.dims.set_point(0, center_z)
         else:
-            print(f"Label {label} not found in {label_class} data.")
+            logger.warning('Label %s not found in %s data.', label,
+                           label_class)
 
+    @timed()
     def highlight_label(self, label):
         # looks like partseg highlights labels by adding a new layer too!
         # https://github.com/napari/napari/issues/3727
 
-        label_class = self.model.class_per_label[label]['class']
-        segmentation_layer = self.viewer.layers[label_class]
-        mask = segmentation_layer.data == label
+        segmentation_layer = self.viewer.layers[
+            self.model.get_layer_name(label)]
 
         segmentation_layer.selected_label = label
 
-        highlighted_labels = np.zeros_like(segmentation_layer.data)
-        highlighted_labels[mask] = 1  # label
-
-        # create a highlight layer if it doesn't exist yet
-        if HL_NAME not in self.viewer.layers:
-            self.viewer.add_labels(highlighted_labels,
-                                   name=HL_NAME,
-                                   blending='additive',
-                                   color={0: 'transparent', 1: 'white'})
-        else:
-            self.viewer.layers[HL_NAME].data = highlighted_labels
-        self.viewer.layers[HL_NAME].refresh()
+        # only clear the previous label and write the new one,
+        # the highlight buffer itself is allocated once
+        highlight_layer = self._get_highlight_layer(
+            self.model.label_index.shape)
+        if self.highlighted_voxels is not None:
+            self.set_layer_voxels(highlight_layer, self.highlighted_voxels, 0)
+        self.highlighted_voxels = self.model.label_index.voxels_of(label)
+        self.set_layer_voxels(highlight_layer, self.highlighted_voxels, 1)
 
         # select segmentation_layer layer to be active instead of highlight
         self.viewer.layers.selection.active = segmentation_layer
 
+    @timed()
+    def highlight_labels(self, labels):
+        # highlight many labels at once, written in one pass
+        highlight_layer = self._get_highlight_layer(
+            self.model.label_index.shape)
+        if self.highlighted_voxels is not None:
+            self.set_layer_voxels(highlight_layer, self.highlighted_voxels, 0)
+        flat_voxels, _ = self.model.label_index.flat_voxels_of_many(labels)
+        self.highlighted_voxels = np.unravel_index(
+            flat_voxels, self.model.label_index.shape)
+        self.set_layer_voxels(highlight_layer, self.highlighted_voxels, 1)
+
     def unhighlight_label(self):
         # remove label from _highlight layer if it exists
-        if HL_NAME in self.viewer.layers:
-            segmentation_layer = self.viewer.layers[HL_NAME]
-            segmentation_layer.data[segmentation_layer.data == 1] = 0
-            segmentation_layer.refresh()
+        if HL_NAME in self.viewer.layers \
+                and self.highlighted_voxels is not None:
+            self.set_layer_voxels(self.viewer.layers[HL_NAME],
+                                  self.highlighted_voxels, 0)
+        self.highlighted_voxels = None
+
+    def _get_highlight_layer(self, shape):
+        # create a highlight layer if it doesn't exist yet,
+        # or replace its buffer if it was made for data of another shape
+        if HL_NAME not in self.viewer.layers:
+            self.highlighted_voxels = None
+            highlight_layer = self.viewer.add_labels(
+                np.zeros(shape, dtype=np.uint8), name=HL_NAME,
+                blending='additive')
+            set_label_colors(highlight_layer, {0: 'transparent', 1: 'white'})
+        elif self.viewer.layers[HL_NAME].data.shape != shape:
+            self.highlighted_voxels = None
+            self.viewer.layers[HL_NAME].data = np.zeros(shape,
+                                                        dtype=np.uint8)
+        return self.viewer.layers[HL_NAME]
 
     def update_visible_layers(self):
         self.visible_layers = set()
@@ -6,19 +6,23 @@ import yaml
 from .classification_model import LabelClassificationModel
 from .classification_view import LabelClassificationView
 from .classification_controller import LabelClassificationController
+from .instrumentation import logger
 
 from .demo import demo_data
 
 import napari
+from napari.qt.threading import thread_worker
 from PyQt5.QtWidgets import QWidget
 
 if TYPE_CHECKING:
     import napari
 
-from PyQt5.QtWidgets import QLineEdit, QPushButton, QHBoxLayout, QVBoxLayout
+from PyQt5.QtWidgets import QLineEdit, QPushButton, QHBoxLayout, \
+    QVBoxLayout, QLabel, QProgressBar
 
 
-# Connect the keyboard input and double-click events to the controller
+# Connect the keyboard input and double-click events to the controller,
+# returns the [(layer, callback), ...] added to the layers
 def setup_classification_callbacks(controller, view, config):
     # Set up key bindings based on the config
     class_names = []
@@ -28,7 +32,7 @@ def setup_classification_callbacks(controller, view, config):
             name = classification['name']
             class_names.append(name)
 
-            @view.viewer.bind_key(key)
+            @view.viewer.bind_key(key, overwrite=True)
             def key_binding(viewer, the_key=key):
                 controller.on_keyboard_input(the_key)
 
@@ -38,28 +42,66 @@ def setup_classification_callbacks(controller, view, config):
                     sub_name = subclass['name']
                     class_names.append(f'{name}:{sub_name}')
 
-                    @view.viewer.bind_key(key)
+                    @view.viewer.bind_key(key, overwrite=True)
                     def key_binding(viewer, the_key=key):
                         controller.on_keyboard_input(the_key)
 
 
 
-    # Set up the mouse drag event
-    layer_names = [layer.name for layer in view.viewer.layers]
-    for layer_name in layer_names:
-        if layer_name in class_names:
-            @view.viewer.layers[layer_name].mouse_drag_callbacks.append
+    # Escape deselects the labels and shows all rows of the table
+    @view.viewer.bind_key('Escape', overwrite=True)
+    def escape_binding(viewer):
+        controller.on_keyboard_input('Escape')
+
+    # Set up the mouse drag event, on the shared labels layer
+    # if all classes are in one layer
+    if config.get('shared_labels') is not None:
+        class_names.append(config['shared_labels'])
+    mouse_callbacks = []
+    for layer in view.viewer.layers:
+        if layer.name in class_names:
             def select_label(layer, event):
                 coordinates = np.round(event.position).astype(int)
                 controller.on_label_selection(tuple(coordinates))
+            layer.mouse_drag_callbacks.append(select_label)
+            mouse_callbacks.append((layer, select_label))
 
     # Set up the list widget events
-    view.label_list.table.cellDoubleClicked.connect(
+    view.label_list.table.doubleClicked.connect(
         controller.on_double_click_label)
 
+    view.label_list.table.selectionModel().selectionChanged.connect(
+        lambda selected, deselected: controller.on_table_selection())
+
+    view.label_list.select_shapes_button.clicked.connect(
+        controller.on_select_shapes_click)
+
+    view.label_list.select_range_button.clicked.connect(
+        controller.on_select_range_click)
+
+    view.label_list.rules_button.clicked.connect(
+        controller.on_rules_button_click)
+
     view.label_list.save_button.clicked.connect(
         controller.on_save_button_click)
 
+    view.label_list.import_button.clicked.connect(
+        controller.on_import_button_click)
+
+    view.label_list.compact_button.clicked.connect(
+        controller.on_compact_button_click)
+
+    return mouse_callbacks
+
+
+def remove_classification_callbacks(view, mouse_callbacks):
+    # disconnect a view and its controller from the viewer, the key
+    # bindings are overwritten by the next setup_classification_callbacks
+    for layer, callback in mouse_callbacks:
+        if callback in layer.mouse_drag_callbacks:
+            layer.mouse_drag_callbacks.remove(callback)
+    view.label_list_window.close()
+
 
 class LabelClassificationWidget(QWidget):
     def __init__(self, napari_viewer: 'napari.viewer.Viewer' = None):
@@ -75,20 +117,115 @@ class LabelClassificationWidget(QWidget):
         config_layout.addWidget(self.config_textbox)
         config_layout.addWidget(self.config_button)
 
+        # Create the progress UI, only shown while the labels are read
+        self.progress_label = QLabel()
+        self.progress_bar = QProgressBar()
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_loading)
+        progress_layout = QHBoxLayout()
+        progress_layout.addWidget(self.progress_bar)
+        progress_layout.addWidget(self.cancel_button)
+
         # Create the main layout for the widget
         main_layout = QVBoxLayout()
         main_layout.addLayout(config_layout)
+        main_layout.addWidget(self.progress_label)
+        main_layout.addLayout(progress_layout)
+        self.hide_progress()
 
         # Set the main layout for the widget
         self.setLayout(main_layout)
 
+        # worker reading the labels, None when not loading
+        self.init_worker = None
+        self.init_failed = False
+        self.model = None
+        self.previous_model = None
+        self.view = None
+        self.controller = None
+        # mouse callbacks of the controller, removed on reload
+        self.mouse_callbacks = []
+
+    def closeEvent(self, event):
+        # release the journal when the widget, or the viewer, is closed
+        self.cancel_loading()
+        for model in [self.model, self.previous_model]:
+            if model is not None:
+                model.close()
+        super().closeEvent(event)
+
+    def show_progress(self, text):
+        self.progress_bar.setRange(0, 0)
+        self.progress_label.setText(text)
+        for widget in [self.progress_label, self.progress_bar,
+                       self.cancel_button]:
+            widget.show()
+
+    def hide_progress(self):
+        for widget in [self.progress_label, self.progress_bar,
+                       self.cancel_button]:
+            widget.hide()
+
     def load_config(self, napari_viewer):
+        # the labels are read in a background thread, the view and the
+        # key bindings are only set up once the model is ready
+        if self.init_worker is not None:
+            return
         config_path = self.config_textbox.text()
+        # the current model is kept until the new one is ready
+        self.previous_model = self.model
         self.model = LabelClassificationModel(napari_viewer.layers,
-                                              config_path)
+                                              config_path, initialize=False)
+        self.config_button.setEnabled(False)
+        self.show_progress("Loading...")
+        self.init_failed = False
+
+        worker = thread_worker(self.model.initialize)()
+        worker.yielded.connect(self.on_init_progress)
+        worker.errored.connect(self.on_init_error)
+        worker.finished.connect(
+            lambda: self.on_model_ready(napari_viewer))
+        worker.start()
+        self.init_worker = worker
+
+    def cancel_loading(self):
+        if self.init_worker is not None:
+            self.init_worker.quit()
+
+    def on_init_progress(self, progress):
+        text, done, total = progress
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+        self.progress_label.setText(text)
+
+    def on_init_error(self, error):
+        self.init_failed = True
+        logger.error('Loading failed: %s', error)
+
+    def on_model_ready(self, napari_viewer):
+        worker = self.init_worker
+        self.init_worker = None
+        self.config_button.setEnabled(True)
+        self.hide_progress()
+        if worker.abort_requested or self.init_failed:
+            # keep working with the model that was loaded before
+            self.model = self.previous_model
+            self.previous_model = None
+            return
+        if self.previous_model is not None:
+            self.previous_model.close()
+            self.previous_model = None
+
+        # the previous controller stops reacting to the viewer
+        if self.view is not None:
+            remove_classification_callbacks(self.view, self.mouse_callbacks)
+            self.mouse_callbacks = []
+
         self.view = LabelClassificationView(self.model, napari_viewer)
         self.controller = LabelClassificationController(self.model, self.view)
+        # restore the classifications of a previous session
+        self.controller.restore_session()
 
         # Set up the keyboard input and double-click events
-        setup_classification_callbacks(self.controller, self.view,
-                                       self.model.config)
+        self.mouse_callbacks = setup_classification_callbacks(
+            self.controller, self.view, self.model.config)
@@ -4,11 +4,23 @@ import yaml
 import napari
 import numpy as np
 import tifffile as tif
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from napari.layers import Image, Labels
+from napari.qt.threading import thread_worker
 from qtpy.QtWidgets import QFileDialog
 from qtpy.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
                             QLineEdit, QLabel, QFileDialog, QDialog,
-                            QGridLayout, QCheckBox)
+                            QGridLayout, QCheckBox, QProgressBar)
+
+from .instrumentation import logger, timed
+from .label_colors import set_label_colors
+from .label_index import scan_label_volumes
+from .zarr_io import is_zarr_path, open_multiscale, write_multiscale
+
+
+def full_resolution(layer):
+    # data of a layer, the first level if it is a multiscale pyramid
+    return layer.data[0] if layer.multiscale else layer.data
 
 
 class DataLoaderModel:
@@ -24,35 +36,285 @@ class DataLoaderModel:
             config = yaml.unsafe_load(config_file)
         self.config = config
 
+    def is_lazy(self, info):
+        # lazy loading is set per file, or for all files in the data section
+        return info.get('lazy', self.config['data'].get('lazy', False))
+
+    @staticmethod
+    def read_tiff(path, lazy=False, mode='r'):
+        """
+        Read a TIFF stack, or open it lazily so only the planes that are
+        viewed are read from disk.
+
+        mode is used for memory-mapped files: 'r' for read only, 'c' for
+        copy-on-write, where edits are kept in memory and not written back.
+        Data opened with 'c' is always writable.
+        """
+        if not lazy:
+            return tif.imread(path)
+        try:
+            # uncompressed contiguous data is mapped directly from disk
+            return tif.memmap(path, mode=mode)
+        except ValueError:
+            if mode != 'r':
+                # compressed or tiled data can not be mapped, data that is
+                # edited, like labels, is read into memory
+                return tif.imread(path)
+            return DataLoaderModel.read_tiff_pages(path)
+
+    @staticmethod
+    def read_tiff_pages(path):
+        """
+        Open a compressed or tiled TIFF as a read only dask array of its
+        pages. Every page is read on its own when it is viewed, opening the
+        file only for that read.
+        """
+        import dask.array as da
+        from dask import delayed
+
+        with tif.TiffFile(path) as tiff:
+            series = tiff.series[0]
+            shape, dtype = series.shape, series.dtype
+            page_shape = series.keyframe.shape
+        n_pages = int(np.prod(shape)) // int(np.prod(page_shape))
+        pages = [da.from_delayed(delayed(tif.imread)(path, key=key),
+                                 page_shape, dtype)
+                 for key in range(n_pages)]
+        return da.stack(pages).reshape(shape)
+
+    @timed()
+    def read_data(self, info, mode='r'):
+        # .zarr / .n5 stores are opened as multiscale pyramids,
+        # a list of arrays from full to lowest resolution
+        if is_zarr_path(info['path']):
+            levels = open_multiscale(info['path'])
+            return levels if len(levels) > 1 else levels[0]
+        return self.read_tiff(info['path'], lazy=self.is_lazy(info),
+                              mode=mode)
+
+    def read_image(self, img_info):
+        return self.read_data(img_info)
+
+    def read_labels(self, lbl_info):
+        if is_zarr_path(lbl_info['path']):
+            # label pyramids are loaded into memory: labels are moved
+            # between class layers when they are reclassified, which lower
+            # levels would not show, so only the full resolution is read,
+            # into a writable array
+            levels = open_multiscale(lbl_info['path'], max_levels=1)
+            label_data = np.array(levels[0])
+        else:
+            label_data = self.read_data(lbl_info, mode='c')
+        colormap = None
+        if lbl_info['color'] is not None:
+            colormap = self.create_colormap(lbl_info['color'])
+        return label_data, colormap
+
+    def add_image(self, img_info, image_data):
+        # the path identifies the image in the label features cache
+        image = Image(image_data, name=img_info['name'],
+                      multiscale=isinstance(image_data, list),
+                      metadata={'path': img_info['path']})
+        self.images[img_info['name']] = image
+        return image
+
+    def add_labels(self, lbl_info, label_data, colormap=None):
+        label = Labels(label_data, name=lbl_info['name'], properties={})
+        if colormap is not None:
+            set_label_colors(label, colormap)
+        self.labels[lbl_info['name']] = label
+        return label
+
     def load_images(self):
         for img_info in self.config['data']['images']:
-            image_data = tif.imread(img_info['path'])
-            image = Image(image_data, name=img_info['name'])
-            self.images[img_info['name']] = image
+            self.add_image(img_info, self.read_image(img_info))
 
     def load_labels(self):
         for lbl_info in self.config['data']['labels']:
-            label_data = tif.imread(lbl_info['path'])
-            label = Labels(label_data, name=lbl_info['name'], properties={})
-            if lbl_info['color'] is not None:
-                label.color = self.create_colormap(lbl_info['color'],
-                                                   label.data)
-            self.labels[lbl_info['name']] = label
+            self.add_labels(lbl_info, *self.read_labels(lbl_info))
+
+    def n_files(self):
+        return len(self.config['data']['images']) \
+            + len(self.config['data']['labels'])
+
+    def iter_read_data(self, max_workers=None):
+        """
+        Read all images and labels in a thread pool, tifffile releases the
+        GIL while decoding. Yields ('image', info, data) or
+        ('labels', info, (data, colormap)) as each file finishes. Layers
+        are not created here, so this can run outside of the main thread.
+        """
+        tasks = [('image', info, self.read_image)
+                 for info in self.config['data']['images']]
+        tasks += [('labels', info, self.read_labels)
+                  for info in self.config['data']['labels']]
+        if max_workers is None:
+            max_workers = min(len(tasks), os.cpu_count() or 1)
+
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as pool:
+            futures = {pool.submit(read, info): (kind, info)
+                       for kind, info, read in tasks}
+            for future in as_completed(futures):
+                kind, info = futures[future]
+                yield kind, info, future.result()
+
+    def iter_load_data(self, max_workers=None):
+        """
+        Read all files and create their layers, then merge the labels of
+        all classes if they are kept in one layer, the longest step. Yields
+        (text, layer) as each file is read and (text, None) before merging.
+        Layers are not added to a viewer, so this can run in a worker.
+        """
+        for kind, info, data in self.iter_read_data(max_workers):
+            if kind == 'image':
+                layer = self.add_image(info, data)
+            else:
+                layer = self.add_labels(info, *data)
+            yield f"Loaded {info['name']}", layer
+
+        if self.config.get('shared_labels') is not None:
+            yield 'Merging labels...', None
+            self.process_shared_labels(self.config['shared_labels'])
+
+    @timed()
+    def save_labels(self, layer_name, path, compression='zlib', data=None):
+        """
+        Write a label layer, or a snapshot of its data, to disk: as an
+        OME-Zarr pyramid if the path ends in .zarr, otherwise as a tiled,
+        compressed BigTIFF. Tiles are compressed in parallel by tifffile.
+        """
+        if data is None:
+            data = full_resolution(self.labels[layer_name])
+        if is_zarr_path(path):
+            write_multiscale(data, path, labels=True)
+        else:
+            # minisblack, so 3 or 4 planes are not taken for RGB(A)
+            tif.imwrite(path, np.asarray(data),
+                        bigtiff=True, tile=(256, 256),
+                        photometric='minisblack', compression=compression)
+        return path
+
+    def snapshot_labels(self, layer_names):
+        # copies of the label layers, taken on the Qt thread so labels
+        # reclassified while saving do not end up half in the files
+        return {layer_name: np.array(full_resolution(self.labels[layer_name]))
+                for layer_name in layer_names}
+
+    def iter_save_labels(self, paths, max_workers=None, snapshots=None):
+        """
+        Save several label layers in a thread pool, {layer_name: path},
+        from their snapshots if given. Yields the name of each layer once
+        it is written.
+        """
+        if max_workers is None:
+            max_workers = min(len(paths), os.cpu_count() or 1)
+        snapshots = snapshots or {}
+
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as pool:
+            futures = {pool.submit(self.save_labels, layer_name, path,
+                                   data=snapshots.get(layer_name)):
+                       layer_name for layer_name, path in paths.items()}
+            for future in as_completed(futures):
+                future.result()
+                yield futures[future]
 
     @staticmethod
-    def create_colormap(color, data):
-        unique_labels = np.unique(data)
-        colormap_dict = {label: color for label in unique_labels}
-        colormap_dict[0] = 'transparent'
-        return colormap_dict
+    def create_colormap(color):
+        # all labels get the same color: the None key sets the color of any
+        # label not in the dict, so the labels never have to be collected
+        return {0: 'transparent', None: color}
 
+    @staticmethod
+    def class_color(class_info, parent_class_info=None):
+        # parent color overwrites the class color
+        if parent_class_info is not None \
+                and parent_class_info['color'] is not None:
+            return parent_class_info['color']
+        return class_info['color']
+
+    @timed()
     def process_classifications(self):
+        # keep all classes in one layer if the config asks for it
+        if self.config.get('shared_labels') is not None:
+            self.process_shared_labels(self.config['shared_labels'])
+            return
+
         # process each classification group
         for group_dict in self.config['classifications']:
             group = group_dict['classes']
             for class_info in group:
                 self.process_class(class_info)
 
+    def iter_classes(self):
+        # (layer name, class info, parent class info) of all classes
+        # and subclasses, in the order of the config
+        for group_dict in self.config['classifications']:
+            for class_info in group_dict['classes']:
+                yield class_info['name'], class_info, None
+                for subclass_info in class_info.get('subclasses', []):
+                    yield (f"{class_info['name']}:{subclass_info['name']}",
+                           subclass_info, class_info)
+
+    def process_shared_labels(self, layer_name):
+        """
+        Put the labels of all classes into one layer. Class membership is
+        kept only in the colormap and in the layer metadata, so there is a
+        single label volume however many classes there are.
+        """
+        class_names, class_colors, sources, volume_classes = [], [], [], []
+        for class_name, class_info, parent_class_info in self.iter_classes():
+            logger.debug('Processing %s', class_name)
+            if class_info['labels'] is not None:
+                sources.append(self.labels.pop(class_info['labels']))
+                volume_classes.append(len(class_names))
+            class_names.append(class_name)
+            class_colors.append(
+                self.class_color(class_info, parent_class_info))
+
+        # label files are read into single arrays, see read_labels
+        volumes = [source.data for source in sources]
+        if not sources:
+            # no class has a labels file, the layer starts empty with the
+            # shape of the other loaded data
+            template = next(iter(self.labels.values()),
+                            next(iter(self.images.values()), None))
+            if template is None:
+                raise ValueError(f'No data to create {layer_name} for, '
+                                 f'load labels or images first.')
+            template = full_resolution(template)
+            data = np.zeros(template.shape, dtype=np.uint32)
+            labels = np.zeros(0, dtype=np.int64)
+            volume_per_label = np.zeros(0, dtype=np.int64)
+        elif len(sources) == 1:
+            # a single source is used as is
+            data = volumes[0]
+            _, labels, volume_per_label, _ = scan_label_volumes(
+                volumes, summary=False, index=False)
+        else:
+            data, labels, volume_per_label, _ = scan_label_volumes(
+                volumes, index=False)
+        volume_classes = np.array(volume_classes, dtype=np.int16)
+        class_index_per_label = volume_classes[volume_per_label]
+
+        # label -> color of its class, labels of classes without a color
+        # keep their default color (None)
+        # object array filled one by one, colors may be tuples
+        colors = np.empty(len(class_colors) + 1, dtype=object)
+        for position, color in enumerate(class_colors):
+            colors[position] = color
+        colormap = dict(zip(labels.tolist(),
+                            colors[class_index_per_label].tolist()))
+        colormap[0] = 'transparent'
+
+        layer = Labels(data, name=layer_name,
+                       metadata={'class_names': class_names,
+                                 'labels': labels,
+                                 'class_index_per_label':
+                                     class_index_per_label})
+        set_label_colors(layer, colormap)
+        self.labels[layer_name] = layer
+        return layer
+
     def _create_labels_layer(self, layer_name, data):
         layer = Labels(data, name=layer_name)
         self.labels[layer_name] = layer
@@ -70,7 +332,7 @@ class DataLoaderModel:
 
     def process_class(self, class_info, parent_class_info=None):
         class_name = class_info['name']
-        print(f"Processing {class_name}")
+        logger.debug('Processing %s', class_name)
         if parent_class_info is not None:
             parent_class_name = parent_class_info['name']
             layer_name = f"{parent_class_name}:{class_name}"
@@ -79,27 +341,23 @@ class DataLoaderModel:
 
         # create label layer if it doesn't exist in loaded labels
         if class_info['labels'] is None:
+            # np.zeros only takes memory for the parts that are painted,
+            # and stays a writable array if the labels are loaded lazily
+            template = full_resolution(next(iter(self.labels.values())))
             label_layer = self._create_labels_layer(
-                layer_name,
-                np.zeros_like(next(iter(self.labels.values())).data))
+                layer_name, np.zeros(template.shape, dtype=template.dtype))
         else:
             label_layer = self._assign_labels_layer(
                 layer_name,
                 self.labels[class_info['labels']])
 
         # set label layer color or overwrite existing color
-        color = class_info['color']
+        color = self.class_color(class_info, parent_class_info)
         if color is not None:
-            label_layer.color = self.create_colormap(color, label_layer.data)
-
-        if parent_class_info is not None:
-            parent_color = parent_class_info['color']
-            if parent_color is not None:
-                label_layer.color = self.create_colormap(parent_color,
-                                                         label_layer.data)
+            set_label_colors(label_layer, self.create_colormap(color))
 
         if 'subclasses' in class_info:
-            print(f"Processing subclasses of {class_name}...")
+            logger.debug('Processing subclasses of %s...', class_name)
             self.process_subclasses(class_info, class_info['subclasses'])
 
     def process_subclasses(self, class_info, subclasses_info):
@@ -127,6 +385,13 @@ class DataLoaderView(QWidget):
         layout.addWidget(self.load_button)
         self.setLayout(layout)
 
+        # Add progress UI, only shown while files are read
+        self.progress_label = QLabel()
+        self.progress_bar = QProgressBar()
+        layout.addWidget(self.progress_label)
+        layout.addWidget(self.progress_bar)
+        self.hide_progress()
+
         # Add Save Labels UI
         save_labels_layout = QHBoxLayout()
         self.save_path_edit = QLineEdit()
@@ -139,6 +404,21 @@ class DataLoaderView(QWidget):
         self.setLayout(layout)
         self.viewer = napari_viewer
 
+    def show_progress(self, n_steps, text):
+        self.progress_bar.setRange(0, n_steps)
+        self.progress_bar.setValue(0)
+        self.progress_label.setText(text)
+        self.progress_bar.show()
+        self.progress_label.show()
+
+    def step_progress(self, text):
+        self.progress_bar.setValue(self.progress_bar.value() + 1)
+        self.progress_label.setText(text)
+
+    def hide_progress(self):
+        self.progress_bar.hide()
+        self.progress_label.hide()
+
     def create_save_dialog(self, label_layers):
         save_dialog = QDialog(self)
         save_dialog.setWindowTitle("Save Labels")
@@ -175,6 +455,14 @@ class DataLoaderController:
         self.model = model
         self.view = view
 
+        # background loading of the data
+        self.load_worker = None
+        self.load_failed = False
+        # layers added while loading, some are replaced by class layers
+        self.loaded_layers = []
+        # background saving of the labels
+        self.save_worker = None
+
         # Connect signals and slots
         self.view.load_yaml_button.clicked.connect(self.load_yaml_config)
         self.view.load_button.clicked.connect(self.load_data)
@@ -201,15 +489,63 @@ class DataLoaderController:
             self.view.yaml_path_edit.setText(yaml_path)
 
     def load_data(self):
-        self.model.load_images()
-        self.model.load_labels()
-        self.model.process_classifications()
-
-        for image in self.model.images.values():
-            self.view.viewer.add_layer(image)
-
+        # read the files and merge shared labels in a background thread,
+        # adding each layer to the viewer as soon as its file is read
+        self.view.load_button.setEnabled(False)
+        self.view.show_progress(self.model.n_files(), "Loading...")
+        self.load_failed = False
+        self.loaded_layers = []
+
+        worker = thread_worker(self.model.iter_load_data)()
+        worker.yielded.connect(self.on_file_read)
+        worker.returned.connect(self.on_data_processed)
+        worker.finished.connect(self.on_data_read)
+        worker.errored.connect(self.on_load_error)
+        worker.start()
+        self.load_worker = worker
+
+    def on_file_read(self, result):
+        text, layer = result
+        if layer is None:
+            # merging shared labels, which is not one of the files
+            self.view.progress_label.setText(text)
+            return
+        self.view.viewer.add_layer(layer)
+        self.loaded_layers.append(layer)
+        self.view.step_progress(text)
+
+    def on_data_processed(self, result=None):
+        # shared labels were merged in the worker, class layers are only
+        # renamed or created here
+        if self.model.config.get('shared_labels') is None:
+            self.model.process_classifications()
+
+        # remove the label layers that were replaced and add the new ones
+        for layer in self.loaded_layers:
+            if isinstance(layer, Labels) \
+                    and layer not in self.model.labels.values() \
+                    and layer in self.view.viewer.layers:
+                self.view.viewer.layers.remove(layer)
         for label in self.model.labels.values():
-            self.view.viewer.add_layer(label)
+            if label not in self.view.viewer.layers:
+                self.view.viewer.add_layer(label)
+
+        # files finish in any order, the layers are put in the order of the
+        # config with the images below the labels
+        layers = self.view.viewer.layers
+        for layer in list(self.model.images.values()) \
+                + list(self.model.labels.values()):
+            layers.move(layers.index(layer), len(layers))
+        # the replaced layers are not kept alive
+        self.loaded_layers = []
+
+    def on_data_read(self):
+        self.view.load_button.setEnabled(True)
+        self.view.hide_progress()
+
+    def on_load_error(self, error):
+        self.load_failed = True
+        logger.error('Loading failed: %s', error)
 
     def save_label_layers(self):
         current_path = self.view.save_path_edit.text()
@@ -227,13 +563,33 @@ class DataLoaderController:
                 self.view.create_save_dialog(self.model.labels.values())
 
             if save_dialog.exec_() == QDialog.Accepted:
+                paths = {}
                 for checkbox, line_edit in zip(checkboxes, line_edits):
                     if checkbox.isChecked():
                         file_name = line_edit.text()
                         layer_name = checkbox.text()
-
-                        tif.imwrite(os.path.join(save_dir, file_name),
-                                    self.model.labels[layer_name].data)
+                        paths[layer_name] = os.path.join(save_dir, file_name)
+                if paths:
+                    self.save_in_background(paths)
+
+    def save_in_background(self, paths):
+        # write the layers in parallel in a background thread
+        self.view.save_labels_button.setEnabled(False)
+        self.view.show_progress(len(paths), "Saving...")
+
+        worker = thread_worker(self.model.iter_save_labels)(
+            paths, snapshots=self.model.snapshot_labels(paths))
+        worker.yielded.connect(
+            lambda layer_name: self.view.step_progress(f"Saved {layer_name}"))
+        worker.finished.connect(self.on_labels_saved)
+        worker.errored.connect(
+            lambda error: logger.error('Saving failed: %s', error))
+        worker.start()
+        self.save_worker = worker
+
+    def on_labels_saved(self):
+        self.view.save_labels_button.setEnabled(True)
+        self.view.hide_progress()
 
 
 # _________________________________________________________________
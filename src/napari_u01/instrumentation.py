@@ -0,0 +1,138 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from collections import deque
+from functools import wraps
+
+# messages of the plugin, e.g. classification changes, are logged here
+# instead of printed, at debug level
+logger = logging.getLogger('napari_u01')
+
+# NAPARI_U01_TIMING=1 records the duration of the hot paths, shown in the
+# Latency widget, any other value is taken as a file to also log them to.
+# Unset or 0 disables timing, the timed functions are then left unwrapped.
+TIMING = os.environ.get('NAPARI_U01_TIMING', '')
+ENABLED = TIMING not in ('', '0')
+# the timings are only logged when there is a file to log them to
+LOG_TIMINGS = ENABLED and TIMING != '1'
+
+
+class Timings:
+    """
+    Latest durations of every span, in seconds. Spans are recorded from
+    worker threads too, appending to a deque is thread safe.
+    """
+
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self.samples = {}
+
+    def record(self, name, seconds):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples.setdefault(
+                name, deque(maxlen=self.max_samples))
+        samples.append(seconds)
+        if LOG_TIMINGS:
+            # queued, the file is written by the logging thread
+            logger.info('%s %.3f ms', name, seconds * 1000)
+
+    def summary(self):
+        # {name: (count, last, mean, max)} in milliseconds
+        summary = {}
+        for name, samples in list(self.samples.items()):
+            values = list(samples)
+            if values:
+                summary[name] = (len(values), values[-1] * 1000,
+                                 sum(values) / len(values) * 1000,
+                                 max(values) * 1000)
+        return summary
+
+    def clear(self):
+        self.samples = {}
+
+
+timings = Timings()
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        timings.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoSpan:
+    # shared do-nothing span used when timing is disabled
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """
+    Time a block of code, e.g. with span('model.initialize'): ...
+    """
+    if not ENABLED:
+        return _NO_SPAN
+    return _Span(name)
+
+
+def timed(name=None):
+    """
+    Decorator timing every call of a function, under its qualified name by
+    default. When timing is disabled the function itself is returned, so
+    it costs nothing.
+    """
+    def decorate(func):
+        if not ENABLED:
+            return func
+        span_name = name or func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings.record(span_name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def _init_logging():
+    if not LOG_TIMINGS:
+        return
+    logger.setLevel(logging.INFO)
+    # records are put in a queue and written to the file by a background
+    # thread, so timing the Qt thread does not make it wait for the disk
+    handler = logging.FileHandler(TIMING)
+    handler.setFormatter(logging.Formatter(
+        '%(asctime)s %(threadName)s %(message)s'))
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    return listener
+
+
+_init_logging()
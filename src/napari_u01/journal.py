@@ -0,0 +1,80 @@
+import csv
+import os
+from datetime import datetime
+
+import numpy as np
+
+
+class ClassificationJournal:
+    """
+    Append-only CSV log of classification changes, one row per keypress,
+    so a session can be restored after a crash without rewriting the
+    whole table on every change.
+    """
+    header = ['Time', 'ID', 'Old Class', 'New Class']
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._writer = None
+
+    def open(self):
+        is_new = not os.path.exists(self.path) \
+            or os.path.getsize(self.path) == 0
+        self._file = open(self.path, 'a', newline='')
+        self._writer = csv.writer(self._file)
+        if is_new:
+            self._writer.writerow(self.header)
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
+
+    def record(self, label, old_class_name, new_class_name):
+        if self._file is None:
+            self.open()
+        self._writer.writerow([datetime.now().isoformat(timespec='seconds'),
+                               int(label), old_class_name, new_class_name])
+        # flush on every change, so nothing is lost if the app crashes
+        self._file.flush()
+
+    def record_many(self, labels, old_class_names, new_class_names):
+        # one write for a bulk change, e.g. an imported table
+        if self._file is None:
+            self.open()
+        time = datetime.now().isoformat(timespec='seconds')
+        self._writer.writerows(zip([time] * len(labels), labels,
+                                   old_class_names, new_class_names))
+        self._file.flush()
+
+    def read_latest(self):
+        """
+        Latest class of every label in the journal, as an array of labels
+        and a list of class names.
+        """
+        if not os.path.exists(self.path):
+            return np.zeros(0, dtype=np.int64), []
+        with open(self.path, newline='') as csvfile:
+            rows = list(csv.reader(csvfile))[1:]
+        if not rows:
+            return np.zeros(0, dtype=np.int64), []
+
+        labels = np.array([row[1] for row in rows], dtype=np.int64)
+        class_names = np.array([row[3] for row in rows], dtype=object)
+        # last change of every label wins
+        reversed_labels = labels[::-1]
+        unique_labels, last = np.unique(reversed_labels, return_index=True)
+        return unique_labels, class_names[::-1][last].tolist()
+
+    def rewrite(self, labels, old_class_names, new_class_names):
+        # replace the whole journal, e.g. with a compacted version
+        self.close()
+        time = datetime.now().isoformat(timespec='seconds')
+        with open(self.path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(self.header)
+            writer.writerows(zip([time] * len(labels), labels,
+                                 old_class_names, new_class_names))
@@ -0,0 +1,65 @@
+import numpy as np
+
+# napari 0.4 colors a Labels layer with a dict (layer.color), later versions
+# with a DirectLabelColormap (layer.colormap), both are set from the same
+# {label: color} dicts here
+
+
+def _uses_color_dict(layer):
+    return 'color' in dir(type(layer))
+
+
+def _uncolored_layer():
+    from napari.layers import Labels
+    return Labels(np.zeros((1, 1), dtype=np.uint8))
+
+
+def default_label_colors(labels):
+    """
+    {label: color} of the colors napari gives the labels of a layer that is
+    not colored, as hex strings, which napari converts faster than arrays.
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    layer = _uncolored_layer()
+    if _uses_color_dict(layer):
+        rgba = [layer.get_color(label) for label in labels.tolist()]
+    else:
+        rgba = layer.colormap.map(labels)
+    rgba = np.round(np.reshape(rgba, (-1, 4)) * 255).astype(np.uint8)
+    return {label: '#' + color.tobytes().hex()
+            for label, color in zip(labels.tolist(), rgba)}
+
+
+def set_label_colors(layer, colors):
+    """
+    Color the labels of a layer with a {label: color} dict, the None key
+    sets the color of the labels that are not in it. Labels with the color
+    None keep the color napari gives them by default.
+    """
+    colors = dict(colors)
+    colors.setdefault(0, 'transparent')
+    colors.setdefault(None, 'black')
+    if colors[None] is None and set(colors) == {0, None}:
+        # all labels keep their default colors
+        if _uses_color_dict(layer):
+            layer.color = {}
+        else:
+            layer.colormap = _uncolored_layer().colormap
+        return
+    uncolored = [label for label, color in colors.items()
+                 if color is None and label is not None]
+    colors.update(default_label_colors(uncolored))
+    if colors[None] is None:
+        colors[None] = 'black'
+
+    if _uses_color_dict(layer):
+        layer.color = colors
+    elif set(colors) == {0, None}:
+        # one color for all labels, e.g. a class layer, needs no lookup
+        # table of label values
+        from napari.utils.colormaps import CyclicLabelColormap
+        layer.colormap = CyclicLabelColormap(
+            colors=[colors[0], colors[None]])
+    else:
+        from napari.utils.colormaps import DirectLabelColormap
+        layer.colormap = DirectLabelColormap(color_dict=colors)
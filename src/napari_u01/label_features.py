@@ -0,0 +1,176 @@
+import hashlib
+import os
+
+import numpy as np
+
+
+class LabelFeatures:
+    """
+    Per-label features, one column per feature aligned with the sorted
+    labels of a LabelIndex, e.g. {'volume': ..., 'nuclei mean': ...}.
+    `sources` has the signature of every image the intensity features were
+    read from, see image_signature.
+    """
+
+    def __init__(self, labels, columns=None, sources=None):
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.columns = dict(columns) if columns is not None else {}
+        self.sources = dict(sources) if sources is not None else {}
+
+    @property
+    def names(self):
+        return list(self.columns)
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def positions_of(self, labels):
+        # rows of many labels, and which of them have features
+        labels = np.asarray(labels, dtype=np.int64)
+        if len(self.labels) == 0:
+            return (np.zeros(len(labels), dtype=np.int64),
+                    np.zeros(len(labels), dtype=bool))
+        pos = np.minimum(np.searchsorted(self.labels, labels),
+                         len(self.labels) - 1)
+        return pos, self.labels[pos] == labels
+
+    def values_of(self, name, labels):
+        # feature values of an array of labels, NaN if not known
+        pos, known = self.positions_of(labels)
+        values = np.full(len(pos), np.nan)
+        values[known] = self.columns[name][pos[known]]
+        return values
+
+    def in_range(self, name, min_value=None, max_value=None):
+        # mask of the labels with min_value <= feature <= max_value
+        values = self.columns[name]
+        keep = np.ones(len(self.labels), dtype=bool)
+        if min_value is not None:
+            keep &= values >= min_value
+        if max_value is not None:
+            keep &= values <= max_value
+        return keep
+
+    def labels_in_range(self, name, min_value=None, max_value=None):
+        return self.labels[self.in_range(name, min_value, max_value)]
+
+    def save(self, path):
+        # column names are stored apart, they may contain any character
+        np.savez(path, labels=self.labels,
+                 names=np.array(self.names, dtype=str),
+                 source_names=np.array(list(self.sources), dtype=str),
+                 source_signatures=np.array(list(self.sources.values()),
+                                            dtype=str),
+                 **{f'column_{i}': column for i, column
+                    in enumerate(self.columns.values())})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as saved:
+            names = saved['names'].tolist()
+            sources = {}
+            if 'source_names' in saved:
+                sources = dict(zip(saved['source_names'].tolist(),
+                                   saved['source_signatures'].tolist()))
+            return cls(saved['labels'],
+                       {name: saved[f'column_{i}']
+                        for i, name in enumerate(names)}, sources)
+
+
+def shape_features(label_index):
+    """
+    Volume in voxels and extent (volume over bounding box volume) of every
+    label, read from the index.
+    """
+    box_volume = np.prod(label_index.bbox_max - label_index.bbox_min + 1,
+                         axis=1)
+    return {'volume': label_index.counts.astype(np.float64),
+            'extent': label_index.counts / np.maximum(box_volume, 1)}
+
+
+def voxel_values(label_index, image, planes_per_slab=16):
+    """
+    Image values at all indexed voxels, in the order of the index.
+    Images that are not in memory (e.g. dask) are read slab by slab.
+    """
+    if isinstance(image, np.ndarray):
+        return np.asarray(image).reshape(-1)[label_index.voxels]
+
+    # sort the voxels by position once, then take each slab's share
+    order = np.argsort(label_index.voxels, kind='stable')
+    sorted_voxels = label_index.voxels[order]
+    values = np.empty(len(order), dtype=image.dtype)
+    plane_size = int(np.prod(label_index.shape[1:], dtype=np.int64))
+    for start in range(0, label_index.shape[0], planes_per_slab):
+        stop = min(start + planes_per_slab, label_index.shape[0])
+        lo, hi = np.searchsorted(sorted_voxels, [start * plane_size,
+                                                 stop * plane_size])
+        if lo == hi:
+            continue
+        slab = np.asarray(image[start:stop]).reshape(-1)
+        values[order[lo:hi]] = slab[sorted_voxels[lo:hi].astype(np.int64)
+                                    - start * plane_size]
+    return values
+
+
+def iter_label_features(label_index, images):
+    """
+    Compute the shape features and the mean and max intensity of every
+    label in every image, one pass per image. A generator yielding
+    (images done, total images); the LabelFeatures are its return value.
+    """
+    columns = shape_features(label_index)
+    starts = label_index.starts[:-1]
+    for done, (name, image) in enumerate(images.items()):
+        if len(label_index) > 0:
+            # the voxels of every label are one run in the index,
+            # so reduceat gives the per-label statistics
+            values = voxel_values(label_index, image)
+            columns[f'{name} mean'] = np.add.reduceat(
+                values, starts, dtype=np.float64) / label_index.counts
+            columns[f'{name} max'] = np.maximum.reduceat(
+                values, starts).astype(np.float64)
+        else:
+            columns[f'{name} mean'] = np.zeros(0)
+            columns[f'{name} max'] = np.zeros(0)
+        yield done + 1, len(images)
+    return LabelFeatures(label_index.labels, columns)
+
+
+def image_signature(image, path=None):
+    """
+    Identifies the content of an image for the features cache: the path,
+    size and modification time of the file it was read from, or a hash of
+    the data if it is in memory. None if neither is known, e.g. for a lazy
+    image without a file.
+    """
+    if path is not None and os.path.exists(path):
+        stat = os.stat(path)
+        return f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+    if isinstance(image, np.ndarray):
+        digest = hashlib.sha1(np.ascontiguousarray(image)).hexdigest()
+        return f'{image.dtype}{image.shape}:{digest}'
+    return None
+
+
+def load_cached_features(path, label_index, names, sources=None):
+    # features saved for the same labels with all the needed columns, read
+    # from the same images ({name: signature}), None if there are none
+    sources = sources or {}
+    if path is None or not os.path.exists(path) \
+            or None in sources.values():
+        return None
+    try:
+        features = LabelFeatures.load(path)
+    except (OSError, ValueError, KeyError):
+        return None
+    if not np.array_equal(features.labels, label_index.labels) \
+            or not set(names) <= set(features.names) \
+            or not np.array_equal(features['volume'], label_index.counts) \
+            or any(features.sources.get(name) != signature
+                   for name, signature in sources.items()):
+        return None
+    return features
@@ -0,0 +1,300 @@
+import numpy as np
+
+
+class LabelIndex:
+    """
+    Per-label voxel index of one or more non-overlapping label volumes.
+
+    All foreground voxels are sorted by label value once, so the voxels,
+    bounding box, size and centroid of a label can be looked up without
+    scanning the whole volume.
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        # flat voxel offsets fit in uint32 for volumes below 4G voxels
+        if np.prod(self.shape, dtype=np.int64) < np.iinfo(np.uint32).max:
+            self.voxel_dtype = np.uint32
+        else:
+            self.voxel_dtype = np.int64
+
+        # sorted unique label values (background excluded)
+        self.labels = np.zeros(0, dtype=np.int64)
+        # flat voxel offsets grouped by label, label i occupies
+        # voxels[starts[i]:starts[i + 1]]
+        self.voxels = np.zeros(0, dtype=self.voxel_dtype)
+        self.starts = np.zeros(1, dtype=np.int64)
+        # per-label statistics, one row per label
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.bbox_min = np.zeros((0, len(self.shape)), dtype=np.int64)
+        self.bbox_max = np.zeros((0, len(self.shape)), dtype=np.int64)
+        self.centroids = np.zeros((0, len(self.shape)), dtype=np.float64)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Build the index from label volumes of the same shape, e.g. the layers
+        of all classes. Labels are assumed not to overlap between volumes.
+        """
+        _, _, _, index = scan_label_volumes(arrays, summary=False)
+        return index
+
+    def build(self, values, voxels, tags=None):
+        """
+        Build the index from the label values of all foreground voxels and
+        their flat offsets into the volume. If tags are given, one per
+        voxel, returns the tag of the first voxel of every label.
+        """
+        # stable sort keeps the voxels of every label in raster order
+        order = np.argsort(values, kind='stable')
+        values = values[order]
+        self.voxels = np.asarray(voxels, dtype=self.voxel_dtype)[order]
+
+        # start of each label's run of voxels
+        is_start = np.ones(len(values), dtype=bool)
+        is_start[1:] = values[1:] != values[:-1]
+        starts = np.flatnonzero(is_start)
+        self.labels = values[starts].astype(np.int64)
+        self.starts = np.append(starts, len(values)).astype(np.int64)
+        self.counts = np.diff(self.starts)
+        label_tags = None if tags is None else tags[order[starts]]
+        del order
+
+        n_labels, n_dims = len(self.labels), len(self.shape)
+        self.bbox_min = np.zeros((n_labels, n_dims), dtype=np.int64)
+        self.bbox_max = np.zeros((n_labels, n_dims), dtype=np.int64)
+        self.centroids = np.zeros((n_labels, n_dims), dtype=np.float64)
+        if n_labels == 0:
+            return label_tags
+
+        # one axis at a time to keep only one coordinate array in memory
+        strides = np.cumprod((self.shape[1:] + (1,))[::-1])[::-1]
+        for axis, (size, stride) in enumerate(zip(self.shape, strides)):
+            coords = (self.voxels // stride) % size
+            self.bbox_min[:, axis] = np.minimum.reduceat(coords, starts)
+            self.bbox_max[:, axis] = np.maximum.reduceat(coords, starts)
+            self.centroids[:, axis] = np.add.reduceat(
+                coords, starts, dtype=np.float64) / self.counts
+        return label_tags
+
+    def __contains__(self, label):
+        return self._position(label) is not None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _position(self, label):
+        pos = np.searchsorted(self.labels, label)
+        if pos < len(self.labels) and self.labels[pos] == label:
+            return pos
+        return None
+
+    def _positions(self, labels):
+        # positions of many labels, and which of them are indexed
+        labels = np.asarray(labels, dtype=np.int64)
+        if len(self.labels) == 0:
+            return (np.zeros(len(labels), dtype=np.int64),
+                    np.zeros(len(labels), dtype=bool))
+        pos = np.minimum(np.searchsorted(self.labels, labels),
+                         len(self.labels) - 1)
+        return pos, self.labels[pos] == labels
+
+    def flat_voxels(self, label):
+        # flat offsets of all voxels of the label, empty if not indexed
+        pos = self._position(label)
+        if pos is None:
+            return np.zeros(0, dtype=self.voxel_dtype)
+        return self.voxels[self.starts[pos]:self.starts[pos + 1]]
+
+    def flat_voxels_of_many(self, labels):
+        """
+        Flat offsets of all voxels of many labels at once, and for every
+        voxel the position of its label in labels. Labels that are not
+        indexed have no voxels.
+        """
+        pos, indexed = self._positions(labels)
+        counts = np.zeros(len(pos), dtype=np.int64)
+        counts[indexed] = self.counts[pos[indexed]]
+        owners = np.repeat(np.arange(len(labels)), counts)
+        # offset of every voxel inside its label's run, added to the start
+        # of the run, gives its position in self.voxels
+        run_starts = np.cumsum(counts) - counts
+        offsets = np.arange(counts.sum()) - np.repeat(run_starts, counts) \
+            + np.repeat(self.starts[pos], counts)
+        return self.voxels[offsets], owners
+
+    def statistics_of(self, labels):
+        """
+        Sizes, centroids and bounding boxes (inclusive min and max corners)
+        of many labels at once. Labels that are not indexed have size 0,
+        NaN centroids and -1 corners.
+        """
+        pos, indexed = self._positions(labels)
+        pos = pos[indexed]
+        n_labels, n_dims = len(indexed), len(self.shape)
+
+        counts = np.zeros(n_labels, dtype=np.int64)
+        counts[indexed] = self.counts[pos]
+        centroids = np.full((n_labels, n_dims), np.nan)
+        centroids[indexed] = self.centroids[pos]
+        bbox_min = np.full((n_labels, n_dims), -1, dtype=np.int64)
+        bbox_min[indexed] = self.bbox_min[pos]
+        bbox_max = np.full((n_labels, n_dims), -1, dtype=np.int64)
+        bbox_max[indexed] = self.bbox_max[pos]
+        return counts, centroids, bbox_min, bbox_max
+
+    def labels_in_polygon(self, polygon, plane=None):
+        """
+        Labels whose centroid lies inside a polygon in the last two axes,
+        e.g. a box or lasso drawn in (y, x). If plane gives the coordinates
+        of the leading axes, e.g. the z of the drawn shape, only labels
+        whose bounding box crosses that plane are returned.
+        """
+        polygon = np.asarray(polygon, dtype=np.float64)[:, -2:]
+        inside = _points_in_polygon(self.centroids[:, -2:], polygon)
+        if plane is not None:
+            plane = np.asarray(plane)
+            lead = len(plane)
+            inside &= np.all((self.bbox_min[:, :lead] <= plane)
+                             & (plane <= self.bbox_max[:, :lead]), axis=1)
+        return self.labels[inside]
+
+    def voxels_of(self, label):
+        # coordinates of all voxels of the label, usable as an array index
+        return np.unravel_index(self.flat_voxels(label), self.shape)
+
+    def bounding_box(self, label):
+        # tuple of slices covering the label, None if not indexed
+        pos = self._position(label)
+        if pos is None:
+            return None
+        return tuple(slice(lo, hi + 1) for lo, hi in
+                     zip(self.bbox_min[pos], self.bbox_max[pos]))
+
+    def centroid(self, label):
+        pos = self._position(label)
+        if pos is None:
+            return None
+        return tuple(self.centroids[pos])
+
+    def size(self, label):
+        pos = self._position(label)
+        if pos is None:
+            return 0
+        return int(self.counts[pos])
+
+
+def _points_in_polygon(points, polygon):
+    # even-odd rule, vectorized over the points, looping over the edges
+    y, x = points[:, 0], points[:, 1]
+    inside = np.zeros(len(points), dtype=bool)
+    y0, x0 = polygon[-1]
+    for y1, x1 in polygon:
+        crosses = (y1 > y) != (y0 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x1 + (y - y1) * (x0 - x1) / (y0 - y1)
+        inside ^= crosses & (x < x_cross)
+        y0, x0 = y1, x1
+    return inside
+
+
+def _keep_result(steps, result):
+    # the same steps, the returned value is appended to result
+    result.append((yield from steps))
+
+
+def run_to_completion(steps):
+    """
+    Run a generator yielding its progress to the end, returns its result.
+    """
+    result = []
+    for _ in _keep_result(steps, result):
+        pass
+    return result[0]
+
+
+def report_progress(text, steps):
+    """
+    Pass on the (done, total) progress of a generator as (text, done,
+    total) and return its result, e.g.
+    result = yield from report_progress('Reading labels...', steps)
+    """
+    result = []
+    for done, total in _keep_result(steps, result):
+        yield text, done, total
+    return result[0]
+
+
+def scan_label_volumes(volumes, summary=True, index=True,
+                       planes_per_slab=16):
+    """
+    Read non-overlapping label volumes of the same shape in a single pass,
+    slab by slab along the first axis.
+
+    Returns the summary image with all labels in one array (None if
+    summary is False), the sorted label values found, the position of the
+    volume each label was found in and the LabelIndex of all labels (None
+    if index is False).
+    """
+    return run_to_completion(
+        iter_scan_label_volumes(volumes, summary, index, planes_per_slab))
+
+
+def iter_scan_label_volumes(volumes, summary=True, index=True,
+                            planes_per_slab=16):
+    """
+    Same as scan_label_volumes, as a generator yielding (planes read,
+    total planes) after every slab, for progress reporting and
+    cancellation. Its results are the return value of the generator.
+    """
+    volumes = list(volumes)
+    shape = tuple(volumes[0].shape)
+    label_index = LabelIndex(shape)
+    plane_size = int(np.prod(shape[1:], dtype=np.int64))
+
+    summary_image = None
+    if summary:
+        dtype = np.result_type(*[volume.dtype for volume in volumes])
+        summary_image = np.zeros(shape, dtype=dtype)
+
+    # label values and the volume they are in, per voxel if indexing,
+    # else per unique value of every slab
+    values, voxels, positions = [], [], []
+    for start in range(0, shape[0], planes_per_slab):
+        stop = min(start + planes_per_slab, shape[0])
+        # which voxels of the slab already belong to a volume
+        occupied = np.zeros((stop - start) * plane_size, dtype=bool)
+        for position, volume in enumerate(volumes):
+            slab = np.asarray(volume[start:stop]).reshape(-1)
+            flat = np.flatnonzero(slab)
+            slab_values = slab[flat]
+
+            # assert that segmentation labels do not overlap between classes
+            assert not occupied[flat].any(), \
+                "Segmentation labels overlap between classes!"
+            occupied[flat] = True
+
+            if summary_image is not None:
+                summary_image[start:stop].reshape(-1)[flat] = slab_values
+
+            if index:
+                values.append(slab_values)
+                voxels.append(flat.astype(label_index.voxel_dtype)
+                              + start * plane_size)
+            else:
+                slab_values = np.unique(slab_values)
+                values.append(slab_values)
+            positions.append(np.full(len(slab_values), position,
+                                     dtype=np.int16))
+        yield stop, shape[0]
+
+    values = np.concatenate(values) if values else np.zeros(0, np.int64)
+    positions = np.concatenate(positions) if positions \
+        else np.zeros(0, np.int16)
+    if not index:
+        labels, first = np.unique(values, return_index=True)
+        return (summary_image, labels.astype(np.int64), positions[first],
+                None)
+    volume_per_label = label_index.build(values, np.concatenate(voxels)
+                                         if voxels else values, positions)
+    return summary_image, label_index.labels, volume_per_label, label_index
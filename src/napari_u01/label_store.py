@@ -0,0 +1,124 @@
+import numpy as np
+
+# class position of labels that do not belong to any class
+NO_CLASS = -1
+
+
+class LabelClassStore:
+    """
+    Class of every label, stored as an array of positions in the class name
+    table, one per label in sorted order. Labels are found by binary search,
+    so memory does not depend on the label values and 32 or 64-bit label
+    ids cost nothing extra.
+
+    Behaves like the {label: {'class': class_name}, ...} dictionary it
+    replaces, so store[label]['class'] and store.items() still work.
+    """
+
+    def __init__(self, class_names, labels, class_index_per_label):
+        # small table of class names, e.g. ['neuron', 'neuron:excitatory']
+        self.class_names = list(class_names)
+        self._class_positions = {name: position for position, name
+                                 in enumerate(self.class_names)}
+        # sorted label values known to the store
+        self.labels = np.asarray(labels, dtype=np.int64)
+        # position of the class of each label in self.labels
+        self.class_index = np.asarray(class_index_per_label, dtype=np.int16)
+
+        # class and subclass part of every class name, for exports
+        split_names = [name.split(':') if ':' in name else [name, '']
+                       for name in self.class_names]
+        self._class_column = np.array(
+            [class_name for class_name, _ in split_names] + [''],
+            dtype=object)
+        self._subclass_column = np.array(
+            [subclass_name for _, subclass_name in split_names] + [''],
+            dtype=object)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __iter__(self):
+        return iter(self.labels.tolist())
+
+    def __contains__(self, label):
+        return self.position_of(label) is not None
+
+    def __getitem__(self, label):
+        return {'class': self.class_of(label)}
+
+    def items(self):
+        for label, class_name in zip(self.labels.tolist(),
+                                     self.class_name_per_label()):
+            yield label, {'class': class_name}
+
+    def position_of(self, label):
+        # position of the label in self.labels, None if not in the store
+        pos = np.searchsorted(self.labels, label)
+        if pos < len(self.labels) and self.labels[pos] == label:
+            return pos
+        return None
+
+    def positions_of(self, labels):
+        # positions of many labels, and which of them are in the store
+        labels = np.asarray(labels, dtype=np.int64)
+        if len(self.labels) == 0:
+            return (np.zeros(labels.shape, dtype=np.int64),
+                    np.zeros(labels.shape, dtype=bool))
+        pos = np.minimum(np.searchsorted(self.labels, labels),
+                         len(self.labels) - 1)
+        return pos, self.labels[pos] == labels
+
+    def class_position(self, class_name):
+        return self._class_positions[class_name]
+
+    def class_of(self, label):
+        pos = self.position_of(label)
+        if pos is None or self.class_index[pos] == NO_CLASS:
+            raise KeyError(label)
+        return self.class_names[self.class_index[pos]]
+
+    def set_class(self, label, class_name):
+        # reclassify one label, returns the name of its old class
+        old_class_name = self.class_of(label)
+        self.class_index[self.position_of(label)] = \
+            self._class_positions[class_name]
+        return old_class_name
+
+    def set_classes(self, labels, class_positions):
+        # reclassify many labels at once, returns their old class positions,
+        # labels that are not in the store are skipped
+        pos, known = self.positions_of(labels)
+        class_positions = np.broadcast_to(class_positions, pos.shape)
+        old_class_positions = self.classes_of(labels)
+        self.class_index[pos[known]] = class_positions[known]
+        return old_class_positions
+
+    def classes_of(self, labels):
+        # class positions of an array of labels, NO_CLASS if not in the store
+        pos, known = self.positions_of(labels)
+        classes = np.full(pos.shape, NO_CLASS, dtype=np.int16)
+        classes[known] = self.class_index[pos[known]]
+        return classes
+
+    def class_name_per_label(self):
+        # class name of every label in the order of self.labels
+        names = np.array(self.class_names + [''], dtype=object)
+        return names[self.class_index].tolist()
+
+    def labels_in_class(self, class_name):
+        position = self._class_positions[class_name]
+        return self.labels[self.class_index == position]
+
+    def counts(self):
+        # number of labels in every class
+        counts = np.bincount(self.class_index + 1,
+                             minlength=len(self.class_names) + 1)[1:]
+        return dict(zip(self.class_names, counts.tolist()))
+
+    def export_columns(self):
+        # label, class and subclass columns for all labels
+        classes = self.class_index
+        return (self.labels,
+                self._class_column[classes],
+                self._subclass_column[classes])
@@ -0,0 +1,60 @@
+from typing import TYPE_CHECKING
+
+from PyQt5 import QtCore
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QTableWidget, \
+    QTableWidgetItem, QPushButton, QHeaderView
+
+from .instrumentation import ENABLED, timings
+
+if TYPE_CHECKING:
+    import napari
+
+
+class LatencyWidget(QWidget):
+    """
+    Table of the recorded timings of the plugin's hot paths, refreshed
+    twice a second. Timing is enabled with NAPARI_U01_TIMING=1.
+    """
+    headers = ['Span', 'Count', 'Last (ms)', 'Mean (ms)', 'Max (ms)']
+
+    def __init__(self, napari_viewer: 'napari.viewer.Viewer' = None):
+        super().__init__()
+        layout = QVBoxLayout()
+
+        if not ENABLED:
+            layout.addWidget(QLabel(
+                'Timing is off, start napari with NAPARI_U01_TIMING=1\n'
+                'or NAPARI_U01_TIMING=<log file> to record it.'))
+
+        self.table = QTableWidget(0, len(self.headers))
+        self.table.setHorizontalHeaderLabels(self.headers)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(
+            0, QHeaderView.Stretch)
+        layout.addWidget(self.table)
+
+        self.clear_button = QPushButton('Clear')
+        self.clear_button.clicked.connect(self.clear)
+        layout.addWidget(self.clear_button)
+        self.setLayout(layout)
+
+        # spans are recorded from worker threads too, so the table polls
+        # the timings on the Qt thread instead of being notified
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        if ENABLED:
+            self.timer.start(500)
+
+    def refresh(self):
+        summary = timings.summary()
+        self.table.setRowCount(len(summary))
+        for row, (name, values) in enumerate(sorted(summary.items())):
+            count, last, mean, maximum = values
+            cells = [name, str(count), f'{last:.2f}', f'{mean:.2f}',
+                     f'{maximum:.2f}']
+            for column, text in enumerate(cells):
+                self.table.setItem(row, column, QTableWidgetItem(text))
+
+    def clear(self):
+        timings.clear()
+        self.refresh()
@@ -0,0 +1,102 @@
+import numpy as np
+
+
+class PointGridIndex:
+    """
+    Points binned in a regular grid of cells. The points of every cell are
+    one run of `order`, shuffled, so the first points of a run are a random
+    sample of the cell and decimating keeps the density even. Coordinates
+    are kept as float32 and must be finite.
+    """
+
+    def __init__(self, points, bins_per_axis=64, seed=0):
+        self.points = np.asarray(points, dtype=np.float32)
+        n, ndim = self.points.shape
+        if n > 0:
+            self.lo = self.points.min(axis=0).astype(np.float64)
+            self.hi = self.points.max(axis=0).astype(np.float64)
+        else:
+            self.lo = np.zeros(ndim)
+            self.hi = np.zeros(ndim)
+        self.bins = np.full(ndim, bins_per_axis, dtype=np.int64)
+        self.cell_size = np.maximum((self.hi - self.lo) / self.bins, 1e-6)
+
+        cells = self._cell_ids(self.points)
+        # sorting the shuffled points leaves every run in random order
+        rng = np.random.default_rng(seed)
+        shuffled = rng.permutation(n)
+        dtype = np.int32 if n < 2 ** 31 else np.int64
+        self.order = shuffled[np.argsort(cells[shuffled])].astype(dtype)
+        n_cells = int(np.prod(self.bins))
+        counts = np.bincount(cells, minlength=n_cells)
+        self.cell_offsets = rng.random(n_cells)
+        self.starts = np.concatenate([[0], np.cumsum(counts)])
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cell_coords(self, points, axis):
+        # cell along one axis, in float32 so the points and the query
+        # boxes are binned the same way
+        coords = points[:, axis] - np.float32(self.lo[axis])
+        coords /= np.float32(self.cell_size[axis])
+        np.clip(coords, 0, self.bins[axis] - 1, out=coords)
+        return coords.astype(np.int32)
+
+    def _cell_ids(self, points):
+        # flat cell of every point
+        cells = np.zeros(len(points), dtype=np.int32)
+        for axis in range(points.shape[1]):
+            cells *= self.bins[axis]
+            cells += self._cell_coords(points, axis)
+        return cells
+
+    def query(self, lo, hi, max_points=None):
+        """
+        Indices of the points with lo <= point <= hi (per axis, infinite
+        bounds allowed), at most about max_points of them: when there are
+        more, the same share of every cell is kept, so the same points are
+        returned while panning.
+        """
+        lo = np.maximum(np.asarray(lo, dtype=np.float64), self.lo)
+        hi = np.minimum(np.asarray(hi, dtype=np.float64), self.hi)
+        if len(self) == 0 or np.any(lo > hi):
+            return np.zeros(0, dtype=np.int64)
+
+        # cells overlapping the box, and which share of each is inside it
+        box = np.array([lo, hi], dtype=np.float32)
+        ranges = [np.arange(first, last + 1) for first, last
+                  in (self._cell_coords(box, axis) for axis in range(len(lo)))]
+        overlaps = []
+        for axis, cells in enumerate(ranges):
+            cell_lo = self.lo[axis] + cells * self.cell_size[axis]
+            inside = np.minimum(hi[axis], cell_lo + self.cell_size[axis]) \
+                - np.maximum(lo[axis], cell_lo)
+            overlaps.append(np.clip(inside / self.cell_size[axis], 0, 1))
+        cells = np.ravel_multi_index(
+            np.meshgrid(*ranges, indexing='ij'), self.bins).reshape(-1)
+        overlap = overlaps[0]
+        for axis_overlap in overlaps[1:]:
+            overlap = np.multiply.outer(overlap, axis_overlap)
+        overlap = overlap.reshape(-1)
+
+        starts = self.starts[cells]
+        take = self.starts[cells + 1] - starts
+        # points expected in the box if every cell is evenly filled
+        expected = np.sum(take * overlap)
+        if max_points is not None and expected > max_points:
+            # rounded by a fixed random offset per cell, so sparse cells
+            # keep their share of points on average
+            take = np.floor(take * (max_points / expected)
+                            + self.cell_offsets[cells]).astype(np.int64)
+
+        # the first `take` points of every run
+        total = int(take.sum())
+        run_offsets = np.cumsum(take) - take
+        positions = np.arange(total) \
+            + np.repeat(starts - run_offsets, take)
+        indices = self.order[positions].astype(np.int64)
+
+        points = self.points[indices]
+        inside = np.all((points >= lo) & (points <= hi), axis=1)
+        return indices[inside]
@@ -0,0 +1,111 @@
+import numpy as np
+
+# columns of a file with one point cloud, and with pairs of synapses
+# (e.g. the same synapse at two timepoints)
+POINT_COLUMNS = ['z', 'y', 'x']
+PAIR_COLUMNS = ['z1', 'y1', 'x1', 'z2', 'y2', 'x2']
+
+# rows read at once, a few tens of MB of float32 per chunk
+CHUNK_ROWS = 1_000_000
+
+
+def is_parquet(file_path):
+    return str(file_path).lower().endswith(('.parquet', '.pq'))
+
+
+def read_column_names(file_path):
+    # only the header (or the Parquet schema) is read
+    if is_parquet(file_path):
+        import pyarrow.parquet as pq
+        return list(pq.read_schema(file_path).names)
+    import pandas as pd
+    return list(pd.read_csv(file_path, nrows=0).columns)
+
+
+def _iter_csv_chunks(file_path, columns, chunk_rows):
+    try:
+        from pyarrow import csv
+    except ImportError:
+        csv = None
+
+    if csv is None:
+        # pandas' own parser, one chunk of rows at a time
+        import pandas as pd
+        reader = pd.read_csv(file_path, usecols=columns,
+                             dtype={column: np.float32 for column in columns},
+                             chunksize=chunk_rows)
+        for chunk in reader:
+            yield chunk[columns].to_numpy(dtype=np.float32)
+        return
+
+    # the pyarrow streaming reader is multithreaded and only converts
+    # the needed columns, straight to float32
+    reader = csv.open_csv(
+        file_path,
+        read_options=csv.ReadOptions(block_size=chunk_rows * 16),
+        convert_options=csv.ConvertOptions(
+            column_types={column: 'float32' for column in columns},
+            include_columns=columns))
+    for batch in reader:
+        yield _batch_to_array(batch, columns)
+
+
+def _iter_parquet_chunks(file_path, columns, chunk_rows):
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(file_path).iter_batches(
+            batch_size=chunk_rows, columns=columns):
+        yield _batch_to_array(batch, columns)
+
+
+def _batch_to_array(batch, columns):
+    chunk = np.empty((batch.num_rows, len(columns)), dtype=np.float32)
+    for i, column in enumerate(columns):
+        chunk[:, i] = batch.column(batch.schema.get_field_index(column)) \
+            .to_numpy(zero_copy_only=False)
+    return chunk
+
+
+def iter_point_chunks(file_path, columns, chunk_rows=CHUNK_ROWS):
+    """
+    Read the given columns of a CSV or Parquet file chunk by chunk, as
+    float32 arrays of shape (rows in chunk, len(columns)).
+    """
+    if is_parquet(file_path):
+        yield from _iter_parquet_chunks(file_path, columns, chunk_rows)
+    else:
+        yield from _iter_csv_chunks(file_path, columns, chunk_rows)
+
+
+def count_rows(file_path):
+    # rows of a Parquet file from its metadata, None for a CSV file
+    if is_parquet(file_path):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(file_path).metadata.num_rows
+    return None
+
+
+def read_points(file_path, columns, chunk_rows=CHUNK_ROWS):
+    # all rows of the columns as one float32 array, the chunks are copied
+    # into it as they are read, so only one copy of the points is kept
+    n_rows = count_rows(file_path)
+    points = np.empty((chunk_rows if n_rows is None else n_rows,
+                       len(columns)), dtype=np.float32)
+    filled = 0
+    for chunk in iter_point_chunks(file_path, columns, chunk_rows):
+        end = filled + len(chunk)
+        if end > len(points):
+            # the rows of a CSV file are not known up front, the array is
+            # grown in place by half its size
+            points.resize((max(end, len(points) * 3 // 2), len(columns)),
+                          refcheck=False)
+        points[filled:end] = chunk
+        filled = end
+    if filled < len(points):
+        points.resize((filled, len(columns)), refcheck=False)
+    return points
+
+
+def pair_colors(n_pairs, seed=None):
+    # one random RGB color per pair, shared by both of its points
+    rng = np.random.default_rng(seed)
+    return rng.random((n_pairs, 3), dtype=np.float32)
@@ -1,7 +1,12 @@
 # model
-import pandas as pd
-from numpy.random import uniform
+import numpy as np
 from napari.layers import Points
+from napari.utils.colormaps.standardize_color import transform_color
+
+from .instrumentation import logger
+from .synapse_io import POINT_COLUMNS, PAIR_COLUMNS, read_column_names, \
+    read_points, pair_colors
+from .synapse_index import PointGridIndex
 
 # view
 from PyQt5.QtWidgets import (QWidget,
@@ -12,44 +17,320 @@ from PyQt5.QtWidgets import (QWidget,
                              QSlider,
                              QColorDialog)
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QColor
 
 # widget
 from PyQt5.QtWidgets import QWidget
 
+# clouds with more points are indexed and only the points in view are shown,
+# at most this many
+MAX_SHOWN_POINTS = 1_000_000
+
 
 class SynapseModel:
     def __init__(self):
         self.point_layers = {}
         self.is_paired = {}
+        # SynapsePairs shared by the two layers of paired synapses
+        self.pairs = {}
+        # LevelOfDetail of the layers showing part of a large cloud
+        self.level_of_detail = {}
 
-    def add_points_layer(self, layer_name, point_layer, is_paired=False):
+    def add_points_layer(self, layer_name, point_layer, pairs=None,
+                         level_of_detail=None):
         self.point_layers[layer_name] = point_layer
-        self.is_paired[layer_name] = is_paired
+        self.is_paired[layer_name] = pairs is not None
+        if pairs is not None:
+            self.pairs[layer_name] = pairs
+        if level_of_detail is not None:
+            self.level_of_detail[layer_name] = level_of_detail
+
+    def remove_points_layer(self, point_layer):
+        # forget a layer removed from the viewer, it may have been renamed
+        for layer_name, layer in list(self.point_layers.items()):
+            if layer is not point_layer:
+                continue
+            del self.point_layers[layer_name]
+            del self.is_paired[layer_name]
+            self.level_of_detail.pop(layer_name, None)
+            pairs = self.pairs.pop(layer_name, None)
+            if pairs is not None:
+                pairs.remove_layer(layer)
+
+    def unique_pairs(self):
+        # every SynapsePairs once, it is shared by two layers
+        return list({id(pairs): pairs
+                     for pairs in self.pairs.values()}.values())
 
     @staticmethod
     def get_points(file_path: str):
-        data = pd.read_csv(file_path)
-        if data is None:
-            return None
+        # CSV or Parquet, only the coordinate columns are read, in chunks
+        columns = set(read_column_names(file_path))
+
+        # if the file has the columns z, y, x
+        if columns >= set(POINT_COLUMNS):
+            logger.debug("one point cloud")
+            return read_points(file_path, POINT_COLUMNS)
 
-        # if the csv file has the columns z, y, x
-        if set(data.columns) >= {'z', 'y', 'x'}:
-            print("one point cloud")
-            return data[['z', 'y', 'x']].values
-        
-        # if the csv file has the columns z1, y1, x1, z2, y2, x2
-        elif set(data.columns) >= {'z1', 'y1', 'x1', 'z2', 'y2', 'x2'}:
-            print("two point clouds")
-            # create a list of random colors the length of the number of points
-            colors = [[uniform(), uniform(), uniform()] for _ in range(len(data))]
-            return data[['z1', 'y1', 'x1']].values, data[['z2', 'y2', 'x2']].values, colors
+        # if the file has the columns z1, y1, x1, z2, y2, x2
+        elif columns >= set(PAIR_COLUMNS):
+            logger.debug("two point clouds")
+            zyx = read_points(file_path, PAIR_COLUMNS)
+            # a random color per pair of points
+            colors = pair_colors(len(zyx))
+            return zyx[:, :3], zyx[:, 3:], colors
         else:
-            print("invalid csv file")
+            logger.warning('Invalid synapse file %s, it needs the columns '
+                           'z, y, x or z1, y1, x1, z2, y2, x2.', file_path)
             return None
 
 
+def _outline(layer):
+    # napari 0.4 calls the outline of points edge, later versions border
+    return 'border' if hasattr(type(layer), 'border_color') else 'edge'
+
+
+def _set_if_changed(layer, name, value):
+    # set a style of all points, the layer is only written to if one of
+    # its points differs
+    values = np.asarray(getattr(layer, name))
+    target = transform_color(value)[0] if name.endswith('color') else value
+    if len(values) > 0 and not np.allclose(values, target):
+        setattr(layer, name, value)
+
+
+def _set_sizes(layer, rows, sizes):
+    # napari 0.4 keeps a size per point and dimension, later one per point
+    all_sizes = np.array(layer.size)
+    all_sizes[rows] = sizes[:, None] if all_sizes.ndim == 2 else sizes
+    layer.size = all_sizes
+
+
+class SynapsePairs:
+    """
+    Color, size and visibility of paired synapses, one value per pair,
+    shared by the layers of both timepoints. The points of a layer are
+    mapped to pairs by an index array (every pair in order, or the pairs
+    its LevelOfDetail shows), so a change to some pairs only rewrites
+    their points, and a selection is mirrored on the partner layer.
+    """
+
+    def __init__(self, colors, size=3):
+        self.colors = np.asarray(colors, dtype=np.float32)
+        self.sizes = np.full(len(self.colors), size, dtype=np.float32)
+        self.shown = np.ones(len(self.colors), dtype=bool)
+        # [(layer, LevelOfDetail or None)] of both timepoints
+        self.layers = []
+        # layer whose selection and current style apply to the pairs
+        self.active = None
+        self._selected = {}
+        self._mirroring = False
+        # highlight callback of every layer, {id(layer): callback}
+        self._callbacks = {}
+
+    def __len__(self):
+        return len(self.colors)
+
+    def add_layer(self, layer, level_of_detail=None):
+        self.layers.append((layer, level_of_detail))
+        if self.active is None:
+            self.active = layer
+
+        def callback(event):
+            self.on_selection(layer)
+        self._callbacks[id(layer)] = callback
+        layer.events.highlight.connect(callback)
+
+    def remove_layer(self, layer):
+        self.layers = [(member, level_of_detail) for member, level_of_detail
+                       in self.layers if member is not layer]
+        layer.events.highlight.disconnect(self._callbacks.pop(id(layer)))
+        self._selected.pop(id(layer), None)
+        if self.active is layer:
+            self.active = self.layers[0][0] if self.layers else None
+
+    def pair_ids(self, layer):
+        # pair of every point of the layer
+        for member, level_of_detail in self.layers:
+            if member is layer and level_of_detail is not None:
+                return level_of_detail.shown
+        return np.arange(len(layer.data))
+
+    def selected_pairs(self, layer):
+        rows = np.fromiter(layer.selected_data, dtype=np.int64)
+        return self.pair_ids(layer)[rows]
+
+    def apply(self, layer):
+        # the whole style of the layer, e.g. once its points were replaced
+        ids = self.pair_ids(layer)
+        if len(ids) == 0:
+            return
+        _set_sizes(layer, slice(None), self.sizes[ids])
+        layer.face_color = self.colors[ids]
+        layer.shown = self.shown[ids]
+
+    def update(self, pairs, size=None, color=None, shown=None):
+        """
+        Set the size, RGB color or visibility of some pairs, and rewrite
+        the points of the pairs that changed in both layers.
+        """
+        changed = {}
+        for name, values, value in [('size', self.sizes, size),
+                                    ('color', self.colors, color),
+                                    ('shown', self.shown, shown)]:
+            if value is None:
+                continue
+            differs = values[pairs] != value
+            if differs.ndim == 2:
+                differs = differs.any(axis=1)
+            mask = np.zeros(len(self), dtype=bool)
+            mask[pairs] = differs
+            if mask.any():
+                values[pairs] = value
+                changed[name] = mask
+
+        for layer, _ in self.layers:
+            ids = self.pair_ids(layer)
+            for name, mask in changed.items():
+                rows = np.flatnonzero(mask[ids])
+                if len(rows) == 0:
+                    continue
+                if name == 'size':
+                    _set_sizes(layer, rows, self.sizes[ids[rows]])
+                elif name == 'color':
+                    colors = np.array(layer.face_color)
+                    colors[rows, :3] = self.colors[ids[rows]]
+                    layer.face_color = colors
+                else:
+                    shown_points = np.array(layer.shown)
+                    shown_points[rows] = self.shown[ids[rows]]
+                    layer.shown = shown_points
+
+    def apply_current_style(self):
+        # current size of the active layer to the pairs selected in it,
+        # or to all pairs, its current face color only to the selected ones
+        layer = self.active
+        if layer is None:
+            return
+        pairs = self.selected_pairs(layer)
+        size = float(np.mean(layer.current_size))
+        if len(pairs) == 0:
+            self.update(slice(None), size=size)
+        else:
+            color = transform_color(layer.current_face_color)[0, :3]
+            self.update(pairs, size=size, color=color)
+
+    def on_selection(self, layer):
+        # highlight also changes when hovering, only act on new selections
+        selected = set(layer.selected_data)
+        if self._mirroring or selected == self._selected.get(id(layer)):
+            return
+        self._selected[id(layer)] = selected
+        if selected:
+            self.active = layer
+
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.selected_pairs(layer)] = True
+        self._mirroring = True
+        try:
+            for partner, _ in self.layers:
+                if partner is layer:
+                    continue
+                rows = np.flatnonzero(mask[self.pair_ids(partner)])
+                partner.selected_data = set(rows.tolist())
+                self._selected[id(partner)] = set(partner.selected_data)
+        finally:
+            self._mirroring = False
+
+
+def canvas_size(viewer):
+    # (height, width) in pixels, viewer._canvas_size in napari 0.4,
+    # viewer.canvas.size later, None if unknown
+    size = getattr(viewer, '_canvas_size', None)
+    if size is None:
+        size = getattr(getattr(viewer, 'canvas', None), 'size', None)
+    return size
+
+
+class LevelOfDetail:
+    """
+    Shows the points of a large cloud that are in the current view and
+    slice in a Points layer, at most max_points of them, picked through a
+    PointGridIndex. In 3D the whole cloud is shown, decimated.
+    """
+
+    def __init__(self, viewer, points, face_color=None,
+                 max_points=MAX_SHOWN_POINTS):
+        self.viewer = viewer
+        self.index = PointGridIndex(points)
+        self.face_color = face_color
+        self.max_points = max_points
+        self.layer = None
+        # SynapsePairs styling the points of paired synapses
+        self.pairs = None
+        ndim = points.shape[1]
+        self.shown = self.index.query(np.full(ndim, -np.inf),
+                                      np.full(ndim, np.inf), max_points)
+
+    def shown_points(self):
+        return self.index.points[self.shown]
+
+    def shown_colors(self):
+        return None if self.face_color is None else self.face_color[self.shown]
+
+    def view_box(self):
+        # (lo, hi) in data coordinates of what the canvas shows
+        ndim = self.layer.ndim
+        lo = np.full(ndim, -np.inf)
+        hi = np.full(ndim, np.inf)
+        dims = self.viewer.dims
+        if dims.ndisplay == 3:
+            return lo, hi
+
+        # points are shown within half a step of the slice
+        point = np.asarray(dims.point, dtype=np.float64)
+        data_point = np.asarray(self.layer.world_to_data(point))[-ndim:]
+        lo[:] = data_point - 0.5
+        hi[:] = data_point + 0.5
+
+        # displayed axes of the layer, it may have fewer dims than the world
+        offset = len(point) - ndim
+        displayed = [axis for axis in dims.displayed if axis >= offset]
+        axes = [axis - offset for axis in displayed]
+        size = canvas_size(self.viewer)
+        if size is None:
+            lo[axes] = -np.inf
+            hi[axes] = np.inf
+            return lo, hi
+
+        # a square around the camera center, as large as the longest side
+        # of the canvas
+        half = max(size) / 2 / self.viewer.camera.zoom
+        center = np.asarray(self.viewer.camera.center)[-len(dims.displayed):]
+        center = center[len(dims.displayed) - len(displayed):]
+        corners = np.array([point, point])
+        corners[0, displayed] = center - half
+        corners[1, displayed] = center + half
+        corners = np.array([self.layer.world_to_data(corner)
+                            for corner in corners])[:, -ndim:]
+        lo[axes] = corners[:, axes].min(axis=0)
+        hi[axes] = corners[:, axes].max(axis=0)
+        return lo, hi
+
+    def refresh(self):
+        lo, hi = self.view_box()
+        shown = self.index.query(lo, hi, self.max_points)
+        if np.array_equal(shown, self.shown):
+            return
+        self.shown = shown
+        self.layer.data = self.shown_points()
+        if self.pairs is not None:
+            self.pairs.apply(self.layer)
+        elif self.face_color is not None and len(shown) > 0:
+            self.layer.face_color = self.shown_colors()
+
+
 class SynapseView(QWidget):
     def __init__(self, viewer):
         super().__init__()
@@ -64,11 +345,18 @@ class SynapseView(QWidget):
         self.refresh_button = QPushButton("Refresh points")
         self.layout.addWidget(self.refresh_button)
 
+        self.hide_pairs_button = QPushButton("Hide selected pairs")
+        self.layout.addWidget(self.hide_pairs_button)
+
+        self.show_pairs_button = QPushButton("Show all pairs")
+        self.layout.addWidget(self.show_pairs_button)
+
     def get_csv_path(self):
         options = QFileDialog.Options()
         options |= QFileDialog.ReadOnly
         file_path, _ = QFileDialog.getOpenFileName(
-            self, "Load CSV", "", "CSV Files (*.csv);;All Files (*)",
+            self, "Load CSV", "",
+            "Synapse Files (*.csv *.parquet);;All Files (*)",
             options=options)
         return file_path
 
@@ -81,6 +369,37 @@ class SynapseController:
 
         self.view.load_csv_button.clicked.connect(self.load_csv_and_display_points)
         self.view.refresh_button.clicked.connect(self.update_points_properties)
+        self.view.hide_pairs_button.clicked.connect(self.hide_selected_pairs)
+        self.view.show_pairs_button.clicked.connect(self.show_all_pairs)
+
+        # owned by the view, so it goes away with the widget
+        self.refresh_timer = QTimer(self.view)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(100)
+        self.refresh_timer.timeout.connect(self.refresh_shown_points)
+        viewer = self.view.viewer
+        if viewer is not None:
+            for event in self.viewer_events():
+                event.connect(self.schedule_refresh)
+            viewer.layers.events.removed.connect(self.on_layer_removed)
+
+    def viewer_events(self):
+        # events of the viewer that change what part of the points is shown
+        viewer = self.view.viewer
+        return [viewer.camera.events.zoom, viewer.camera.events.center,
+                viewer.dims.events.current_step, viewer.dims.events.ndisplay]
+
+    def close(self):
+        # the viewer outlives the widget, its events are disconnected
+        self.refresh_timer.stop()
+        if self.view.viewer is not None:
+            for event in self.viewer_events():
+                event.disconnect(self.schedule_refresh)
+            self.view.viewer.layers.events.removed.disconnect(
+                self.on_layer_removed)
+
+    def on_layer_removed(self, event):
+        self.model.remove_points_layer(event.value)
 
     def load_csv_and_display_points(self):
         # TODO : create FixedPointsLayer class and use it here instead of Points layer class
@@ -90,36 +409,86 @@ class SynapseController:
 
             if points is not None:
                 # if it is one point cloud
-                print(type(points))
+                logger.debug(type(points))
                 # if there are two point clouds (paired synapses)
                 if isinstance(points, tuple):
                     zyx1, zyx2, colors = points
                     idx = len(self.model.point_layers)
+                    # both layers share the colors, sizes and visibility
+                    pairs = SynapsePairs(colors)
                     # actually add the points to the viewer
-                    layer_name = f"synapses_paired_{idx}_tp1"
-                    point_layer = self.view.viewer.add_points(zyx1, name=layer_name, size=3, face_color=colors)
-                    self.model.add_points_layer(layer_name, point_layer, is_paired=True)
-
-                    # actually add the points to the viewer
-                    layer_name = f"synapses_paired_{idx}_tp2"
-                    point_layer = self.view.viewer.add_points(zyx2, name=layer_name, size=3, face_color=colors)
-                    self.model.add_points_layer(layer_name, point_layer, is_paired=True)
+                    self.add_points(f"synapses_paired_{idx}_tp1", zyx1,
+                                    pairs=pairs)
+                    self.add_points(f"synapses_paired_{idx}_tp2", zyx2,
+                                    pairs=pairs)
                 else:
                     # actually add the points to the viewer
-                    layer_name = f"synapses_{len(self.model.point_layers)}"
-                    point_layer = self.view.viewer.add_points(points, name=layer_name, size=3)
-                    self.model.add_points_layer(layer_name, point_layer)
+                    self.add_points(f"synapses_{len(self.model.point_layers)}",
+                                    points)
+
+    def add_points(self, layer_name, zyx, colors=None, pairs=None):
+        viewer = self.view.viewer
+        if pairs is not None:
+            colors = pairs.colors
+        kwargs = {} if colors is None else {'face_color': colors}
+        if len(zyx) <= MAX_SHOWN_POINTS:
+            point_layer = viewer.add_points(zyx, name=layer_name, size=3,
+                                            **kwargs)
+            self.model.add_points_layer(layer_name, point_layer, pairs)
+            if pairs is not None:
+                pairs.add_layer(point_layer)
+            return
+
+        # too many points to show at once, show the ones in view
+        level_of_detail = LevelOfDetail(viewer, zyx, colors)
+        if colors is not None:
+            kwargs['face_color'] = level_of_detail.shown_colors()
+        point_layer = viewer.add_points(level_of_detail.shown_points(),
+                                        name=layer_name, size=3, **kwargs)
+        level_of_detail.layer = point_layer
+        self.model.add_points_layer(layer_name, point_layer, pairs,
+                                    level_of_detail)
+        if pairs is not None:
+            level_of_detail.pairs = pairs
+            pairs.add_layer(point_layer, level_of_detail)
+        level_of_detail.refresh()
+
+    def schedule_refresh(self, event=None):
+        # camera and dims events come in bursts while navigating,
+        # refresh once they settle
+        self.refresh_timer.start()
+
+    def refresh_shown_points(self):
+        for level_of_detail in self.model.level_of_detail.values():
+            level_of_detail.refresh()
 
     def update_points_properties(self):
         for layer_name, point_layer in self.model.point_layers.items():
-            # Update the point layer's properties
-            point_layer.size = point_layer.current_size
-            point_layer.edge_color = point_layer.current_edge_color
-            point_layer.edge_width = point_layer.current_edge_width
-            # do not update face color if it is a paired synapse layer
-            # because the face color is the same for each pair of paired points
+            # Update the point layer's properties, if they changed
+            outline = _outline(point_layer)
+            for name in [f'{outline}_color', f'{outline}_width']:
+                _set_if_changed(point_layer, name,
+                                getattr(point_layer, f'current_{name}'))
+            # paired synapse layers share a size and face color per pair,
+            # set below for the changed pairs only
             if not self.model.is_paired[layer_name]:
-                point_layer.face_color = point_layer.current_face_color
+                _set_if_changed(point_layer, 'size',
+                                point_layer.current_size)
+                _set_if_changed(point_layer, 'face_color',
+                                point_layer.current_face_color)
+        for pairs in self.model.unique_pairs():
+            pairs.apply_current_style()
+
+    def hide_selected_pairs(self):
+        # hides both points of the pairs selected in either layer
+        for pairs in self.model.unique_pairs():
+            selected = pairs.selected_pairs(pairs.active)
+            if len(selected) > 0:
+                pairs.update(selected, shown=False)
+
+    def show_all_pairs(self):
+        for pairs in self.model.unique_pairs():
+            pairs.update(slice(None), shown=True)
 
 # TODO : turn into a reader https://napari.org/stable/plugins/guides.html
 class SynapseWidget(QWidget):
@@ -133,3 +502,7 @@ class SynapseWidget(QWidget):
         layout = QVBoxLayout()
         layout.addWidget(self.view)
         self.setLayout(layout)
+
+    def closeEvent(self, event):
+        self.controller.close()
+        super().closeEvent(event)
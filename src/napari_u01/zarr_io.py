@@ -0,0 +1,156 @@
+import re
+
+import numpy as np
+import tifffile as tif
+
+
+def is_zarr_path(path):
+    # chunked stores are directories ending in .zarr or .n5
+    return str(path).rstrip('/\\').lower().endswith(('.zarr', '.n5'))
+
+
+def _open_group(path):
+    import zarr
+    if str(path).rstrip('/\\').lower().endswith('.n5'):
+        # N5 is read through zarr's N5Store, only available in zarr 2
+        n5_store = getattr(zarr, 'N5Store', None)
+        if n5_store is None:
+            raise ImportError(
+                f'Reading N5 needs zarr 2, zarr {zarr.__version__} is '
+                f'installed. Convert {path} to OME-Zarr, or install '
+                f'"zarr<3".')
+        return zarr.open_group(n5_store(path), mode='r')
+    return zarr.open_group(path, mode='r')
+
+
+def _natural_key(name):
+    # '2' < '10' and 's2' < 's10'
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r'(\d+)', name)]
+
+
+def open_multiscale(path, max_levels=None):
+    """
+    Open a chunked multiscale image as a list of dask arrays, full
+    resolution first, at most max_levels of them.
+
+    The levels are read from the OME-Zarr 'multiscales' metadata, or, for
+    stores without it (e.g. N5 pyramids with s0, s1, ... datasets), from
+    the names of the arrays in the group. A single array is returned as a
+    list of one level.
+    """
+    import dask.array as da
+    import zarr
+
+    try:
+        group = _open_group(path)
+    except (zarr.errors.ContainsArrayError, ValueError, TypeError):
+        return [da.from_zarr(zarr.open_array(path, mode='r'))]
+
+    multiscales = group.attrs.get('multiscales')
+    if multiscales:
+        level_paths = [dataset['path']
+                       for dataset in multiscales[0]['datasets']]
+    else:
+        level_paths = sorted(group.array_keys(), key=_natural_key)
+    return [da.from_zarr(group[level_path])
+            for level_path in level_paths[:max_levels]]
+
+
+def downsample(data, labels=False):
+    """
+    Halve the last two (y, x) axes of a dask array. Images are averaged,
+    labels are subsampled so label values are kept.
+    """
+    import dask.array as da
+
+    factors = {data.ndim - 2: 2, data.ndim - 1: 2}
+    if labels:
+        return data[(Ellipsis, slice(None, None, 2), slice(None, None, 2))]
+    return da.coarsen(np.mean, data, factors, trim_excess=True).astype(
+        data.dtype)
+
+
+def write_multiscale(data, path, labels=False, n_levels=None,
+                     plane_chunk=1024, axes='zyx'):
+    """
+    Write an array as an OME-Zarr multiscale pyramid.
+
+    Every chunk holds part of a single plane, (1, plane_chunk, plane_chunk)
+    for 3D data, so showing one plane reads as few bytes as possible. Only
+    y and x are downsampled, so every level has all planes. Levels are
+    added until the plane fits in one chunk, or n_levels is reached.
+    """
+    import dask.array as da
+    import zarr
+
+    if not isinstance(data, da.Array):
+        data = da.from_array(data)
+    chunks = (1,) * (data.ndim - 2) + (plane_chunk, plane_chunk)
+
+    datasets = []
+    level = data
+    while True:
+        level_path = str(len(datasets))
+        level.rechunk(tuple(min(c, s) for c, s in zip(chunks, level.shape))
+                      ).to_zarr(path, component=level_path, overwrite=True)
+        factor = 2 ** len(datasets)
+        scale = [1.0] * (data.ndim - 2) + [float(factor)] * 2
+        datasets.append({
+            'path': level_path,
+            'coordinateTransformations': [{'type': 'scale',
+                                           'scale': scale}]})
+
+        fits_in_chunk = max(level.shape[-2:]) <= plane_chunk
+        if (n_levels is not None and len(datasets) >= n_levels) \
+                or (n_levels is None and fits_in_chunk) \
+                or min(level.shape[-2:]) < 2:
+            break
+        # read the written level back, so the next one does not
+        # recompute the whole chain of downsampling from the source
+        level = downsample(da.from_zarr(path, component=level_path),
+                           labels=labels)
+
+    space_axes = axes[-data.ndim:]
+    group = zarr.open_group(path, mode='a')
+    group.attrs['multiscales'] = [{
+        'version': '0.4',
+        'axes': [{'name': axis, 'type': 'space'} for axis in space_axes],
+        'datasets': datasets}]
+    return path
+
+
+def convert_tiff_to_zarr(tiff_path, zarr_path, labels=False, **kwargs):
+    """
+    Convert a TIFF stack to an OME-Zarr multiscale pyramid. The TIFF is
+    read plane by plane, so it does not need to fit in memory.
+    Keyword arguments are passed to write_multiscale.
+    """
+    import dask.array as da
+
+    try:
+        data = da.from_array(tif.memmap(tiff_path, mode='r'))
+    except ValueError:
+        # compressed TIFFs can not be memory mapped, they are read chunk
+        # by chunk while the store is open
+        with tif.imread(tiff_path, aszarr=True) as store:
+            return write_multiscale(da.from_zarr(store), zarr_path,
+                                    labels=labels, **kwargs)
+    return write_multiscale(data, zarr_path, labels=labels, **kwargs)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Convert a TIFF stack to an OME-Zarr pyramid.')
+    parser.add_argument('tiff_path')
+    parser.add_argument('zarr_path')
+    parser.add_argument('--labels', action='store_true',
+                        help='subsample instead of averaging')
+    parser.add_argument('--levels', type=int, default=None)
+    parser.add_argument('--chunk', type=int, default=1024,
+                        help='chunk size in y and x')
+    args = parser.parse_args()
+    convert_tiff_to_zarr(args.tiff_path, args.zarr_path, labels=args.labels,
+                         n_levels=args.levels, plane_chunk=args.chunk)